@@ -0,0 +1,121 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+## Benchmark of the startup: import of CDSupdate and 'cdsupdate --help', each
+## case in a new interpreter, and the load of the metadata of the variables
+## (registry, csv sources, and the pandas reader of the previous versions,
+## including the import of pandas). Run with:
+##
+##   python benchmarks/bench_import.py [nrep]
+##
+## Print the median and the maximal wall time, and for the startup the heavy
+## packages imported (none is expected).
+
+##############
+## Packages ##
+##############
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+
+###############
+## Variables ##
+###############
+
+heavy = ["xarray","pandas","netCDF4","cftime","cdsapi","zarr","fsspec","kerchunk"]
+
+cases = [
+    ( "python"        , "pass" ),
+    ( "numpy"         , "import numpy" ),
+    ( "import"        , "import CDSupdate" ),
+    ( "help"          , "from CDSupdate.__exec import start_cdsupdate ; start_cdsupdate(['--help'])" ),
+]
+
+
+###############################
+## Reference (pandas) reader ##
+###############################
+
+ref_code = """
+import os
+import pandas as pd
+from CDSupdate.__CVarsParams import data_path
+tab   = pd.read_csv( os.path.join( data_path , "ERA5-name.csv" ) , keep_default_na = False )
+desc  = {}
+for cvar in tab["AMIP"].values.tolist():
+	try:
+		with open( os.path.join( data_path , f"ERA5-{cvar}-description.txt" ) , "r" ) as f:
+			desc[cvar] = "".join(f.readlines()).replace("\\n","")
+	except:
+		desc[cvar] = ""
+areas = pd.read_csv( os.path.join( data_path , "areas.csv" ) )
+"""
+
+
+###############
+## Functions ##
+###############
+
+def measure_metadata( code ):##{{{
+	
+	## Wall time of the load of the metadata, after the import of CDSupdate
+	script = f"import time\nimport CDSupdate\nt0 = time.perf_counter()\n{code}\nprint( time.perf_counter() - t0 )"
+	out    = subprocess.run( [sys.executable,"-c",script] , stdin = subprocess.DEVNULL , capture_output = True , text = True )
+	return float(out.stdout.strip().split("\n")[-1])
+##}}}
+
+def measure( code ):##{{{
+	
+	## Wall time of the interpreter running code, and the heavy packages
+	## imported
+	script = f"{code}\nimport sys\nprint( ','.join( m for m in {heavy!r} if m in sys.modules ) , file = sys.stderr )"
+	env    = dict( os.environ , TERM = "dumb" )
+	t0     = time.perf_counter()
+	out    = subprocess.run( [sys.executable,"-c",script] , stdin = subprocess.DEVNULL , stdout = subprocess.DEVNULL , stderr = subprocess.PIPE , env = env , text = True )
+	t1     = time.perf_counter()
+	return t1 - t0,out.stderr.strip().split("\n")[-1]
+##}}}
+
+
+##########
+## main ##
+##########
+
+if __name__ == "__main__":
+	
+	nrep = 10
+	if len(sys.argv) > 1:
+		nrep = int(sys.argv[1])
+	
+	print( f"Wall time of a new interpreter, {nrep} runs" )
+	print( "{:14} {:>12} {:>12}  {}".format( "case" , "median (s)" , "max (s)" , "heavy packages" ) )
+	for name,code in cases:
+		res   = [ measure(code) for _ in range(nrep) ]
+		times = [ t for t,_ in res ]
+		print( "{:14} {:>12.3f} {:>12.3f}  {}".format( name , statistics.median(times) , max(times) , res[-1][1] or "-" ) )
+	
+	print( "" )
+	print( "Load of the metadata of the variables and areas" )
+	print( "{:14} {:>12} {:>12}".format( "case" , "median (s)" , "max (s)" ) )
+	for name,code in [ ( "registry" , "from CDSupdate.__CVarsParams import load_registry ; load_registry()" ) , ( "csv sources" , "from CDSupdate.__CVarsParams import compile_registry ; compile_registry()" ) , ( "pandas (ref)" , ref_code ) ]:
+		times = [ measure_metadata(code) for _ in range(nrep) ]
+		print( "{:14} {:>12.4f} {:>12.4f}".format( name , statistics.median(times) , max(times) ) )
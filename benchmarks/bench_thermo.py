@@ -0,0 +1,164 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+## Benchmark of the thermodynamics kernels against the xarray formulas used
+## before (CDSupdate <= 2.3.1). Run with:
+##
+##   python benchmarks/bench_thermo.py [ntime] [nlat] [nlon]
+##
+## For each variable, print the runtime, the peak of memory allocated (from
+## tracemalloc, numpy allocations are tracked) and the maximal difference.
+
+##############
+## Packages ##
+##############
+
+import sys
+import time
+import tracemalloc
+
+import numpy  as np
+import xarray as xr
+
+from CDSupdate.__thermo import blockwise
+from CDSupdate.__thermo import wind_speed
+from CDSupdate.__thermo import relative_humidity
+from CDSupdate.__thermo import specific_humidity
+from CDSupdate.__thermo import upper_bound_tas
+from CDSupdate.__thermo import heat_index_noaa
+from CDSupdate.__thermo import heat_index_blazejczyk
+
+
+###################################
+## Reference (xarray) formulas ##
+###################################
+
+def ref_sfcWind( uas , vas ):##{{{
+	return np.sqrt( uas**2 + vas**2 )
+##}}}
+
+def ref_hurs( dptas , tas ):##{{{
+	eD = 6.1078 * np.exp( 17.1 * ( dptas - 273.15 ) / ( 235 + dptas - 273.15 ) )
+	eT = 6.1078 * np.exp( 17.1 * ( tas   - 273.15 ) / ( 235 + tas   - 273.15 ) )
+	return eD / eT * 100
+##}}}
+
+def ref_huss( dptas , ps ):##{{{
+	rdry = 287.0597
+	rvap = 461.5250
+	a1   = 611.21
+	a3   = 17.502
+	a4   = 32.19
+	T0   = 273.16
+	E    = a1 * np.exp( a3 * ( dptas - T0 ) / ( dptas - a4 ) )
+	return E * ( rdry / rvap ) / ( ps - ( E * ( 1 - rdry / rvap ) ) )
+##}}}
+
+def ref_ubtas( ta500 , zg500 , huss , orog ):##{{{
+	Lv      = 2.5008 * 1e6
+	cp      = 1004.7090
+	g       = 9.80665
+	epsilon = 0.0180153 / 0.028964
+	hus_sat = epsilon * 6.11 * np.exp( Lv / 461.52 * ( 1 / 273.15 - 1 / ta500 ) ) / 500
+	return ta500 + Lv / cp * (hus_sat - huss) + g / cp * (zg500 - orog)
+##}}}
+
+def ref_HI_noaa( tas , hurs ):##{{{
+	T = (tas - 273.15) * 9. / 5. + 32
+	H = hurs.round(0)
+	HI = -42.379 + 2.04901523 * T + 10.14333127 * H + -0.22475541 * T * H + -0.00683783 * T**2 + -0.05481717 * H**2 + 0.00122874 * T**2 * H + 0.00085282 * T * H**2 + -0.00000199 * T**2 * H**2
+	HIA1 = ( 13 - H ) /  4 * np.sqrt( ( 17 - np.abs( T - 95 ) ) / 17 )
+	HIA2 = ( H - 85 ) / 10 * ( ( 87 - T ) / 5 )
+	HIL  = 0.5 * ( T + 61 + 1.2 * (T - 68) + 0.094 * H )
+	HI = HI.where( ~( ( H < 13. ) & (T > 80.) & (T < 112) ) , HI - HIA1 )
+	HI = HI.where( ~( ( H > 85. ) & (T > 80.) & (T <  87) ) , HI + HIA2 )
+	HI = HI.where( HIL > 80. , HIL )
+	return (HI - 32.) * 5. / 9. + 273.15
+##}}}
+
+def ref_HI_blazejczyk( tas , hurs ):##{{{
+	T  = tas - 273.15
+	H  = hurs.round(0)
+	HI = 273.15 + -8.784695 + 1.61139411 * T + 2.338549 * H + -0.14611605 * T * H + -1.2308094e-2 * T**2 + -1.6424828e-2 * H**2 + 2.211732e-3 * T**2 * H + 7.2546e-4 * T * H**2 + -3.582e-6 * T**2 * H**2
+	return HI.where( T > 20 , np.nan )
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def measure( f , *args ):##{{{
+	tracemalloc.start()
+	t0  = time.perf_counter()
+	out = f(*args)
+	t1  = time.perf_counter()
+	_,peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return np.asarray(out),t1 - t0,peak
+##}}}
+
+def fields( ntime , nlat , nlon ):##{{{
+	rng  = np.random.default_rng(42)
+	dims = ["time","lat","lon"]
+	def f( loc , scale ):
+		return xr.DataArray( rng.normal( loc , scale , size = (ntime,nlat,nlon) ).astype("float32") , dims = dims )
+	X = {}
+	X["tas"]   = f( 295 , 10 )
+	X["dptas"] = X["tas"] - np.abs(f( 0 , 5 ))
+	X["hurs"]  = xr.DataArray( rng.uniform( 0 , 100 , size = (ntime,nlat,nlon) ).astype("float32") , dims = dims )
+	X["ps"]    = f( 1e5 , 1e3 )
+	X["uas"]   = f( 0 , 5 )
+	X["vas"]   = f( 0 , 5 )
+	X["ta500"] = f( 250 , 10 )
+	X["zg500"] = f( 5500 , 100 )
+	X["huss"]  = np.abs(f( 0.01 , 0.005 ))
+	X["orog"]  = xr.DataArray( rng.uniform( 0 , 3000 , size = (nlat,nlon) ).astype("float32") , dims = dims[1:] )
+	return X
+##}}}
+
+
+##########
+## main ##
+##########
+
+if __name__ == "__main__":
+	
+	ntime,nlat,nlon = 2 * 744,100,100
+	if len(sys.argv) > 1:
+		ntime,nlat,nlon = [int(s) for s in sys.argv[1:4]]
+	
+	X = fields( ntime , nlat , nlon )
+	cases = [
+	    ( "sfcWind"       , ref_sfcWind        , wind_speed            , ["uas","vas"] ),
+	    ( "hurs"          , ref_hurs           , relative_humidity     , ["dptas","tas"] ),
+	    ( "huss"          , ref_huss           , specific_humidity     , ["dptas","ps"] ),
+	    ( "ubtas"         , ref_ubtas          , upper_bound_tas       , ["ta500","zg500","huss","orog"] ),
+	    ( "HI-noaa"       , ref_HI_noaa        , heat_index_noaa       , ["tas","hurs"] ),
+	    ( "HI-blazejczyk" , ref_HI_blazejczyk  , heat_index_blazejczyk , ["tas","hurs"] ),
+	]
+	
+	print( f"Fields of shape ({ntime},{nlat},{nlon}), float32" )
+	print( "{:14} {:>10} {:>10} {:>12} {:>12} {:>10} {:>12}".format( "cvar" , "t_ref (s)" , "t_new (s)" , "peak_ref (MB)" , "peak_new (MB)" , "identical" , "max|diff|" ) )
+	for name,fref,kernel,cvars in cases:
+		args = [X[c] for c in cvars]
+		oref,tref,pref = measure( fref , *args )
+		onew,tnew,pnew = measure( lambda *a: blockwise( kernel , a , ntime ) , *args )
+		same = np.array_equal( oref , onew , equal_nan = True )
+		diff = float(np.nanmax(np.abs(oref - onew)))
+		print( "{:14} {:>10.3f} {:>10.3f} {:>12.1f} {:>12.1f} {:>10} {:>12.3g}".format( name , tref , tnew , pref / 2**20 , pnew / 2**20 , str(same) , diff ) )
@@ -27,13 +27,20 @@ import sys
 import os
 import argparse
 import tempfile
+import importlib.util
 import logging
 import datetime as dt
+import functools
+import contextlib
+import contextvars
 import dataclasses
 
 import numpy  as np
-import xarray as xr
-import pandas as pd
+
+from .__lazy import LazyModule
+
+xr = LazyModule("xarray")
+pd = LazyModule("pandas")
 
 from .__exceptions  import AbortForHelpException
 from .__exceptions  import  NoUserInputException
@@ -41,6 +48,16 @@ from .__exceptions  import  NoUserInputException
 from .__CVarsParams import CVarsParams
 from .__CVarsParams import cvarsParams
 
+from .__blocks import parse_memory
+from .__blocks import parse_interval
+from .__grid   import Grid
+from .__thermo import TIME_BLOCK
+from .__tmpfiles import tmp_formats
+from .__shards import file_periods
+from .__compression import parse_compression
+from .__lossy import parse_lossy
+from .__chunking import parse_chunking
+
 
 ###############
 ## Variables ##
@@ -68,10 +85,31 @@ class CDSUParams:
 	area_name   : str             | None = None
 	period      : str             | None = None
 	output_dir  : str             | None = None
+	output_url  : str             | None = None
+	persist     : bool                   = True
 	keep_hourly : bool                   = False
+	max_memory  : str | int       | None = None
+	tmp_format  : str                    = "netcdf"
+	merge_mode  : str                    = "rewrite"
+	output_format : str                  = "netcdf"
+	file_period : str                    = "year"
+	compression : str | dict             = "zlib-5"
+	lossy       : str | dict             = "none"
+	chunking    : str | tuple            = "map"
+	rechunk     : str | None             = None
+	jobs_file   : str | None             = None
+	watch       : str | float     | None = None
+	watch_status : str | None            = None
+	compression_benchmark : str | None   = None
+	
+	download_workers : int = 1
+	queue_years      : int = 2
+	merge_workers    : int = 1
+	upload_workers   : int = 4
 	
 	cvarsParams  : CVarsParams   = cvarsParams
 	cdsApiParams : dict | None = None
+	grid         : Grid | None = None
 	
 	def init_from_user_input( self , *argv ):##{{{
 		
@@ -100,6 +138,23 @@ class CDSUParams:
 		parser.add_argument( "--period" , default = None )
 		parser.add_argument( "--output-dir"  , default = None )
 		parser.add_argument( "--keep-hourly" , action = "store_const" , const = True , default = False )
+		parser.add_argument( "--max-memory"  , default = None )
+		parser.add_argument( "--tmp-format"  , default = "netcdf" )
+		parser.add_argument( "--merge-mode"  , default = "rewrite" )
+		parser.add_argument( "--output-format" , default = "netcdf" )
+		parser.add_argument( "--file-period" , default = "year" )
+		parser.add_argument( "--compression" , default = "zlib-5" )
+		parser.add_argument( "--lossy"       , default = "none" )
+		parser.add_argument( "--chunking"    , default = "map" )
+		parser.add_argument( "--rechunk"     , default = None )
+		parser.add_argument( "--jobs-file"   , default = None )
+		parser.add_argument( "--watch"       , default = None )
+		parser.add_argument( "--watch-status" , default = None )
+		parser.add_argument( "--compression-benchmark" , default = None )
+		parser.add_argument( "--download-workers" , default = 1 , type = int )
+		parser.add_argument( "--queue-years"      , default = 2 , type = int )
+		parser.add_argument( "--merge-workers"    , default = 1 , type = int )
+		parser.add_argument( "--upload-workers"   , default = 4 , type = int )
 		
 		## Transform in dict
 		kwargs = vars(parser.parse_args(argv))
@@ -111,6 +166,21 @@ class CDSUParams:
 		
 	##}}}
 	
+	@staticmethod
+	def from_user_input( *argv ):##{{{
+		
+		## Parameters of a run from the arguments of 'cdsupdate', checked and
+		## with its tmp directory, the context of the run for run_cdsupdate
+		params = CDSUParams()
+		params.init_from_user_input(*argv)
+		params.check()
+		if params.abort:
+			raise params.error
+		params.init_tmp()
+		
+		return params
+	##}}}
+	
 	def init_tmp(self):##{{{
 		
 		if self.tmp is None:
@@ -122,6 +192,11 @@ class CDSUParams:
 		prefix            = f"CDSUPDATE_{now}_"
 		self.tmp_gen      = tempfile.TemporaryDirectory( dir = self.tmp_base , prefix = prefix )
 		self.tmp          = self.tmp_gen.name
+		
+		## Output on an object store, staging directory of the output files
+		if self.output_url is not None:
+			self.output_dir = os.path.join( self.tmp , "OUTPUT" )
+			os.makedirs(self.output_dir)
 	##}}}
 	
 	def init_logging(self):##{{{
@@ -176,14 +251,84 @@ class CDSUParams:
 			if self.help:
 				raise AbortForHelpException
 			
-			## Test of the output dir exist
+			## Format of the output files, zarr is optional
+			if not self.output_format in ["netcdf","zarr"]:
+				raise Exception( f"Output format '{self.output_format}' is not available" )
+			if self.output_format == "zarr" and importlib.util.find_spec("zarr") is None:
+				raise Exception( "The package 'zarr' is required for the zarr output format" )
+			
+			## Compression profiles
+			try:
+				self.compression = { key : profile.available(self.output_format) for key,profile in parse_compression(self.compression).items() }
+			except ValueError as e:
+				raise Exception(e)
+			
+			## Lossy encoding
+			try:
+				self.lossy = parse_lossy(self.lossy)
+			except ValueError as e:
+				raise Exception(e)
+			
+			## Chunks of the output files
+			try:
+				self.chunking = parse_chunking(self.chunking)
+			except ValueError as e:
+				raise Exception(e)
+			
+			## Period of the output files
+			if not self.file_period in file_periods:
+				raise Exception( f"File period '{self.file_period}' is not available" )
+			
+			## Memory budget, also used by --rechunk
+			if self.max_memory is not None:
+				try:
+					self.max_memory = parse_memory(self.max_memory)
+				except ValueError as e:
+					raise Exception(e)
+			
+			## Rechunk of existing files, no other inputs needed
+			if self.rechunk is not None:
+				if not os.path.exists(self.rechunk):
+					raise Exception( f"Path {self.rechunk} to rechunk doesn't exists!" )
+				return
+			
+			## Jobs file, the inputs are given by the jobs
+			if self.jobs_file is not None:
+				if not os.path.isfile(self.jobs_file):
+					raise Exception( f"Jobs file {self.jobs_file} doesn't exists!" )
+				if importlib.util.find_spec("tomllib") is None and importlib.util.find_spec("tomli") is None:
+					raise Exception( "The package 'tomli' is required to read a jobs file" )
+				return
+			
+			## Benchmark of the compression profiles, no other inputs needed
+			if self.compression_benchmark is not None:
+				if not os.path.isfile(self.compression_benchmark):
+					raise Exception( f"File {self.compression_benchmark} for the compression benchmark doesn't exists!" )
+				return
+			
+			## Test of the output dir exist, not needed if the data are not
+			## persisted (CDSupdate.fetch)
 			if self.output_dir is None:
-				raise Exception("Output directory must be given!")
-			self.output_dir = os.path.abspath(self.output_dir)
-			if self.output_dir.split(os.path.sep)[-1] == "ERA5":
-				self.output_dir = os.path.sep.join( self.output_dir.split(os.path.sep)[:-1] )
-			if not os.path.isdir(self.output_dir):
-				raise Exception( f"Output directory {self.output_dir} is not a path!" )
+				if self.persist:
+					raise Exception("Output directory must be given!")
+			
+			## Or an url of an object store (fsspec), the files are written in a
+			## staging directory (see init_tmp) and uploaded
+			elif "://" in self.output_dir:
+				if importlib.util.find_spec("fsspec") is None:
+					raise Exception( "The package 'fsspec' is required for an output directory on an object store" )
+				if self.output_format == "zarr":
+					raise Exception( "The zarr output format can not be used with an object store" )
+				self.output_url = self.output_dir.rstrip("/")
+				if self.output_url.split("/")[-1] == "ERA5":
+					self.output_url = "/".join( self.output_url.split("/")[:-1] )
+				self.output_dir = None
+			else:
+				self.output_dir = os.path.abspath(self.output_dir)
+				if self.output_dir.split(os.path.sep)[-1] == "ERA5":
+					self.output_dir = os.path.sep.join( self.output_dir.split(os.path.sep)[:-1] )
+				if not os.path.isdir(self.output_dir):
+					raise Exception( f"Output directory {self.output_dir} is not a path!" )
 			
 			## Test if the tmp directory exists
 			if self.tmp is not None:
@@ -243,6 +388,33 @@ class CDSUParams:
 			if not self.period[0] <= self.period[1]:
 				raise Exception( f"Start period greater than the end!" )
 			
+			## Watch mode, interval between two checks of the CDS
+			if self.watch is not None:
+				try:
+					self.watch = parse_interval(self.watch)
+				except ValueError as e:
+					raise Exception(e)
+			
+			## Merge of new data in the old files
+			if not self.merge_mode in ["rewrite","append"]:
+				raise Exception( f"Merge mode '{self.merge_mode}' is not available" )
+			
+			## Pipeline
+			if self.download_workers < 1:
+				raise Exception( "At least one download worker is required" )
+			if self.queue_years < 1:
+				raise Exception( "At least one year must be in the download queue" )
+			if self.merge_workers < 1:
+				raise Exception( "At least one merge worker is required" )
+			if self.upload_workers < 1:
+				raise Exception( "At least one upload worker is required" )
+			
+			## Format of intermediate files
+			if not self.tmp_format in tmp_formats:
+				raise Exception( f"Format '{self.tmp_format}' of intermediate files is not available" )
+			if self.tmp_format == "memory" and self.merge_workers > 1:
+				raise Exception( "The intermediate files in memory can not be used with merge workers" )
+			
 		except Exception as e:
 			self.abort = True
 			self.error = e
@@ -260,6 +432,46 @@ class CDSUParams:
 		return self.__dict__.get(key)
 	##}}}
 	
+	def time_block( self , nbytes , nbuffers = 1 , align = 1 ):##{{{
+		
+		## Number of time steps processed at once: nbytes is the size of one
+		## time step of one field, and nbuffers the number of fields of this
+		## size allocated by the stage. Without budget, a default is used.
+		## Half of the budget is for the blocks, the other half for the hourly
+		## data kept in memory (see CDSupdate.__store).
+		if self.max_memory is None:
+			block = TIME_BLOCK
+		else:
+			block = int( self.max_memory // 2 // ( nbytes * nbuffers ) )
+		block = max( align , block - block % align )
+		
+		return block
+	##}}}
+	
+	def compression_profile( self , cvar ):##{{{
+		
+		## Profile of cvar, of cvar without level, or the default
+		if isinstance(self.compression,str):
+			self.compression = parse_compression(self.compression)
+		avar,_ = self.cvarsParams.split_level(cvar)
+		return self.compression.get( cvar , self.compression.get( avar , self.compression[None] ) )
+	##}}}
+	
+	def lossy_profile( self , cvar ):##{{{
+		
+		## Lossy encoding of cvar, of cvar without level, or the default
+		if isinstance(self.lossy,str):
+			self.lossy = parse_lossy(self.lossy)
+		avar,_ = self.cvarsParams.split_level(cvar)
+		return self.lossy.get( cvar , self.lossy.get( avar , self.lossy[None] ) )
+	##}}}
+	
+	def years(self):##{{{
+		years = list(set( key[0][:4] for key in self.cdsApiParams ))
+		years.sort()
+		return years
+	##}}}
+	
 	def _period_to_CDSAPI( self , tl , tr , all_year = False ):##{{{
 		
 		## Global parameters
@@ -319,7 +531,74 @@ class CDSUParams:
 		self.cdsApiParams = cdsApiParams
 	##}}}
 
-cdsuParams = CDSUParams()
+
+class _CurrentParams:##{{{
+	
+	## Parameters of the current run: all the attributes are read from (and
+	## written to) the CDSUParams activated by use_params in the current
+	## thread / context, or the default instance of the process. The stages
+	## read cdsuParams, so several runs with their own CDSUParams can be done
+	## concurrently in one process.
+	
+	def __getattr__( self , name ):##{{{
+		return getattr( current_params() , name )
+	##}}}
+	
+	def __setattr__( self , name , value ):##{{{
+		setattr( current_params() , name , value )
+	##}}}
+	
+	def __getitem__( self , key ):##{{{
+		return current_params()[key]
+	##}}}
+	
+	def __repr__(self):##{{{
+		return repr(current_params())
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+_default_params = CDSUParams()
+_current_params = contextvars.ContextVar( "cdsuParams" , default = _default_params )
+
+def current_params():##{{{
+	return _current_params.get()
+##}}}
+
+@contextlib.contextmanager
+def use_params( params ):##{{{
+	
+	## Activate params (a CDSUParams, the context of a run) in the current
+	## context, None keeps the current parameters
+	if params is None:
+		yield current_params()
+		return
+	token = _current_params.set(params)
+	try:
+		yield params
+	finally:
+		_current_params.reset(token)
+##}}}
+
+def with_params( func ):##{{{
+	
+	## Decorator of the stages: the keyword argument params (a CDSUParams) is
+	## the run context, activated during the call
+	@functools.wraps(func)
+	def wrapper( *args , params = None , **kwargs ):
+		with use_params(params):
+			return func( *args , **kwargs )
+	
+	return wrapper
+##}}}
+
+
+cdsuParams = _CurrentParams()
 
 
 
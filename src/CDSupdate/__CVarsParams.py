@@ -18,13 +18,133 @@
 
 import os
 import re
-import pandas as pd
+import csv
+import json
+import types
+import dataclasses
+
+
+###############
+## Variables ##
+###############
+
+## The metadata of the variables (ERA5-name.csv and the descriptions) and of
+## the areas (areas.csv) are compiled in the registry registry.json, read at
+## the import without pandas. After a change of the sources, the registry is
+## rebuilt with write_registry(), until then the sources are read.
+data_path     = os.path.join( os.path.dirname(os.path.abspath(__file__)) , "data" )
+registry_name = "registry.json"
+
+
+###############
+## Functions ##
+###############
+
+def _registry_sources( dpath ):##{{{
+	
+	## Source files of the registry (the description files which exist)
+	sources = ["ERA5-name.csv","areas.csv"]
+	sources = sources + sorted( f for f in os.listdir(dpath) if f.startswith("ERA5-") and f.endswith("-description.txt") )
+	return sources
+##}}}
+
+def compile_registry( dpath = data_path ):##{{{
+	
+	## Variables, one dict (column: value, all str) per row of ERA5-name.csv
+	with open( os.path.join( dpath , "ERA5-name.csv" ) , "r" , newline = "" ) as f:
+		variables = [ dict(row) for row in csv.DictReader( f , restval = "" ) ]
+	
+	## Descriptions
+	descriptions = {}
+	for row in variables:
+		try:
+			with open( os.path.join( dpath , f"ERA5-{row['AMIP']}-description.txt" ) , "r" ) as f:
+				descriptions[row["AMIP"]] = "".join(f.readlines()).replace("\n","")
+		except:
+			descriptions[row["AMIP"]] = ""
+	
+	## Areas, name: [lon_min,lon_max,lat_min,lat_max]
+	with open( os.path.join( dpath , "areas.csv" ) , "r" , newline = "" ) as f:
+		reader = csv.reader(f)
+		next(reader)
+		areas = { str(row[0]) : [ float(x) for x in row[1:] ] for row in reader if len(row) > 0 }
+	
+	return { "sources" : _registry_sources(dpath) , "variables" : variables , "descriptions" : descriptions , "areas" : areas }
+##}}}
+
+def write_registry( dpath = data_path ):##{{{
+	with open( os.path.join( dpath , registry_name ) , "w" ) as f:
+		json.dump( compile_registry(dpath) , f , indent = 1 )
+		f.write("\n")
+##}}}
+
+def load_registry( dpath = data_path ):##{{{
+	
+	## The registry, or the sources if they have changed since the registry
+	## was written
+	rfile = os.path.join( dpath , registry_name )
+	try:
+		with open( rfile , "r" ) as f:
+			registry = json.load(f)
+		mtime = os.stat(rfile).st_mtime
+	except (OSError,ValueError):
+		return compile_registry(dpath)
+	
+	sources = _registry_sources(dpath)
+	if not sources == registry["sources"] or any( os.stat( os.path.join( dpath , s ) ).st_mtime > mtime for s in sources ):
+		return compile_registry(dpath)
+	
+	return registry
+##}}}
 
 
 ###########
 ## Class ##
 ###########
 
+@dataclasses.dataclass( frozen = True , slots = True )
+class CVar:##{{{
+	
+	## Metadata of a variable (a row of ERA5-name.csv), built once by
+	## CVarsParams. height is kept as the str of the csv ('' for the variables
+	## on pressure levels), attrs are the CF attributes written in the output
+	## files (read only).
+	
+	AMIP        : str
+	ERA5        : str
+	CDS         : str
+	level       : str
+	height      : str
+	deps        : tuple
+	nsb         : int
+	valid_range : tuple
+	attrs       : types.MappingProxyType
+	
+	@staticmethod
+	def from_row( row , description ):##{{{
+		
+		attrs = { "standard_name" : row["standard_name"],
+		          "long_name"     : row["long_name"],
+		          "units"         : row["units"],
+		          "comment"       : row["comment"],
+		          "CDS_name"      : row["CDS"],
+		          "ERA5_name"     : row["ERA5"],
+		          "description"   : description }
+		deps  = tuple(row["dep"].split(";")) if len(row["dep"]) > 0 else ()
+		
+		return CVar( AMIP        = row["AMIP"],
+		             ERA5        = row["ERA5"],
+		             CDS         = row["CDS"],
+		             level       = row["level"],
+		             height      = row["height"],
+		             deps        = deps,
+		             nsb         = int(row["nsb"]),
+		             valid_range = ( float(row["valid_min"]) , float(row["valid_max"]) ),
+		             attrs       = types.MappingProxyType(attrs) )
+	##}}}
+	
+##}}}
+
 class CVarsParams:##{{{
 	
 	def __init__( self ):##{{{
@@ -37,47 +157,34 @@ class CVarsParams:##{{{
 		                       '850', '875', '900','925', '950', '975','1000']
 		
 		
-		## Read table of cvars
-		cpath = os.path.dirname(os.path.abspath(__file__))
-		self._cvar_tab = pd.read_csv( os.path.join( cpath , "data" , "ERA5-name.csv" ) , keep_default_na = False )
+		## Read table of cvars, one record by cvar
+		registry         = load_registry()
+		self.description = dict(registry["descriptions"])
+		self._records = { row["AMIP"] : CVar.from_row( row , self.description.get(row["AMIP"],"") ) for row in registry["variables"] }
 		
 		## All cvars
-		self.all_cvars = self._cvar_tab["AMIP"].values.tolist()
+		self.all_cvars = list(self._records)
 		self.dwl_cvars = []
 		self.cmp_cvars = []
 		self.dep_cvars = {}
 		
 		## Build the dependecy graph
-		deps = self._cvar_tab["dep"].values.tolist()
-		for cvar,dep in zip(self.all_cvars,deps):
-			if len(dep) == 0:
+		for cvar,rec in self._records.items():
+			if len(rec.deps) == 0:
 				self.dwl_cvars.append(cvar)
-				self.dep_cvars[cvar] = []
 			else:
 				self.cmp_cvars.append(cvar)
-				self.dep_cvars[cvar] = dep.split(";")
+			self.dep_cvars[cvar] = list(rec.deps)
 		
 		## Conversion
-		self.AMIP_ERA5 = { str(self._cvar_tab.loc[i,"AMIP"]) : str(self._cvar_tab.loc[i,"ERA5"]) for i in range(self._cvar_tab.shape[0]) }
-		self.ERA5_AMIP = { str(self._cvar_tab.loc[i,"ERA5"]) : str(self._cvar_tab.loc[i,"AMIP"]) for i in range(self._cvar_tab.shape[0]) }
-		self.AMIP_CDS  = { str(self._cvar_tab.loc[i,"AMIP"]) : str(self._cvar_tab.loc[i,"CDS"])  for i in range(self._cvar_tab.shape[0]) }
-		self.CDS_AMIP  = { str(self._cvar_tab.loc[i,"CDS"])  : str(self._cvar_tab.loc[i,"AMIP"]) for i in range(self._cvar_tab.shape[0]) }
-		
-		## Now read description
-		self.description = {}
-		for cvar in self.all_cvars:
-			try:
-				with open( os.path.join( cpath , "data" , f"ERA5-{cvar}-description.txt" ) , "r" ) as f:
-					self.description[cvar] = "".join(f.readlines()).replace("\n","")
-			except:
-				self.description[cvar] = ""
-		
-		## Now read areas
-		self.areas_tab = pd.read_csv( os.path.join( cpath , "data" , "areas.csv" ) )
-		
-		self.available_area = {}
-		for i in range(self.areas_tab.shape[0]):
-			self.available_area[str(self.areas_tab.iloc[i,0])] = [float(x) for x in self.areas_tab.iloc[i,1:].values.tolist()]
+		recs = list(self._records.values())
+		self.AMIP_ERA5 = { rec.AMIP : rec.ERA5 for rec in recs }
+		self.ERA5_AMIP = { rec.ERA5 : rec.AMIP for rec in recs }
+		self.AMIP_CDS  = { rec.AMIP : rec.CDS  for rec in recs }
+		self.CDS_AMIP  = { rec.CDS  : rec.AMIP for rec in recs }
+		
+		## Areas
+		self.available_area = dict(registry["areas"])
 		
 	##}}}
 	
@@ -149,33 +256,28 @@ class CVarsParams:##{{{
 		return to_dwl,to_cmp,levs
 	##}}}
 	
+	def record( self , cvar ):##{{{
+		return self._records[cvar]
+	##}}}
+	
 	def level( self , cvar ):##{{{
-		tab   = self._cvar_tab.copy()
-		tab.index = tab["AMIP"]
-		return tab.loc[cvar,"level"]
+		return self._records[cvar].level
 	##}}}
 	
 	def height( self , cvar ):##{{{
-		tab   = self._cvar_tab.copy()
-		tab.index = tab["AMIP"]
-		return tab.loc[cvar,"height"]
+		return self._records[cvar].height
+	##}}}
+	
+	def nsb( self , cvar ):##{{{
+		return self._records[cvar].nsb
+	##}}}
+	
+	def valid_range( self , cvar ):##{{{
+		return self._records[cvar].valid_range
 	##}}}
 	
 	def attrs( self , cvar ):##{{{
-		
-		attrs = {}
-		tab   = self._cvar_tab.copy()
-		tab.index = tab["AMIP"]
-		
-		attrs["standard_name"] = tab.loc[cvar]["standard_name"]
-		attrs["long_name"]     = tab.loc[cvar][f"long_name"]
-		attrs["units"]         = tab.loc[cvar]["units"]
-		attrs["comment"]       = tab.loc[cvar][f"comment"]
-		attrs["CDS_name"]      = tab.loc[cvar]["CDS"]
-		attrs["ERA5_name"]     = tab.loc[cvar]["ERA5"]
-		attrs["description"]   = self.description[cvar]
-		
-		return attrs
+		return self._records[cvar].attrs
 	##}}}
 	
 ##}}}
@@ -0,0 +1,121 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import shutil
+import contextlib
+
+from .__lazy import lazy_import
+
+fcntl = lazy_import("fcntl")
+
+
+###############
+## Variables ##
+###############
+
+## ioctl of Linux cloning a file (reflink): the blocks are shared by the two
+## files until they are modified
+FICLONE = 0x40049409
+
+
+###############
+## Functions ##
+###############
+
+def atomic_target( ofile ):##{{{
+	
+	## Temporary name of ofile, hidden and in the same directory, so that the
+	## final os.replace is atomic
+	return os.path.join( os.path.dirname(ofile) , "." + os.path.basename(ofile) + ".part" )
+##}}}
+
+def copy_target( ifile , tfile ):##{{{
+	
+	## Copy of ifile in tfile, modified and renamed over ifile. A clone on the
+	## file systems supporting it (btrfs, XFS, ...), no data is copied, else
+	## a full copy.
+	if fcntl is not None:
+		try:
+			with open( ifile , "rb" ) as fi, open( tfile , "wb" ) as fo:
+				fcntl.ioctl( fo.fileno() , FICLONE , fi.fileno() )
+			return
+		except OSError:
+			pass
+	shutil.copyfile( ifile , tfile )
+##}}}
+
+def commit_target( tfile , ofile ):##{{{
+	
+	## Flush tfile on the disk, and rename it in ofile. Readers see the old
+	## file or the new one, never a partial file.
+	fd = os.open( tfile , os.O_RDONLY )
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+	os.replace( tfile , ofile )
+	
+	## And the rename itself
+	try:
+		fd = os.open( os.path.dirname(ofile) or "." , os.O_RDONLY )
+	except OSError:
+		return
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
+##}}}
+
+def commit_tree( tpath , opath ):##{{{
+	
+	## Replace the directory opath (e.g. a zarr store) by tpath. A non empty
+	## directory can not be replaced atomically: the old one is renamed
+	## first, and removed after the rename of the new one.
+	old = None
+	if os.path.isdir(opath):
+		old = os.path.join( os.path.dirname(opath) , "." + os.path.basename(opath) + ".old" )
+		if os.path.isdir(old):
+			shutil.rmtree(old)
+		os.replace( opath , old )
+	os.replace( tpath , opath )
+	if old is not None:
+		shutil.rmtree(old)
+##}}}
+
+@contextlib.contextmanager
+def atomic_output( ofile ):##{{{
+	
+	## with atomic_output(ofile) as tfile: write tfile, renamed in ofile at the
+	## end, or removed if an exception occurs
+	tfile = atomic_target(ofile)
+	try:
+		yield tfile
+	except BaseException:
+		if os.path.isfile(tfile):
+			os.remove(tfile)
+		raise
+	commit_target( tfile , ofile )
+##}}}
+
@@ -0,0 +1,111 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import re
+import warnings
+
+import numpy as np
+
+
+###############
+## Functions ##
+###############
+
+def parse_memory( s ):##{{{
+	
+	## Accept an integer (bytes), or a number followed by K, M, G or T
+	## (powers of 1024), with an optional 'B' / 'iB', e.g. '64G', '512MiB'.
+	m = re.fullmatch( r"\s*([0-9]*\.?[0-9]+)\s*([KMGT]?)(i?B)?\s*" , str(s) , flags = re.IGNORECASE )
+	if m is None:
+		raise ValueError( f"Invalid memory size '{s}', use e.g. '64G' or '512M'" )
+	
+	value,unit,_ = m.groups()
+	power = "KMGT".find(unit.upper()) + 1 if len(unit) > 0 else 0
+	
+	return int( float(value) * 1024**power )
+##}}}
+
+def parse_interval( s ):##{{{
+	
+	## Accept an integer (seconds), or a number followed by s, min, h or d,
+	## e.g. '6h', '30min'.
+	m = re.fullmatch( r"\s*([0-9]*\.?[0-9]+)\s*(s|min|h|d)?\s*" , str(s) , flags = re.IGNORECASE )
+	if m is None:
+		raise ValueError( f"Invalid interval '{s}', use e.g. '6h' or '30min'" )
+	
+	value,unit = m.groups()
+	seconds = { "s" : 1 , "min" : 60 , "h" : 3600 , "d" : 86400 }[unit.lower() if unit is not None else "s"]
+	
+	if not float(value) * seconds > 0:
+		raise ValueError( f"The interval '{s}' must be positive" )
+	
+	return float(value) * seconds
+##}}}
+
+def default_memory():##{{{
+	
+	## Half of the physical memory, or 8G if it can not be found
+	try:
+		return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+	except (ValueError,OSError,AttributeError):
+		return 8 * 1024**3
+##}}}
+
+def day_blocks( time , block ):##{{{
+	
+	## Split a sorted time axis in slices of at most 'block' time steps,
+	## without cutting a day (a day larger than block is a block itself).
+	days    = np.asarray(time).astype("datetime64[D]")
+	_,idx   = np.unique( days , return_index = True )
+	idx     = [int(i) for i in idx] + [days.size]
+	
+	slices = []
+	i0     = 0
+	for i in range(1,len(idx)):
+		if idx[i] - i0 > block and idx[i-1] > i0:
+			slices.append( slice(i0,idx[i-1]) )
+			i0 = idx[i-1]
+	if i0 < days.size:
+		slices.append( slice(i0,days.size) )
+	
+	return slices
+##}}}
+
+def daily_reduce( time , X , how = "mean" ):##{{{
+	
+	## Reduce hourly data X (time first) to daily values, NaN are skipped as
+	## xarray does. time must contain whole days (see day_blocks).
+	days    = np.asarray(time).astype("datetime64[D]")
+	udays,idx = np.unique( days , return_index = True )
+	idx     = [int(i) for i in idx] + [days.size]
+	
+	func = { "mean" : np.nanmean , "min" : np.nanmin , "max" : np.nanmax }[how]
+	out  = np.empty( (udays.size,) + X.shape[1:] , dtype = X.dtype )
+	with warnings.catch_warnings():
+		warnings.simplefilter( "ignore" , category = RuntimeWarning )
+		for i in range(udays.size):
+			func( X[idx[i]:idx[i+1]] , axis = 0 , out = out[i] )
+	
+	return udays.astype("datetime64[ns]"),out
+##}}}
+
@@ -0,0 +1,386 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import datetime as dt
+
+import numpy as np
+
+from .__lazy import LazyModule
+
+netCDF4 = LazyModule("netCDF4")
+
+
+#############
+## Imports ##
+#############
+
+from .__CDSUParams import cdsuParams
+from .__shards import file_range
+from .__shards import shard_key
+from .__remote import remote_find
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+## Catalog of the output files, in output_dir/ERA5. One row per file (or
+## zarr store), the path is relative to output_dir/ERA5. The times are
+## 'YYYY-MM-DDTHH', era5t_start is the first time step of ERA5T (preliminary)
+## data in the file (NULL if none), era5t is 1 if the file has ERA5T data.
+## refs are the kerchunk references of the file (JSON), computed by the index
+## (see __index.py), NULL for a new file.
+catalog_name   = "catalog.sqlite"
+catalog_schema = """
+CREATE TABLE IF NOT EXISTS files (
+	path        TEXT PRIMARY KEY,
+	area        TEXT NOT NULL,
+	freq        TEXT NOT NULL,
+	cvar        TEXT NOT NULL,
+	t0          TEXT,
+	t1          TEXT,
+	nsteps      INTEGER,
+	grid        TEXT,
+	compression TEXT,
+	lossy       TEXT,
+	era5t       INTEGER,
+	era5t_start TEXT,
+	sha256      TEXT,
+	updated     TEXT,
+	refs        TEXT
+);
+CREATE INDEX IF NOT EXISTS files_key ON files (area,freq,cvar,t0);
+"""
+catalog_columns = ["path","area","freq","cvar","t0","t1","nsteps","grid","compression","lossy","era5t","era5t_start","sha256","updated","refs"]
+
+## Raw data version of the final ERA5 data, the others (0005) are ERA5T
+era5_expver = 1
+
+
+###############
+## Functions ##
+###############
+
+def catalog_file( output_dir = None ):##{{{
+	if output_dir is None:
+		output_dir = cdsuParams.output_dir
+	return os.path.join( output_dir , "ERA5" , catalog_name )
+##}}}
+
+def _time2iso( t ):##{{{
+	if t is None:
+		return None
+	return str(np.datetime64(t,"h"))
+##}}}
+
+def _iso2time( s ):##{{{
+	if s is None:
+		return None
+	return np.datetime64(s,"h")
+##}}}
+
+def connect( cfile ):##{{{
+	
+	## Connection to the catalog cfile, with the schema. The writers (merge
+	## workers) are serialized by the lock of sqlite, each update is one
+	## transaction.
+	con = sqlite3.connect( cfile , timeout = 600 )
+	con.executescript(catalog_schema)
+	
+	## Catalog of a previous version, without the refs
+	if not "refs" in [ row[1] for row in con.execute( "PRAGMA table_info(files)" ) ]:
+		with con:
+			con.execute( "ALTER TABLE files ADD COLUMN refs TEXT" )
+	
+	return con
+##}}}
+
+def open_catalog():##{{{
+	
+	## Catalog of the output_dir of the run, built from the file names of the
+	## tree if it does not exist (the other columns are filled when the files
+	## are written)
+	cfile = catalog_file()
+	new   = not os.path.isfile(cfile)
+	os.makedirs( os.path.dirname(cfile) , exist_ok = True )
+	con   = connect(cfile)
+	if new:
+		_bootstrap(con)
+	
+	return con
+##}}}
+
+def _name_row( rel ):##{{{
+	
+	## Row (path,area,freq,cvar,t0,t1) of the file rel (relative to
+	## output_dir/ERA5), from its name
+	area,freq,cvar,name = rel.split(os.path.sep)
+	t0 = t1 = None
+	if name.endswith(".nc") and not freq == "fx":
+		t0,t1 = [ _time2iso( np.datetime64( f"{t[:4]}-{t[4:6]}-{t[6:8]}T{t[8:10] or '00'}" ) ) for t in file_range(name) ]
+	return (rel,area,freq,cvar,t0,t1)
+##}}}
+
+def _bootstrap( con ):##{{{
+	
+	root = os.path.join( cdsuParams.output_dir , "ERA5" )
+	if cdsuParams.output_url is None:
+		paths = []
+		for dpath,dnames,fnames in os.walk(root):
+			paths.extend( [ os.path.join( dpath , f ) for f in fnames if f.endswith(".nc") ] )
+			paths.extend( [ os.path.join( dpath , d ) for d in dnames if d.endswith(".zarr") ] )
+			dnames[:] = [ d for d in dnames if not d.endswith(".zarr") ]
+	else:
+		paths = [ p for p in remote_find(root) if p.endswith(".nc") ]
+	
+	rows = []
+	for path in paths:
+		rel = os.path.relpath( path , root )
+		if not len(rel.split(os.path.sep)) == 4 or os.path.basename(rel).startswith("."):
+			continue
+		rows.append( _name_row(rel) )
+	
+	with con:
+		con.executemany( "INSERT OR IGNORE INTO files (path,area,freq,cvar,t0,t1) VALUES (?,?,?,?,?,?)" , rows )
+	logger.info( f" * Catalog built with {len(rows)} existing files" )
+##}}}
+
+def catalog_files( con , area , freq , cvar ):##{{{
+	
+	## Names of the output files of (area,freq,cvar), sorted by time
+	rows = con.execute( "SELECT path FROM files WHERE area = ? AND freq = ? AND cvar = ? ORDER BY t0" , (area,freq,cvar) ).fetchall()
+	return [ os.path.basename(row[0]) for row in rows ]
+##}}}
+
+def catalog_reconcile( con , area , freq , cvar ):##{{{
+	
+	## Check the rows of (area,freq,cvar) against the netCDF files of its
+	## directory, which can have been changed by hand or by an interrupted
+	## merge. The rows of the missing files are removed. The files missing in
+	## the catalog are added, except if the catalog already has a file for
+	## their shard (e.g. the old file of an interrupted merge): they are not
+	## used by the merge.
+	root  = os.path.join( cdsuParams.output_dir , "ERA5" )
+	opath = os.path.join( root , area , freq , cvar )
+	if cdsuParams.output_url is None:
+		names = os.listdir(opath) if os.path.isdir(opath) else []
+	else:
+		names = [ os.path.basename(p) for p in remote_find(opath) ]
+	names = set( name for name in names if name.endswith(".nc") and not name.startswith(".") )
+	files = [ f for f in catalog_files( con , area , freq , cvar ) if f.endswith(".nc") ]
+	
+	period  = cdsuParams.file_period
+	missing = [ f for f in files if not f in names ]
+	shards  = set( shard_key( file_range(f)[0] , period ) for f in files if f in names )
+	added   = []
+	for name in sorted( names - set(files) ):
+		if shard_key( file_range(name)[0] , period ) in shards:
+			logger.warning( f" * '{name}' is not in the catalog, another file of its period is used" )
+			continue
+		added.append( _name_row( os.path.join( area , freq , cvar , name ) ) )
+	if len(missing) == 0 and len(added) == 0:
+		return
+	
+	for f in missing:
+		logger.warning( f" * '{f}' is missing, removed from the catalog" )
+	for row in added:
+		logger.info( f" * '{os.path.basename(row[0])}' added in the catalog" )
+	with con:
+		con.executemany( "DELETE FROM files WHERE path = ?" , [ ( os.path.join( area , freq , cvar , f ) ,) for f in missing ] )
+		con.executemany( "INSERT OR IGNORE INTO files (path,area,freq,cvar,t0,t1) VALUES (?,?,?,?,?,?)" , added )
+##}}}
+
+def catalog_rows( con , area , freq , cvar ):##{{{
+	
+	## Rows of the output files of (area,freq,cvar), as dict, sorted by time
+	rows = con.execute( "SELECT {} FROM files WHERE area = ? AND freq = ? AND cvar = ? ORDER BY t0".format( ",".join(catalog_columns) ) , (area,freq,cvar) ).fetchall()
+	return [ dict(zip(catalog_columns,row)) for row in rows ]
+##}}}
+
+def catalog_last( con , area , freq , cvar ):##{{{
+	
+	## Last time step of the output files of (area,freq,cvar), None if no file
+	row = con.execute( "SELECT MAX(t1) FROM files WHERE area = ? AND freq = ? AND cvar = ?" , (area,freq,cvar) ).fetchone()
+	return _iso2time(row[0])
+##}}}
+
+def catalog_set_refs( con , path , refs ):##{{{
+	
+	## Record the kerchunk references of the file path (relative to
+	## output_dir/ERA5)
+	with con:
+		con.execute( "UPDATE files SET refs = ? WHERE path = ?" , ( json.dumps(refs) , path ) )
+##}}}
+
+def catalog_era5t( path ):##{{{
+	
+	## First ERA5T time step and last time step of the output file path
+	rel = os.path.relpath( path , os.path.join( cdsuParams.output_dir , "ERA5" ) )
+	con = connect(catalog_file())
+	row = con.execute( "SELECT era5t_start,t1 FROM files WHERE path = ?" , (rel,) ).fetchone()
+	con.close()
+	if row is None:
+		return None,None
+	
+	return _iso2time(row[0]),_iso2time(row[1])
+##}}}
+
+def _updated():##{{{
+	return str(dt.datetime.now(dt.UTC))[:19].replace(" ","T") + "Z"
+##}}}
+
+def _sha256( path ):##{{{
+	h = hashlib.sha256()
+	with open( path , "rb" ) as f:
+		for block in iter( lambda: f.read(2**24) , b"" ):
+			h.update(block)
+	return h.hexdigest()
+##}}}
+
+def catalog_update( path , cvar , freq , time , era5t_start = None , replaced = None ):##{{{
+	
+	## Record the output file (or zarr store) path, with the time steps time,
+	## and remove the row of the replaced file (renamed by the merge). One
+	## transaction, readers see the old or the new rows.
+	root = os.path.join( cdsuParams.output_dir , "ERA5" )
+	rel  = os.path.relpath( path , root )
+	area = cdsuParams.area_name
+	grid = cdsuParams.grid
+	
+	row = { "path" : rel , "area" : area , "freq" : freq , "cvar" : cvar }
+	if time is not None and len(time) > 0:
+		row["t0"]     = _time2iso(time[ 0])
+		row["t1"]     = _time2iso(time[-1])
+		row["nsteps"] = int(len(time))
+	if grid is not None:
+		row["grid"] = json.dumps( { "nlat" : int(grid.nlat) , "nlon" : int(grid.nlon) , "lat" : [float(grid.lat[0]),float(grid.lat[-1])] , "lon" : [float(grid.lon[0]),float(grid.lon[-1])] } )
+	row["compression"] = str(cdsuParams.compression_profile(cvar))
+	row["lossy"]       = str(cdsuParams.lossy_profile(cvar))
+	row["era5t"]       = int( era5t_start is not None )
+	row["era5t_start"] = _time2iso(era5t_start)
+	row["sha256"]      = _sha256(path) if os.path.isfile(path) else None
+	row["updated"]     = _updated()
+	
+	keys = list(row)
+	with connect(catalog_file()) as con:
+		if replaced is not None and not os.path.basename(replaced) == os.path.basename(path):
+			con.execute( "DELETE FROM files WHERE path = ?" , ( os.path.relpath( replaced , root ) ,) )
+		con.execute( "INSERT OR REPLACE INTO files ({}) VALUES ({})".format( ",".join(keys) , ",".join( "?" for _ in keys ) ) , [ row[k] for k in keys ] )
+	con.close()
+##}}}
+
+def catalog_rechunked( path , compression ):##{{{
+	
+	## The output file path (output_dir/ERA5/area/freq/cvar/name) has been
+	## rewritten out of a merge (--rechunk) with the profile compression: its
+	## sha256 and compression are updated, and its kerchunk references (old
+	## byte ranges) removed. Returns (output_dir,area,freq,cvar) of the file,
+	## None if it is not in a catalog.
+	cpath = os.path.dirname(path)
+	fpath = os.path.dirname(cpath)
+	apath = os.path.dirname(fpath)
+	root  = os.path.dirname(apath)
+	cfile = os.path.join( root , catalog_name )
+	if not os.path.isfile(cfile):
+		return None
+	
+	con = connect(cfile)
+	with con:
+		cur = con.execute( "UPDATE files SET compression = ? , sha256 = ? , updated = ? , refs = NULL WHERE path = ?" , ( str(compression) , _sha256(path) , _updated() , os.path.relpath( path , root ) ) )
+	con.close()
+	if cur.rowcount == 0:
+		return None
+	
+	return os.path.dirname(root),os.path.basename(apath),os.path.basename(fpath),os.path.basename(cpath)
+##}}}
+
+def file_time( path ):##{{{
+	
+	## Time steps of an output netCDF file
+	with netCDF4.Dataset( path , mode = "r" ) as ncf:
+		if not "time" in ncf.variables:
+			return None
+		hours = np.round(np.asarray(ncf.variables["time"][:])).astype("int64")
+	return np.datetime64("1900-01-01T00","h") + hours.astype("timedelta64[h]")
+##}}}
+
+def record_era5t( time , expver ):##{{{
+	
+	## Record the first ERA5T time step of raw data (expver of the CDS), in
+	## TMP/ERA5-AMIP/era5t.json, read by the merge
+	expver = np.broadcast_to( np.atleast_1d(expver) , time.shape )
+	idx    = np.flatnonzero( ~( expver.astype(int) == era5_expver ) )
+	if idx.size == 0:
+		return
+	
+	jfile = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "era5t.json" )
+	first = np.datetime64(time[idx[0]],"h")
+	if os.path.isfile(jfile):
+		with open( jfile , "r" ) as f:
+			first = min( first , _iso2time(json.load(f)["era5t_start"]) )
+	os.makedirs( os.path.dirname(jfile) , exist_ok = True )
+	with open( jfile , "w" ) as f:
+		json.dump( { "era5t_start" : _time2iso(first) } , f )
+##}}}
+
+def era5t_start():##{{{
+	
+	## First ERA5T time step of the raw data of the run, None if only ERA5
+	jfile = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "era5t.json" )
+	if not os.path.isfile(jfile):
+		return None
+	with open( jfile , "r" ) as f:
+		return _iso2time(json.load(f)["era5t_start"])
+##}}}
+
+def merged_era5t( eO , tO1 , time , eN , freq ):##{{{
+	
+	## First ERA5T time step of a file merged from an old file (first ERA5T
+	## step eO, last step tO1) and new data over time (first ERA5T step eN of
+	## the run): the ERA5T steps of the old file outside the new data remain.
+	tN0 = np.datetime64(time[ 0],"h")
+	tN1 = np.datetime64(time[-1],"h")
+	cands = []
+	if eN is not None and eN <= tN1:
+		cands.append( max( eN , tN0 ) )
+	if eO is not None:
+		if eO < tN0:
+			cands.append(eO)
+		elif tO1 is not None and tO1 > tN1:
+			cands.append( max( eO , tN1 + np.timedelta64( 24 if freq == "day" else 1 , "h" ) ) )
+	
+	return min(cands) if len(cands) > 0 else None
+##}}}
+
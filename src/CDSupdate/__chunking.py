@@ -0,0 +1,206 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import math
+import logging
+
+from .__lazy import LazyModule
+
+netCDF4 = LazyModule("netCDF4")
+
+
+#############
+## Imports ##
+#############
+
+from .__atomic import atomic_output
+from .__shards import shard_steps
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+chunking_layouts = ["map","series","balanced"]
+
+## Time steps of a yearly file, and target size of a chunk (bytes)
+year_steps   = { "hr" : 8784 , "day" : 366 }
+chunk_target = 2**20
+
+
+###############
+## Functions ##
+###############
+
+def parse_chunking( s ):##{{{
+	
+	## 'map', 'series', 'balanced' or explicit sizes 't,y,x'
+	if s in chunking_layouts:
+		return s
+	try:
+		chunks = tuple( int(c) for c in s.split(",") )
+	except ValueError:
+		raise ValueError( f"Invalid chunking: '{s}'" )
+	if not len(chunks) == 3 or min(chunks) < 1:
+		raise ValueError( f"Invalid chunking: '{s}'" )
+	
+	return chunks
+##}}}
+
+def _file_steps( freq , period ):##{{{
+	
+	## Time steps of a file, at most one year
+	if not freq in year_steps:
+		return 1
+	return min( year_steps[freq] , shard_steps[period][freq] )
+##}}}
+
+def chunk_shape( chunking , freq , nlat , nlon , period = "year" ):##{{{
+	
+	## Chunks (t,y,x) of a variable of a file of the period 'period'
+	## - map     : one map per chunk, fast to read maps
+	## - series  : one year (or one file) per chunk, on small tiles, fast to
+	##             read time series
+	## - balanced: one month per chunk, on medium tiles
+	nt = _file_steps( freq , period )
+	if chunking == "map":
+		return (1,nlat,nlon)
+	if chunking == "series":
+		t = nt
+	elif chunking == "balanced":
+		t = min( max( 1 , year_steps.get( freq , 1 ) // 12 ) , nt )
+	else:
+		t,y,x = chunking
+		return (t,min(y,nlat),min(x,nlon))
+	
+	## Square tiles of ~chunk_target bytes
+	side = max( 1 , int(math.sqrt( chunk_target / ( 4 * t ) )) )
+	return (t,min(side,nlat),min(side,nlon))
+##}}}
+
+def time_chunk( freq , period = "year" ):##{{{
+	return (_file_steps( freq , period ),)
+##}}}
+
+def aligned_block( block , chunks ):##{{{
+	
+	## Time blocks multiple of the time chunks, so that each chunk is
+	## compressed only once
+	if chunks[0] <= block:
+		return block - block % chunks[0]
+	return block
+##}}}
+
+def set_chunk_cache( ncv , chunks , nlat , nlon , max_memory = None ):##{{{
+	
+	## If a block is smaller than a time chunk, a row of chunks is kept in the
+	## cache until complete, instead of being compressed at each block
+	nbytes = 4 * chunks[0] * nlat * nlon * 2
+	if max_memory is not None:
+		nbytes = min( nbytes , max_memory // 2 )
+	nslots = 101 * math.ceil( nlat / chunks[1] ) * math.ceil( nlon / chunks[2] )
+	ncv.set_var_chunk_cache( size = max( nbytes , 2**20 ) , nelems = nslots , preemption = 0.75 )
+##}}}
+
+def rechunk_file( ifile , chunking , compression , max_memory = None , period = "year" ):##{{{
+	
+	## Rewrite an output file with new chunks, and the compression profile.
+	## The data are copied raw (packed or bit-rounded data are not changed).
+	
+	with atomic_output( ifile ) as tfile:
+		with netCDF4.Dataset( ifile , mode = "r" ) as ncfi, netCDF4.Dataset( tfile , mode = "w" ) as ncfo:
+			
+			ncfi.set_auto_maskandscale(False)
+			ncfo.set_auto_maskandscale(False)
+			
+			## Dimensions
+			for name,dim in ncfi.dimensions.items():
+				ncfo.createDimension( name , None if dim.isunlimited() else len(dim) )
+			
+			freq = os.path.basename(ifile).split("_")[2]
+			nlat = len(ncfi.dimensions["lat"])
+			nlon = len(ncfi.dimensions["lon"])
+			
+			## Variables
+			for name,ncvi in ncfi.variables.items():
+				
+				attrs = { att : ncvi.getncattr(att) for att in ncvi.ncattrs() if not att == "_FillValue" and not att.startswith("_Quantize") }
+				fill  = getattr( ncvi , "_FillValue" , None )
+				dims  = ncvi.dimensions
+				
+				if dims == ("time","lat","lon"):
+					chunks = chunk_shape( chunking , freq , nlat , nlon , period )
+				elif dims == ("lat","lon"):
+					chunks = chunk_shape( chunking , freq , nlat , nlon )[1:]
+				elif dims == ("time",):
+					chunks = time_chunk( freq , period )
+				elif len(dims) == 1:
+					chunks = (len(ncfi.dimensions[dims[0]]),)
+				else:
+					chunks = None
+				
+				kwargs = compression.kwargs() if len(dims) > 1 else { "compression" : "zlib" , "complevel" : 5 , "shuffle" : False }
+				if chunks is None:
+					kwargs = {}
+				
+				## Bit-rounding is kept (the data are already rounded)
+				quantization = ncvi.quantization()
+				if quantization is not None:
+					kwargs["significant_digits"] = quantization[0]
+					kwargs["quantize_mode"]      = quantization[1]
+				ncvo = ncfo.createVariable( name , ncvi.dtype , dims , fill_value = fill , chunksizes = chunks , **kwargs )
+				ncvo.setncatts(attrs)
+				
+				## Copy, by time blocks for the main variable
+				if not dims[:1] == ("time",) or len(dims) == 1:
+					ncvo[...] = ncvi[...]
+					continue
+				
+				set_chunk_cache( ncvo , chunks , nlat , nlon , max_memory )
+				ntime = len(ncfi.dimensions["time"])
+				block = aligned_block( max( 1 , ( max_memory or 2**30 ) // ( 8 * ncvi.dtype.itemsize * nlat * nlon ) ) , chunks )
+				for i0 in range(0,ntime,block):
+					i1 = min( i0 + block , ntime )
+					ncvo[i0:i1,...] = ncvi[i0:i1,...]
+			
+			## Global attributes
+			ncfo.setncatts( { att : ncfi.getncattr(att) for att in ncfi.ncattrs() } )
+##}}}
+
+def rechunk_files( path ):##{{{
+	
+	## Output files of path, a file or a directory (e.g. an area of the
+	## archive)
+	if os.path.isfile(path):
+		return [path]
+	return [ os.path.join( root , f ) for root,_,files in os.walk(path) for f in sorted(files) if f.endswith(".nc") and not f.startswith(".") ]
+##}}}
+
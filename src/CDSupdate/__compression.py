@@ -0,0 +1,216 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import time
+import logging
+import tempfile
+import dataclasses
+
+import numpy as np
+
+from .__lazy import LazyModule
+from .__lazy import lazy_import
+
+netCDF4 = LazyModule("netCDF4")
+zarr    = lazy_import("zarr")
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+## Codecs, and default compression levels
+codecs_level = { "none" : 0 , "zlib" : 5 , "zstd" : 3 , "blosc_lz4" : 5 , "bzip2" : 9 }
+
+## Profiles compared by the benchmark
+benchmark_profiles = ["none","zlib-5","zlib-1","zlib-1-shuffle","zlib-5-shuffle","zstd-3-shuffle","blosc_lz4-5-shuffle","bzip2-9"]
+
+## Cache of the available HDF5 filters
+_filters = {}
+
+
+#############
+## Classes ##
+#############
+
+@dataclasses.dataclass(frozen=True)
+class Compression:##{{{
+	
+	## Compression profile of a variable, written 'codec[-level][-shuffle]',
+	## e.g. 'zlib-5' (the default), 'zstd-3-shuffle' or 'none'.
+	
+	codec   : str  = "zlib"
+	level   : int  = 5
+	shuffle : bool = False
+	
+	@staticmethod
+	def from_str( s ):##{{{
+		
+		parts   = s.strip().split("-")
+		codec   = parts[0]
+		shuffle = len(parts) > 1 and parts[-1] == "shuffle"
+		if shuffle:
+			parts = parts[:-1]
+		if not codec in codecs_level or len(parts) > 2:
+			raise ValueError( f"Invalid compression profile: '{s}'" )
+		level = codecs_level[codec] if len(parts) == 1 else int(parts[1])
+		
+		return Compression( codec , level , shuffle )
+	##}}}
+	
+	def __str__(self):##{{{
+		if self.codec == "none":
+			return "none"
+		return f"{self.codec}-{self.level}" + ( "-shuffle" if self.shuffle else "" )
+	##}}}
+	
+	def is_available(self):##{{{
+		
+		if self.codec in ["none","zlib"]:
+			return True
+		
+		if not self.codec in _filters:
+			with netCDF4.Dataset( "filters.nc" , mode = "w" , diskless = True , persist = False ) as ncf:
+				has_filter = getattr( ncf , f"has_{self.codec.split('_')[0]}_filter" )
+				_filters[self.codec] = bool(has_filter())
+		
+		return _filters[self.codec]
+	##}}}
+	
+	def available( self , fmt = "netcdf" ):##{{{
+		
+		## The profile, or zlib with the same shuffle if the HDF5 plugin of the
+		## codec (or the zarr codec) is not available
+		if fmt == "zarr" and not self.codec == "bzip2":
+			return self
+		if fmt == "netcdf" and self.is_available():
+			return self
+		
+		fallback = Compression( "zlib" , codecs_level["zlib"] , self.shuffle )
+		logger.warning( f"Compression '{self}' not available, '{fallback}' used" )
+		
+		return fallback
+	##}}}
+	
+	def kwargs(self):##{{{
+		
+		## Arguments of netCDF4.Dataset.createVariable
+		if self.codec == "none":
+			return { "compression" : None , "shuffle" : self.shuffle }
+		
+		## Blosc has its own shuffle
+		if self.codec.startswith("blosc"):
+			return { "compression" : self.codec , "complevel" : self.level , "shuffle" : False , "blosc_shuffle" : int(self.shuffle) }
+		
+		return { "compression" : self.codec , "complevel" : self.level , "shuffle" : self.shuffle }
+	##}}}
+	
+	def zarr_kwargs(self):##{{{
+		
+		## Encoding of xarray.Dataset.to_zarr. zlib is written with the gzip
+		## codec (same deflate), the shuffle is only available with blosc
+		if self.codec == "none":
+			return { "compressors" : None }
+		if self.codec == "zstd":
+			return { "compressors" : [zarr.codecs.ZstdCodec( level = self.level )] }
+		if self.codec.startswith("blosc"):
+			return { "compressors" : [zarr.codecs.BloscCodec( cname = self.codec.split("_")[1] , clevel = self.level , shuffle = "shuffle" if self.shuffle else "noshuffle" )] }
+		
+		return { "compressors" : [zarr.codecs.GzipCodec( level = self.level )] }
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def parse_compression( s ):##{{{
+	
+	## 'profile' or 'profile,cvar:profile,...', returns a dict cvar => profile,
+	## with the key None for the default profile
+	out = { None : Compression() }
+	for item in s.split(","):
+		if ":" in item:
+			cvar,profile = item.split(":")
+			out[cvar.strip()] = Compression.from_str(profile)
+		else:
+			out[None] = Compression.from_str(item)
+	
+	return out
+##}}}
+
+def compression_benchmark( ifile , profiles = None , tmp = None ):##{{{
+	
+	## Write the main variable of ifile (e.g. a sample year) with each profile,
+	## and return a list of (profile,write time,read time,size), with None for
+	## the times and size of the profiles not available.
+	
+	profiles = benchmark_profiles if profiles is None else profiles
+	
+	## Read the data
+	with netCDF4.Dataset( ifile , mode = "r" ) as ncf:
+		cvar = [ v for v in ncf.variables if ncf.variables[v].ndim == 3 ][0]
+		X    = np.ma.filled( ncf.variables[cvar][:].astype(np.float32) , np.nan )
+	ntime,nlat,nlon = X.shape
+	
+	results = []
+	with tempfile.TemporaryDirectory( dir = tmp ) as tdir:
+		for profile in profiles:
+			profile = Compression.from_str(profile) if isinstance(profile,str) else profile
+			if not profile.is_available():
+				results.append( (str(profile),None,None,None) )
+				continue
+			
+			ofile = os.path.join( tdir , f"{profile}.nc" )
+			
+			## Write
+			t0 = time.perf_counter()
+			with netCDF4.Dataset( ofile , mode = "w" ) as ncf:
+				ncf.createDimension( "time" , None )
+				ncf.createDimension( "lat"  , nlat )
+				ncf.createDimension( "lon"  , nlon )
+				ncv = ncf.createVariable( cvar , "float32" , ("time","lat","lon") , fill_value = np.nan , chunksizes = (1,nlat,nlon) , **profile.kwargs() )
+				ncv[:] = X
+			t1 = time.perf_counter()
+			
+			## Read
+			with netCDF4.Dataset( ofile , mode = "r" ) as ncf:
+				ncf.variables[cvar][:]
+			t2 = time.perf_counter()
+			
+			results.append( (str(profile),t1 - t0,t2 - t1,os.path.getsize(ofile)) )
+			os.remove(ofile)
+	
+	return results
+##}}}
+
@@ -59,9 +59,98 @@ Input parameters
 --area name,xmin,xmax,ymin,ymax OR keyword
     Area, can be a grid, or a keyword, see area section.
 --keep-hourly
-    Keep also hourly data
+    Keep also hourly data. Without this option, the hourly data needed by the
+    extra variables are kept in memory, and are not written in the tmp
+    directory.
+--max-memory size
+    Memory budget (e.g. 16G, 512M). Conversion, extra variables and the final
+    merge are done by blocks of time fitting in half of this budget, the other
+    half keeps the hourly data in memory (spilled in the tmp directory if
+    exceeded). Default is to process one month of hourly data at once, with
+    half of the physical memory for the hourly data.
+--tmp-format netcdf|npy|memory
+    Format of the intermediate files in the tmp directory. 'netcdf' (default),
+    or 'npy' for raw float32 data with a JSON sidecar, memory-mapped by the
+    later stages (the pages are shared between processes through the OS page
+    cache). With 'memory' the intermediate data are kept in memory, nothing
+    is written in TMP/ERA5-AMIP (only the raw downloads), and only one merge
+    worker can be used.
+--merge-mode rewrite|append
+    How new data are merged in an existing file. 'rewrite' (default)
+    writes a new file with the old and new data. 'append' writes only the new
+    time steps in a copy of the existing file (time steps already present are
+    overwritten), renamed with the new time range: the old data are not
+    compressed again. The copy is a clone on the file systems supporting it
+    (btrfs, XFS), elsewhere the whole file is still copied. If the new time
+    steps can not be appended (before the start of the file, or missing in
+    the middle), the file is rewritten.
+--output-format netcdf|zarr
+    Format of the output files. 'netcdf' (default) is one file per period
+    (see --file-period). 'zarr' (requires the package zarr) is one store
+    'ERA5_cvar_freq_area.zarr' per variable with all the time steps, the new
+    time steps are appended in the store (--merge-mode and --file-period are
+    not used). The shuffle is only available with the blosc codec, and bzip2
+    is replaced by zlib. An update of a store is not atomic.
+--compression profile[,cvar:profile,...]
+    Compression of the output files, 'codec[-level][-shuffle]' with codec in
+    none, zlib, zstd, blosc_lz4 and bzip2. Default is 'zlib-5'. A profile can
+    be given per variable, e.g. 'zlib-1-shuffle,pr:zstd-3-shuffle'. If the
+    HDF5 plugin of a codec is not available, zlib is used.
+--lossy mode[,cvar:mode,...]
+    Lossy encoding of the output files, default is 'none'. Can be given per
+    variable, as for --compression.
+    - 'bitround[-nsb]': keep nsb bits of the mantissa (default in the column
+      'nsb' of ERA5-name.csv), the relative error is less than 2**-(nsb+1).
+    - 'pack': int16 packing with scale_factor / add_offset on the range
+      [valid_min,valid_max] of ERA5-name.csv, the absolute error is half a
+      step, (valid_max - valid_min) / 131068, up to the float32 rounding.
+      Values outside are clipped.
+--compression-benchmark file
+    Only compare the compression profiles (write time, read time and size) on
+    the output file 'file', e.g. a sample year.
+--chunking map|series|balanced|t,y,x
+    Chunks of the output files. 'map' (default) is one map per chunk, fast to
+    read maps. 'series' is one year (or one monthly file) per chunk on small
+    tiles, fast to read the time series of a few grid points. 'balanced' is
+    one month per chunk on larger tiles. Explicit sizes can be given with
+    't,y,x'.
+--rechunk path
+    Only rewrite the output file 'path' (or all files in the directory
+    'path') with the chunks of --chunking and the profile of --compression.
+--jobs-file jobs.toml
+    Only run all the jobs (updates) of the file 'jobs.toml', under global
+    limits, see 'About the jobs file'. The jobs are given by their options.
+--watch interval
+    Stay resident, and check the CDS every 'interval' (seconds, or e.g. '6h',
+    '30min'). Only the new days are downloaded and merged, see 'About the
+    watch mode'.
+--watch-status file
+    Status file (JSON) of --watch, default is
+    <output_dir>/ERA5/watch_<area>.json.
+--file-period month|year|decade
+    Period covered by an output file, default is 'year'. With monthly files,
+    an update of a few days only rewrites the last month. Must be the same
+    for all the updates of an output directory.
+--download-workers N
+    Number of parallel downloads, default is 1. The downloads run during the
+    conversion of the years already downloaded.
+--queue-years N
+    Number of years downloaded ahead of the year processed, default is 2.
+--merge-workers N
+    Number of processes for the final merge and compression, default is 1.
+    Each (frequency, variable, file) is merged independently, the logs are
+    kept in order, and a failed merge does not stop the others.
+--upload-workers N
+    Number of parts of a file sent in parallel by the multipart upload to S3,
+    default is 4.
 --output-dir output_directory
-    Output directory.
+    Output directory. Can be the url of an object store (e.g. s3://bucket/path,
+    requires the package fsspec, and s3fs for S3). The files are then written
+    in a staging directory in the tmp directory, the old files are fetched
+    only when a merge needs them, and the new files are uploaded at the end of
+    each merge. The options of the file system are given by the fsspec
+    environment variables, e.g. FSSPEC_S3_ENDPOINT_URL for a local MinIO.
+    Not available with the zarr output format.
 --tmp temporary_directory
     Temporary directory used to download data before formatting.
 --help
@@ -83,6 +172,97 @@ About the variables
   saturated vapor pressure (from temperature) (see [1], table 4.2b).
 - Heat Index HI is computed with the NOAA equation (see [2])
 
+About the catalog
+-----------------
+The output files are listed in the sqlite database catalog.sqlite of
+<output_dir>/ERA5, table 'files', updated after each written file (one
+transaction per file): path (relative to <output_dir>/ERA5), area, freq,
+cvar, first and last time
+steps t0 / t1, number of time steps nsteps, grid, compression and lossy
+profiles, era5t (1 if the file has ERA5T preliminary data) and era5t_start
+(first ERA5T time step), sha256 and the date of the update. The merge finds
+the old files with the catalog. If it does not exist, it is built from the
+names of the files of the tree (the other columns are filled when the files
+are rewritten). Before a merge, the catalog of a variable is checked against
+its directory: the rows of the missing files are removed, the files added by
+hand are added (except if the catalog has already a file for their period).
+A replaced file is removed only after the new one is in the catalog. Files
+rewritten by --rechunk are updated in the catalog (sha256 and compression).
+
+About the index
+---------------
+After each update, the files of a variable are indexed in its directory, to
+open all the time steps as one dataset without reading each file:
+- ERA5_cvar_freq_area.ncml, NcML aggregation of the files along time (for
+  the netCDF-Java tools, e.g. THREDDS or Panoply),
+- ERA5_cvar_freq_area.json, kerchunk references of the chunks of the files
+  (requires the package kerchunk), opened with xarray by
+  xr.open_dataset( "reference://" , engine = "zarr" ,
+      backend_kwargs = {{ "consolidated" : False ,
+      "storage_options" : {{ "fo" : <json file> }} }} )
+  With an object store, the references are the urls of the files, give the
+  options of the file system with "remote_protocol" and "remote_options" in
+  the storage_options.
+  The references of the files are kept in the catalog. Not written if the
+  time chunks are cut by the end of the files (e.g. --chunking series).
+  The indexes of the files rewritten by --rechunk are rebuilt.
+No index is written for the zarr output format.
+
+Reading the output
+------------------
+In python, CDSupdate.open( area , cvar , freq , period = None , bbox = None ,
+points = None , root = <output_dir> ) returns the xarray dataset of a variable.
+The files of the period (e.g. '2020/2022-06') are found with the catalog,
+and only the chunks of the selection are read. bbox is
+lon_min,lon_max,lat_min,lat_max, points is a list of (lon,lat), the nearest
+grid points are selected along the dimension 'point'. The last opened files
+are kept open for the next calls. With dask, the dataset is lazy.
+
+About the jobs file
+-------------------
+A jobs file (TOML) gives the global limits, the options of all the jobs, and
+the options of each job (names of the options without '--'):
+
+    [limits]
+    download_workers = 4       ## Concurrent requests to the CDS, all jobs
+    cpu_workers      = 4       ## Processes of the merges, all jobs
+    max_tmp          = "100G"  ## Size of the tmp directory, all jobs
+    jobs             = 4       ## Jobs run concurrently
+    
+    [defaults]
+    output-dir = "data/"
+    
+    [[job]]
+    name   = "sfcWind-NA"
+    cvars  = "sfcWind"
+    area   = "NorthAtlantic"
+    period = "2024-06-01/"
+    keep-hourly = true
+
+An identical raw request of several jobs (same variable, area and dates) is
+downloaded only once. The conversions of the jobs are serialized (HDF5 is not
+thread safe), their downloads and merges overlap. A year of a job starts only
+if its estimated size fits in max_tmp, the files of a year are removed from
+the tmp directory once merged. --tmp and --log are given on the command line,
+the download and merge workers by the limits.
+
+About the watch mode
+--------------------
+With --watch, cdsupdate is a daemon replacing the periodic runs (e.g. cron).
+At each check, the last day of the output files (from the catalog) is
+compared with the last day in the CDS (asked to the CDS, or estimated with
+the lag of ERA5T, 5 days). If new days are available, they are downloaded
+and merged, else nothing is done. The start of --period is the first day of
+the data, its end is not used. The imports, the metadata, the grids and the
+clients of the CDS are kept between the checks. SIGTERM or SIGINT stop the
+watch after the current update. The status file gives the pid, the state
+(checking, updating, idle, error or stopped), the number of cycles, updates
+and consecutive failures, the last check, the last day in the CDS and in
+the output files, the last update and its period, the last error and the
+next check. A monitoring can check that the pid is alive and that
+next_check is not in the past. With an object store, the default status file
+is in the tmp directory.
+
 About the area
 --------------
 You can pass a box, or the following keywords:
@@ -23,29 +23,33 @@
 import sys,os
 import datetime as dt
 import logging
-
-import cdsapi
+import importlib.metadata
 
 import numpy  as np
-import pandas as pd
-import xarray as xr
-import netCDF4
 
 
 #############
 ## Imports ##
 #############
 
+from .__CDSUParams import CDSUParams
 from .__CDSUParams import cdsuParams
+from .__CDSUParams import use_params
+from .__CDSUParams import with_params
 from .__release    import version
 
 from .__exceptions import AbortForHelpException
 from .__exceptions import NoUserInputException
 
-from .__io import load_data_CDS
-from .__io import BRUT_to_AMIP_format
-from .__io import merge_AMIP_CF_format
-from .__extracvars import build_EXTRA_cvars
+from .__pipeline import run_pipeline
+from .__compression import benchmark_profiles
+from .__compression import compression_benchmark
+from .__chunking import rechunk_file
+from .__chunking import rechunk_files
+from .__catalog import catalog_rechunked
+from .__index import reindex
+from .__jobs import run_jobs
+from .__watch import run_watch
 
 from .__curses_doc import print_doc
 
@@ -62,13 +66,15 @@ logger.addHandler(logging.NullHandler())
 ## Functions ##
 ###############
 
-
+@with_params
 def run_cdsupdate():##{{{
 	"""
 	CDSupdate.run_cdsupdate
 	=======================
 	
-	Main execution, after the control of user input.
+	Main execution, after the control of user input. The keyword argument
+	params (a CDSUParams) is the context of the run, by default the current
+	parameters.
 	
 	"""
 	
@@ -78,17 +84,61 @@ def run_cdsupdate():##{{{
 	for key in cdsuParams.cdsApiParams:
 		logger.info( " * {} / {}".format(*key) )
 	
-	## Download data
-	load_data_CDS()
+	## Download, change data format, build extra variables and merge with
+	## current data, year by year. The downloads of the next years run during
+	## the processing of a year. The hourly data are kept in memory between
+	## the conversion and the extra variables, and written in the TMP
+	## directory only if needed (--keep-hourly, or memory budget exceeded)
+	run_pipeline()
 	
-	## Change data format
-	BRUT_to_AMIP_format()
+##}}}
+
+def run_compression_benchmark():##{{{
+	"""
+	CDSupdate.run_compression_benchmark
+	===================================
 	
-	## Extra variables
-	build_EXTRA_cvars()
+	Compare the compression profiles on an output file (e.g. a sample year).
 	
-	## And now merge with current data
-	merge_AMIP_CF_format()
+	"""
+	
+	profiles = benchmark_profiles + [ str(p) for p in cdsuParams.compression.values() if not str(p) in benchmark_profiles ]
+	results  = compression_benchmark( cdsuParams.compression_benchmark , profiles , cdsuParams.tmp )
+	
+	print( "{:<22}{:>12}{:>12}{:>14}".format( "Profile" , "Write (s)" , "Read (s)" , "Size (MB)" ) )
+	for profile,twrite,tread,size in results:
+		if size is None:
+			print( "{:<22}{:>38}".format( profile , "not available" ) )
+		else:
+			print( "{:<22}{:>12.3f}{:>12.3f}{:>14.3f}".format( profile , twrite , tread , size / 1024**2 ) )
+	
+##}}}
+
+def run_rechunk():##{{{
+	"""
+	CDSupdate.run_rechunk
+	=====================
+	
+	Rewrite the output files of --rechunk with new chunks and compression.
+	The files of an archive are updated in its catalog, and the indexes of
+	their variables are rebuilt.
+	
+	"""
+	
+	logger.info( "Rechunk:" )
+	keys = set()
+	for ifile in rechunk_files(cdsuParams.rechunk):
+		
+		## Profile of the variable of the file (ERA5_cvar_freq_area_...)
+		compression = cdsuParams.compression_profile( os.path.basename(ifile).split("_")[1] )
+		logger.info( f" * Rechunk '{ifile}' ({compression})" )
+		rechunk_file( ifile , cdsuParams.chunking , compression , cdsuParams.max_memory , cdsuParams.file_period )
+		key = catalog_rechunked( ifile , compression )
+		if key is not None:
+			keys.add(key)
+	
+	for key in sorted(keys):
+		reindex(*key)
 	
 ##}}}
 
@@ -101,6 +151,14 @@ def start_cdsupdate( argv ):##{{{
 	
 	"""
 	
+	## Each call has its own parameters (the context of the run), read by all
+	## the stages, so several calls can run concurrently in one process
+	with use_params(CDSUParams()):
+		_start_cdsupdate(argv)
+	
+##}}}
+
+def _start_cdsupdate( argv ):##{{{
 	
 	## Time counter
 	walltime0 = dt.datetime.utcnow()
@@ -128,17 +186,14 @@ def start_cdsupdate( argv ):##{{{
 	logger.info( "Start: {}".format( str(walltime0)[:19] + " (UTC)") )
 	logger.info(cdsuParams.LINE)
 	
-	## Package version
-	pkgs = [("numpy"      , np ),
-	        ("pandas"     , pd ),
-	        ("xarray"     , xr ),
-	        ("netCDF4"    , netCDF4 )
-	       ]
+	## Package version, from the metadata of the installed packages (they are
+	## not imported)
+	pkgs = ["numpy","pandas","xarray","netCDF4"]
 	
 	logger.info( "Packages version:" )
 	logger.info( " * {:{fill}{align}{n}}".format( "CDSupdate" , fill = " " , align = "<" , n = 12 ) + f"version {version}" )
-	for name_pkg,pkg in pkgs:
-		logger.info( " * {:{fill}{align}{n}}".format( name_pkg , fill = " " , align = "<" , n = 12 ) +  f"version {pkg.__version__}" )
+	for name_pkg in pkgs:
+		logger.info( " * {:{fill}{align}{n}}".format( name_pkg , fill = " " , align = "<" , n = 12 ) +  f"version {importlib.metadata.version(name_pkg)}" )
 	logger.info(cdsuParams.LINE)
 	
 	## Serious functions start here
@@ -161,7 +216,16 @@ def start_cdsupdate( argv ):##{{{
 			raise cdsuParams.error
 		
 		## Go
-		run_cdsupdate()
+		if cdsuParams.compression_benchmark is not None:
+			run_compression_benchmark()
+		elif cdsuParams.jobs_file is not None:
+			run_jobs(cdsuParams.jobs_file)
+		elif cdsuParams.rechunk is not None:
+			run_rechunk()
+		elif cdsuParams.watch is not None:
+			run_watch(argv)
+		else:
+			run_cdsupdate()
 		
 	except AbortForHelpException:
 		print_doc()
@@ -23,9 +23,9 @@
 import sys,os
 import datetime as dt
 import logging
+import contextlib
 
 import numpy  as np
-import xarray as xr
 
 
 #############
@@ -33,6 +33,22 @@ import xarray as xr
 #############
 
 from .__CDSUParams import cdsuParams
+from .__CDSUParams import with_params
+from .__workers import hdf5_serialized
+from .__blocks import day_blocks
+from .__blocks import daily_reduce
+from .__tmpfiles import TmpWriter
+from .__tmpfiles import list_tmp
+from .__tmpfiles import open_tmp
+from .__store import HourlyStore
+from .__io import find_grid
+from .__thermo import Workspace
+from .__thermo import wind_speed
+from .__thermo import relative_humidity
+from .__thermo import specific_humidity
+from .__thermo import upper_bound_tas
+from .__thermo import heat_index_noaa
+from .__thermo import heat_index_blazejczyk
 
 
 ##################
@@ -69,13 +85,52 @@ def kelvin2fahrenheit(T):
 
 ##}}}
 
-def build_ubtas():##{{{
+def _build_cvar( store , years , cvar , cvars_in , kernel = None , how = "mean" , hourly = True , static = None ):##{{{
 	
-	## Constant
-	Lv      = 2.5008 * 1e6 ## Latent heat of vaporization
-	cp      = 1004.7090    ## Specific heat of air at constant pressure
-	g       = 9.80665      ## Gravitational constant
-	epsilon = 0.0180153 / 0.028964
+	## Build cvar from the hourly cvars_in of the store, by time blocks.
+	## kernel is a function of CDSupdate.__thermo (None to keep cvars_in[0]),
+	## how the daily reduction, and hourly if hourly data must be saved.
+	
+	area_name = cdsuParams.area_name
+	static    = [] if static is None else static
+	
+	## Years available for all the cvars_in
+	if years is None:
+		ipath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , cvars_in[0] )
+		years = sorted( set( f.split("_")[-1][:4] for f in list_tmp(ipath) ) )
+	
+	## Loop on years
+	for year in years:
+		
+		## Hourly inputs, in memory or opened from TMP/ERA5-AMIP/hr
+		inputs = [ store.get( c , year ) for c in cvars_in ]
+		if any( i is None for i in inputs ):
+			continue
+		time   = inputs[0][0]
+		grid   = find_grid(inputs[0][1])
+		
+		## Block size, inputs + output + temporaries of the kernel
+		block = cdsuParams.time_block( 4 * grid.nlat * grid.nlon , nbuffers = len(cvars_in) + 8 , align = 24 )
+		ws    = Workspace()
+		
+		with contextlib.ExitStack() as stack:
+			wrtd = stack.enter_context( TmpWriter( cdsuParams.tmp , cvar , "day" , area_name , grid.lat , grid.lon , cdsuParams.tmp_format ) )
+			wrth = stack.enter_context( store.writer( cvar , year , time , grid ) ) if hourly else None
+			
+			for sl in day_blocks( time , block ):
+				X = [ np.asarray( X[sl] , dtype = np.float32 ) for _,X in inputs ]
+				if kernel is None:
+					Y = X[0]
+				else:
+					Y = kernel( *X , *static , out = ws( "out" , X[0].shape ) , ws = ws )
+				
+				if hourly:
+					wrth.append( time[sl] , Y )
+				wrtd.append( *daily_reduce( time[sl] , Y , how ) )
+	
+##}}}
+
+def build_ubtas( store , years = None ):##{{{
 	
 	## ta500: temperature at 500hPa
 	## zg500: geopotential at 500hPa
@@ -87,465 +142,78 @@ def build_ubtas():##{{{
 	
 	## Open orography
 	ipath_orog = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "fx" , "orog"  )
-	idata_orog = xr.open_dataset( os.path.join( ipath_orog , f"ERA5-AMIP_orog_fx_{area_name}.nc" ) )
-	
-	## files
-	ipath_ta500  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "ta500" )
-	ipath_zg500  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "zg500" )
-	ipath_huss   = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "huss"  )
-	ifiles_ta500 = sorted(os.listdir(ipath_ta500))
-	ifiles_zg500 = sorted(os.listdir(ipath_zg500))
-	ifiles_huss  = sorted(os.listdir(ipath_huss))
+	with open_tmp( os.path.join( ipath_orog , f"ERA5-AMIP_orog_fx_{area_name}.nc" ) ) as idata_orog:
+		orog = idata_orog["orog"].values.astype(np.float32)
 	
-	## Loop on files
-	for ifile_ta500,ifile_zg500,ifile_huss in zip(ifiles_ta500,ifiles_zg500,ifiles_huss):
-		
-		## Open data
-		idata_ta500 = xr.open_dataset( os.path.join( ipath_ta500 , ifile_ta500 ) )
-		idata_zg500 = xr.open_dataset( os.path.join( ipath_zg500 , ifile_zg500 ) )
-		idata_huss  = xr.open_dataset( os.path.join( ipath_huss  , ifile_huss  ) )
-		
-		## Output
-		odatah = idata_huss.copy( deep = True ).rename( huss = "ubtas" )
-		
-		## Specific humidity saturation at 500hPa from Clausius-Clapeyron relation
-		hus_sat = epsilon * 6.11 * np.exp( Lv / 461.52 * ( 1 / 273.15 - 1 / idata_ta500['ta500'] ) ) / 500
-		
-		## And compute upper bound
-		ubtas   = idata_ta500['ta500'] + Lv / cp * (hus_sat - idata_huss['huss']) + g / cp * (idata_zg500['zg500'] - idata_orog['orog'])
-		odatah['ubtas'] = ubtas[:,0,:,:].drop("pressure_level")
-		
-		## Build daily
-		year   = odatah.time.dt.year[0].values
-		dtime  = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(odatah.time.dt.dayofyear.values)]
-		odatad = odatah.groupby("time.dayofyear").max().rename( dayofyear = "time" ).assign_coords( time = dtime )
-		
-		## Save hourly
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "ubtas" )
-		t0    = str(odatah.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatah.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_ubtas_hr_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/hr/ubtas/{ofile}'" )
-		odatah.to_netcdf( os.path.join( opath , ofile ) )
-		
-		## Save daily
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , "ubtas" )
-		t0    = str(odatad.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatad.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_ubtas_day_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/day/ubtas/{ofile}'" )
-		odatad.to_netcdf( os.path.join( opath , ofile ) )
+	## Upper bound, daily is the max
+	_build_cvar( store , years , "ubtas" , ["ta500","zg500","huss"] , upper_bound_tas , how = "max" , static = [orog] )
 ##}}}
 
-def build_sfcWind():##{{{
-	
-	area_name = cdsuParams.area_name
-	
-	## files
-	ipathu  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "uas" )
-	ipathv  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "vas" )
-	ifilesu = os.listdir(ipathu)
-	ifilesv = os.listdir(ipathv)
-	ifilesu.sort()
-	ifilesv.sort()
-	
-	for ifileu,ifilev in zip(ifilesu,ifilesv):
-		
-		idatau = xr.open_dataset( os.path.join( ipathu , ifileu ) )
-		idatav = xr.open_dataset( os.path.join( ipathv , ifilev ) )
-		
-		year  = idatau.time.dt.year[0].values
-		dtime = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(idatau.time.dt.dayofyear.values)]
-		
-		## Build hourly sfcWind
-		odatah = idatau.copy( deep = True ).rename( uas = "sfcWind" )
-		odatah["sfcWind"] = np.sqrt( idatau["uas"]**2 + idatav["vas"]**2 )
-		
-		## Build daily
-		odatad = odatah.groupby("time.dayofyear").mean().rename( dayofyear = "time" ).assign_coords( time = dtime )
-		
-		## Save hourly
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "sfcWind" )
-		t0    = str(odatah.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatah.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_sfcWind_hr_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/hr/sfcWind/{ofile}'" )
-		odatah.to_netcdf( os.path.join( opath , ofile ) )
-		
-		## Save daily
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , "sfcWind" )
-		t0    = str(odatad.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatad.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_sfcWind_day_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/day/sfcWind/{ofile}'" )
-		odatad.to_netcdf( os.path.join( opath , ofile ) )
-	
+def build_sfcWind( store , years = None ):##{{{
+	_build_cvar( store , years , "sfcWind" , ["uas","vas"] , wind_speed )
 ##}}}
 
-def build_hurs():##{{{
-	
-	cvar = "hurs"
-	area_name = cdsuParams.area_name
-	
-	## files
-	ipathD  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "dptas" )
-	ipathT  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" ,   "tas" )
-	ifilesD = os.listdir(ipathD)
-	ifilesT = os.listdir(ipathT)
-	ifilesD.sort()
-	ifilesT.sort()
-	
-	for ifileD,ifileT in zip(ifilesD,ifilesT):
-		
-		idataD = xr.open_dataset( os.path.join( ipathD , ifileD ) )
-		idataT = xr.open_dataset( os.path.join( ipathT , ifileT ) )
-		
-		year  = idataT.time.dt.year[0].values
-		dtime = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(idataD.time.dt.dayofyear.values)]
-		
-		## Build hourly hurs
-		odatah = idataD.copy( deep = True ).rename( dptas = cvar )
-		eD     = 6.1078 * np.exp( 17.1 * ( idataD["dptas"] - 273.15 ) / ( 235 + idataD["dptas"] - 273.15 ) )
-		eT     = 6.1078 * np.exp( 17.1 * ( idataT[  "tas"] - 273.15 ) / ( 235 + idataT[  "tas"] - 273.15 ) )
-		odatah[cvar] = eD / eT * 100
-		
-		## Build daily
-		odatad = odatah.groupby("time.dayofyear").mean().rename( dayofyear = "time" ).assign_coords( time = dtime )
-		
-		## Save hourly
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar )
-		t0    = str(odatah.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatah.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvar}_hr_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/hr/{cvar}/{ofile}'" )
-		odatah.to_netcdf( os.path.join( opath , ofile ) )
-		
-		## Save daily
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , cvar )
-		t0    = str(odatad.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatad.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvar}_day_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/day/{cvar}/{ofile}'" )
-		odatad.to_netcdf( os.path.join( opath , ofile ) )
+def build_hurs( store , years = None ):##{{{
+	_build_cvar( store , years , "hurs" , ["dptas","tas"] , relative_humidity )
 ##}}}
 
-def build_huss():##{{{
-	
-	cvar = "huss"
-	area_name = cdsuParams.area_name
-	
-	## files
-	ipathD  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , "dptas" )
-	ipathP  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" ,    "ps" )
-	ifilesD = os.listdir(ipathD)
-	ifilesP = os.listdir(ipathP)
-	ifilesD.sort()
-	ifilesP.sort()
-	
-	for ifileD,ifileP in zip(ifilesD,ifilesP):
-		
-		idataD = xr.open_dataset( os.path.join( ipathD , ifileD ) )
-		idataP = xr.open_dataset( os.path.join( ipathP , ifileP ) )
-		
-		year  = idataP.time.dt.year[0].values
-		dtime = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(idataP.time.dt.dayofyear.values)]
-		
-		## Build hourly huss
-		odatah = idataD.copy( deep = True ).rename( dptas = cvar )
-		rdry   = 287.0597
-		rvap   = 461.5250
-		a1     = 611.21
-		a3     = 17.502
-		a4     = 32.19
-		T0     = 273.16
-		
-		E            = a1 * np.exp( a3 * ( idataD["dptas"] - T0 ) / ( idataD["dptas"] - a4 ) )
-		odatah[cvar] = E * ( rdry / rvap ) / ( idataP["ps"] - ( E * ( 1 - rdry / rvap ) ) )
-		
-		## Build daily
-		odatad = odatah.groupby("time.dayofyear").mean().rename( dayofyear = "time" ).assign_coords( time = dtime )
-		
-		## Save hourly
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar )
-		t0    = str(odatah.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatah.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvar}_hr_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/hr/{cvar}/{ofile}'" )
-		odatah.to_netcdf( os.path.join( opath , ofile ) )
-		
-		## Save daily
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , cvar )
-		t0    = str(odatad.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatad.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvar}_day_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/day/{cvar}/{ofile}'" )
-		odatad.to_netcdf( os.path.join( opath , ofile ) )
+def build_huss( store , years = None ):##{{{
+	_build_cvar( store , years , "huss" , ["dptas","ps"] , specific_humidity )
 ##}}}
 
-def _build_HI_method_blazejczyk():##{{{
-	cvar = "HI"
-	area_name = cdsuParams.area_name
-	
-	## files
-	cvar0   = "tas"
-	ipath0  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar0 )
-	ifiles0 = os.listdir(ipath0)
-	ifiles0.sort()
-	cvar1   = "hurs"
-	ipath1  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar1 )
-	ifiles1 = os.listdir(ipath1)
-	ifiles1.sort()
-	
-	for ifile0,ifile1 in zip(ifiles0,ifiles1):
-		
-		idata0 = xr.open_dataset( os.path.join( ipath0 , ifile0 ) )
-		idata1 = xr.open_dataset( os.path.join( ipath1 , ifile1 ) )
-		
-		## Build hourly HI
-		odatah = idata0.copy( deep = True ).rename( { cvar0 : cvar } )
-		year  = idata0.time.dt.year[0].values
-		dtime = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(idata0.time.dt.dayofyear.values)]
-		
-		c0     = -8.784695
-		c1     = 1.61139411
-		c2     = 2.338549
-		c3     = -0.14611605
-		c4     = -1.2308094e-2
-		c5     = -1.6424828e-2
-		c6     = 2.211732e-3
-		c7     = 7.2546e-4
-		c8     = -3.582e-6
-		T      = idata0[cvar0] - 273.15
-		H      = idata1[cvar1].round(0)
-		
-		odatah[cvar] = 273.15 + c0 + c1 * T + c2 * H + c3 * T * H + c4 * T**2 + c5 * H**2 + c6 * T**2 * H + c7 * T * H**2 + c8 * T**2 * H**2
-		odatah[cvar] = odatah[cvar].where( T > 20 , np.nan )
-		
-		## Build daily
-		odatad = odatah.groupby("time.dayofyear").mean().rename( dayofyear = "time" ).assign_coords( time = dtime )
-		
-		## Save hourly
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar )
-		t0    = str(odatah.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatah.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvar}_hr_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/hr/{cvar}/{ofile}'" )
-		odatah.to_netcdf( os.path.join( opath , ofile ) )
-		
-		## Save daily
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , cvar )
-		t0    = str(odatad.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatad.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvar}_day_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/day/{cvar}/{ofile}'" )
-		odatad.to_netcdf( os.path.join( opath , ofile ) )
+def _build_HI_method_blazejczyk( store , years = None ):##{{{
+	_build_cvar( store , years , "HI" , ["tas","hurs"] , heat_index_blazejczyk )
 ##}}}
 
-def _build_HI_method_noaa():##{{{
-	cvar = "HI"
-	area_name = cdsuParams.area_name
-	
-	## files
-	cvar0   = "tas"
-	ipath0  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar0 )
-	ifiles0 = os.listdir(ipath0)
-	ifiles0.sort()
-	cvar1   = "hurs"
-	ipath1  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar1 )
-	ifiles1 = os.listdir(ipath1)
-	ifiles1.sort()
+def _build_HI_method_noaa( store , years = None ):##{{{
 	
-	for ifile0,ifile1 in zip(ifiles0,ifiles1):
-		
-		idata0 = xr.open_dataset( os.path.join( ipath0 , ifile0 ) )
-		idata1 = xr.open_dataset( os.path.join( ipath1 , ifile1 ) )
-		
-		## Build hourly HI
-		odatah = idata0.copy( deep = True ).rename( { cvar0 : cvar } )
-		year  = idata0.time.dt.year[0].values
-		dtime = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(idata0.time.dt.dayofyear.values)]
-		
-		## Variables
-		T = kelvin2fahrenheit(idata0[cvar0])
-		H = idata1[cvar1].round(0)
-		
-		## Constants
-		c0 = -42.379
-		c1 =   2.04901523
-		c2 =  10.14333127
-		c3 =  -0.22475541
-		c4 =  -0.00683783
-		c5 =  -0.05481717
-		c6 =   0.00122874
-		c7 =   0.00085282
-		c8 =  -0.00000199
-		
-		## Heat Index
-		HI = c0 + c1 * T + c2 * H + c3 * T * H + c4 * T**2 + c5 * H**2 + c6 * T**2 * H + c7 * T * H**2 + c8 * T**2 * H**2
-		
-		## Correction for extremes
-		HIA1 = ( 13 - H ) /  4 * np.sqrt( ( 17 - np.abs( T - 95 ) ) / 17 )
-		HIA2 = ( H - 85 ) / 10 * ( ( 87 - T ) / 5 )
-		HIL  = 0.5 * ( T + 61 + 1.2 * (T - 68) + 0.094 * H )
-		
-		HI = HI.where( ~( ( H < 13. ) & (T > 80.) & (T < 112) ) , HI - HIA1 )
-		HI = HI.where( ~( ( H > 85. ) & (T > 80.) & (T <  87) ) , HI + HIA2 )
-		HI = HI.where( HIL > 80. , HIL )
-		
-		odatah[cvar] = fahrenheit2kelvin(HI)
-		
-		## Build daily
-		odatad = odatah.groupby("time.dayofyear").mean().rename( dayofyear = "time" ).assign_coords( time = dtime )
-		
-		## Save hourly
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar )
-		t0    = str(odatah.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatah.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvar}_hr_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/hr/{cvar}/{ofile}'" )
-		odatah.to_netcdf( os.path.join( opath , ofile ) )
-		
-		## Save daily
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , cvar )
-		t0    = str(odatad.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatad.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvar}_day_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/day/{cvar}/{ofile}'" )
-		odatad.to_netcdf( os.path.join( opath , ofile ) )
-		
+	## Heat Index, with correction for extremes (see CDSupdate.__thermo)
+	_build_cvar( store , years , "HI" , ["tas","hurs"] , heat_index_noaa )
 ##}}}
 
-def build_HI( method = "noaa" ):##{{{
+def build_HI( store , years = None , method = "noaa" ):##{{{
 	
 	if method == "noaa":
-		_build_HI_method_noaa()
+		_build_HI_method_noaa( store , years )
 	else:
-		_build_HI_method_blazejczyk()
+		_build_HI_method_blazejczyk( store , years )
 	
 ##}}}
 
-def build_cvarmin( cvar ):##{{{
-	
-	cvarN = f"{cvar}min"
-	area_name = cdsuParams.area_name
-	
-	## files
-	ipath  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar )
-	ifiles = os.listdir(ipath)
-	ifiles.sort()
-	
-	
-	for ifile in ifiles:
-		
-		idata = xr.open_dataset( os.path.join( ipath , ifile ) )
-		
-		year  = idata.time.dt.year[0].values
-		dtime = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(idata.time.dt.dayofyear.values)]
-		
-		## Build daily
-		odatad = idata.groupby("time.dayofyear").min().rename( dayofyear = "time" ).assign_coords( time = dtime ).rename( { cvar : cvarN } )
-		
-		## Save daily
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , cvarN )
-		t0    = str(odatad.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatad.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvarN}_day_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/day/{cvarN}/{ofile}'" )
-		odatad.to_netcdf( os.path.join( opath , ofile ) )
+def build_cvarmin( store , cvar , years = None ):##{{{
+	_build_cvar( store , years , f"{cvar}min" , [cvar] , how = "min" , hourly = False )
 ##}}}
 
-def build_cvarmax( cvar ):##{{{
-	
-	cvarX = f"{cvar}max"
-	area_name = cdsuParams.area_name
-	
-	## files
-	ipath  = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar )
-	ifiles = os.listdir(ipath)
-	ifiles.sort()
-	
-	
-	for ifile in ifiles:
-		
-		idata = xr.open_dataset( os.path.join( ipath , ifile ) )
-		
-		year  = idata.time.dt.year[0].values
-		dtime = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(idata.time.dt.dayofyear.values)]
-		
-		## Build daily
-		odatad = idata.groupby("time.dayofyear").max().rename( dayofyear = "time" ).assign_coords( time = dtime ).rename( { cvar : cvarX } )
-		
-		## Save daily
-		opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , cvarX )
-		t0    = str(odatad.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-		t1    = str(odatad.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-		ofile = f"ERA5-AMIP_{cvarX}_day_{area_name}_{t0}-{t1}.nc"
-		target = os.path.join( opath , ofile )
-		if not os.path.isdir(opath):
-			os.makedirs(opath)
-		logger.info( f" * Save 'TMP/ERA5-AMIP/day/{cvarX}/{ofile}'" )
-		odatad.to_netcdf( os.path.join( opath , ofile ) )
+def build_cvarmax( store , cvar , years = None ):##{{{
+	_build_cvar( store , years , f"{cvar}max" , [cvar] , how = "max" , hourly = False )
 ##}}}
 
-def build_EXTRA_cvars():##{{{
+@with_params
+@hdf5_serialized
+def build_EXTRA_cvars( store = None , years = None ):##{{{
+	
+	## Without store, the hourly data are read from TMP/ERA5-AMIP/hr
+	if store is None:
+		store = HourlyStore( cdsuParams.tmp , cdsuParams.area_name , keep_hourly = True , fmt = cdsuParams.tmp_format )
 	
 	cvars_cmp = cdsuParams.cvars_cmp
 	for cvar in cvars_cmp:
 		logger.info( f"Build EXTRA cvar '{cvar}'" )
 		
 		if cvar[-3:] == "min":
-			build_cvarmin( cvar[:-3] )
+			build_cvarmin( store , cvar[:-3] , years )
 		if cvar[-3:] == "max":
-			build_cvarmax( cvar[:-3] )
+			build_cvarmax( store , cvar[:-3] , years )
 		if cvar == "sfcWind":
-			build_sfcWind()
+			build_sfcWind( store , years )
 		if cvar == "hurs":
-			build_hurs()
+			build_hurs( store , years )
 		if cvar == "huss":
-			build_huss()
+			build_huss( store , years )
 		if cvar == "HI":
-			build_HI()
+			build_HI( store , years )
 		if cvar == "ubtas":
-			build_ubtas()
+			build_ubtas( store , years )
 	
 ##}}}
 
@@ -0,0 +1,218 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import logging
+import threading
+import concurrent.futures
+
+from .__lazy import LazyModule
+
+xr = LazyModule("xarray")
+
+
+#############
+## Imports ##
+#############
+
+from .__CDSUParams import CDSUParams
+from .__CDSUParams import use_params
+from .__tmpfiles import list_tmp
+from .__tmpfiles import open_tmp
+from .__tmpfiles import release_tmp
+from .__workers import hdf5_lock
+from .__pipeline import run_pipeline
+from .__io import merge_AMIP_CF_format
+from .__io import build_gattrs
+from .__io import find_grid
+from .__io import _zarr_coords
+from .__io import _zarr_attrs
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Functions ##
+###############
+
+## Library API, exported as CDSupdate.fetch: the download, conversion and
+## extra variables are run with the intermediate files in memory (tmp format
+## 'memory'), and the datasets are built from them, without writing the
+## output files. The merge in the output directory can be done after, in a
+## background thread (persist).
+
+def _argv( cvars , area , period , freq , output_dir , kwargs ):##{{{
+	
+	## Arguments of 'cdsupdate' of the fetch, kwargs are the other options
+	## (e.g. download_workers = 4 for --download-workers 4)
+	if not isinstance(cvars,str):
+		cvars = ",".join(cvars)
+	if not isinstance(area,str):
+		area = ",".join( str(x) for x in area )
+	if not isinstance(period,str):
+		period = "/".join( str(t) for t in period )
+	
+	argv = ["--cvars",cvars,"--area",area,"--period",period,"--tmp-format","memory"]
+	if output_dir is not None:
+		argv = argv + ["--output-dir",output_dir]
+	if freq == "hr":
+		argv = argv + ["--keep-hourly"]
+	for key,value in kwargs.items():
+		if value is False or value is None:
+			continue
+		argv = argv + [ "--" + key.replace("_","-") ]
+		if value is not True:
+			argv = argv + [str(value)]
+	
+	return argv
+##}}}
+
+def _dataset( params , cvar , freq ):##{{{
+	
+	## Dataset of cvar from the intermediate data of the run, with the
+	## coordinates and attributes of the output files
+	avar,level = params.cvarsParams.split_level(cvar)
+	height     = params.cvarsParams.height(cvar) if level == "single" else level
+	if cvar == "orog":
+		freq = "fx"
+	ipath  = os.path.join( params.tmp , "ERA5-AMIP" , freq , cvar )
+	ifiles = list_tmp(ipath)
+	if len(ifiles) == 0:
+		return None
+	
+	ldata = [ open_tmp( os.path.join( ipath , ifile ) ) for ifile in ifiles ]
+	if len(ldata) == 1:
+		data = ldata[0][[cvar]]
+	else:
+		data = xr.concat( [ idata[[cvar]] for idata in ldata ] , dim = "time" )
+	
+	data = data.assign_coords( _zarr_coords( find_grid(data) , level , height ) )
+	data[cvar].attrs = _zarr_attrs( avar , level )
+	if "time" in data.dims:
+		data["time"].attrs = { "axis" : "T" , "long_name" : "Time Axis" , "standard_name" : "time" }
+	data.attrs = build_gattrs( cvar , level )
+	
+	return data
+##}}}
+
+def _persist( params ):##{{{
+	
+	## Merge of the data of the fetch in the output directory, the memory is
+	## released after
+	try:
+		merge_AMIP_CF_format( params = params )
+	finally:
+		release_tmp(params.tmp)
+		params.tmp_gen.cleanup()
+##}}}
+
+def fetch( cvars , area , period , freq = "day" , output_dir = None , persist = False , **kwargs ):##{{{
+	"""
+	CDSupdate.fetch
+	===============
+	
+	Download, convert and build the extra variables, and return the data as
+	a dict cvar: xarray.Dataset, with the coordinates and attributes of the
+	output files. Nothing is written except the raw downloads, in a tmp
+	directory removed at the end.
+	
+	Parameters
+	----------
+	cvars: str or list
+	    Variables, e.g. 'tas,hurs' or ['tas','zg500']
+	area: str or list
+	    Name of an area, 'name,lon_min,lon_max,lat_min,lat_max', or the
+	    bounds (lon_min,lon_max,lat_min,lat_max)
+	period: str or tuple
+	    't0/t1' (isoformat), or (t0,t1)
+	freq: str
+	    'day' or 'hr', 'orog' is always 'fx'
+	output_dir: str or None
+	    Output directory, only used with persist
+	persist: bool
+	    If True, the data are also merged in output_dir in a background
+	    thread, and (data,future) is returned, with future a
+	    concurrent.futures.Future of the merge
+	kwargs:
+	    Other options of cdsupdate, e.g. download_workers = 4, max_memory =
+	    '8G' or compression = 'zstd-3'
+	
+	"""
+	
+	if not freq in ["day","hr"]:
+		raise ValueError( f"Invalid frequency '{freq}', 'day' or 'hr' expected" )
+	if persist and output_dir is None:
+		raise ValueError( "An output directory is required to persist the data" )
+	
+	## Parameters of the run
+	params = CDSUParams()
+	params.init_from_user_input( *_argv( cvars , area , period , freq , output_dir , kwargs ) )
+	params.persist = persist
+	params.check()
+	if params.abort:
+		raise params.error
+	params.init_tmp()
+	params.build_CDSAPIParams()
+	
+	try:
+		with use_params(params):
+			
+			## Download and convert, without the merge
+			run_pipeline( merge = False )
+			
+			## Datasets of the requested variables
+			data = {}
+			with hdf5_lock:
+				for cvar in params.cvars:
+					ds = _dataset( params , cvar , freq )
+					if ds is None:
+						logger.warning( f"No data for '{cvar}'" )
+						continue
+					data[cvar] = ds
+	except BaseException:
+		release_tmp(params.tmp)
+		params.tmp_gen.cleanup()
+		raise
+	
+	if not persist:
+		release_tmp(params.tmp)
+		params.tmp_gen.cleanup()
+		return data
+	
+	## Merge in the background, the threads run in a new context
+	future = concurrent.futures.Future()
+	def target():
+		try:
+			future.set_result( _persist(params) )
+		except BaseException as e:
+			future.set_exception(e)
+	threading.Thread( target = target , name = f"CDSupdate-persist-{params.area_name}" , daemon = False ).start()
+	
+	return data,future
+##}}}
+
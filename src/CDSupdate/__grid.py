@@ -0,0 +1,138 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+from __future__ import annotations
+
+import dataclasses
+
+import numpy as np
+
+
+###############
+## Variables ##
+###############
+
+_grids = {}
+
+
+#############
+## Classes ##
+#############
+
+@dataclasses.dataclass( frozen = True , eq = False )
+class Grid:##{{{
+	
+	## Grid of an area, in the AMIP format (lat increasing, lon in [-180,180[
+	## and increasing), with the permutation from the raw CDS grid. The
+	## permutation is a flip of lat and a roll of lon in practice, otherwise an
+	## index is used.
+	
+	area_name : str
+	lat       : np.ndarray
+	lon       : np.ndarray
+	lat_index : np.ndarray | slice
+	lon_roll  : int | None
+	lon_index : np.ndarray | None
+	
+	@property
+	def nlat(self):##{{{
+		return self.lat.size
+	##}}}
+	
+	@property
+	def nlon(self):##{{{
+		return self.lon.size
+	##}}}
+	
+	@property
+	def shape(self):##{{{
+		return (self.nlat,self.nlon)
+	##}}}
+	
+	@staticmethod
+	def from_raw( area_name , latitude , longitude ):##{{{
+		
+		latitude  = np.asarray(latitude)
+		longitude = np.asarray(longitude)
+		
+		## Latitude, the permutation is a slice if the axis is monotonic
+		ilat = np.argsort( latitude , kind = "stable" )
+		if np.all( np.diff(ilat) == 1 ):
+			lat_index = slice(None)
+		elif np.all( np.diff(ilat) == -1 ):
+			lat_index = slice(None,None,-1)
+		else:
+			lat_index = ilat
+		
+		## Longitude, in [-180,180[, the permutation is a roll if possible
+		lon  = np.where( longitude < 180 , longitude , longitude - 360 )
+		ilon = np.argsort( lon , kind = "stable" )
+		roll = int(ilon[0])
+		if np.array_equal( ilon , np.roll( np.arange(ilon.size) , -roll ) ):
+			lon_index = None
+		else:
+			roll      = None
+			lon_index = ilon
+		
+		return Grid( area_name = area_name , lat = latitude[ilat].astype("float64") , lon = lon[ilon].astype("float64") ,
+		             lat_index = lat_index , lon_roll = roll , lon_index = lon_index )
+	##}}}
+	
+	def reorder( self , X , out = None ):##{{{
+		
+		## X has the raw grid on the two last axes, out (float32) the AMIP
+		## grid. The cast to float32 is done during the copy.
+		if out is None:
+			out = np.empty( X.shape[:-2] + self.shape , dtype = np.float32 )
+		
+		X = X[...,self.lat_index,:]
+		if self.lon_roll is None:
+			out[...] = X[...,self.lon_index]
+		else:
+			k = self.lon_roll
+			n = self.nlon
+			out[...,:n-k] = X[...,k:]
+			out[...,n-k:] = X[...,:k]
+		
+		return out
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def grid_from_raw( area_name , latitude , longitude ):##{{{
+	
+	## The grid depends only of the area and of the raw coordinates, so it is
+	## computed once and cached
+	latitude  = np.asarray(latitude)
+	longitude = np.asarray(longitude)
+	key = (area_name,latitude.tobytes(),longitude.tobytes())
+	if key not in _grids:
+		_grids[key] = Grid.from_raw( area_name , latitude , longitude )
+	
+	return _grids[key]
+##}}}
+
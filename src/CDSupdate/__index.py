@@ -0,0 +1,207 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import json
+import base64
+import logging
+import html
+
+from .__lazy import lazy_import
+
+kerchunk_hdf     = lazy_import("kerchunk.hdf")
+kerchunk_combine = lazy_import("kerchunk.combine")
+
+
+#############
+## Imports ##
+#############
+
+from .__CDSUParams import CDSUParams
+from .__CDSUParams import cdsuParams
+from .__CDSUParams import use_params
+from .__atomic import atomic_output
+from .__remote import remote_url
+from .__remote import remote_open
+from .__remote import remote_upload
+from .__remote import remote_remove
+from .__catalog import connect
+from .__catalog import catalog_file
+from .__catalog import catalog_rows
+from .__catalog import catalog_set_refs
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Functions ##
+###############
+
+## Index of all the output files of (area,freq,cvar), written in the directory
+## of the files after the merge, to open the whole period as one dataset
+## without reading the metadata of each file:
+## - ERA5_cvar_freq_area.ncml, NcML aggregation (joinExisting on time), read
+##   by the netCDF-Java tools (THREDDS, Panoply, ...),
+## - ERA5_cvar_freq_area.json, kerchunk references (byte ranges of the chunks
+##   of each file), if kerchunk is installed. The references of a file are
+##   kept in the catalog, only the rewritten files are read again.
+
+def index_path( cvar , freq , ext ):##{{{
+	area_name = cdsuParams.area_name
+	return os.path.join( cdsuParams.output_dir , "ERA5" , area_name , freq , cvar , f"ERA5_{cvar}_{freq}_{area_name}.{ext}" )
+##}}}
+
+def _ncml( rows ):##{{{
+	
+	## NcML aggregation of the files (names relative to the ncml file), with
+	## the number of time steps of the catalog, so that readers do not open
+	## the files to build the time axis
+	lines = [
+		'<?xml version="1.0" encoding="UTF-8"?>',
+		'<netcdf xmlns="http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2">',
+		'  <aggregation dimName="time" type="joinExisting">'
+		]
+	for row in rows:
+		location = html.escape( os.path.basename(row["path"]) , quote = True )
+		if row["nsteps"] is None:
+			lines.append( f'    <netcdf location="{location}"/>' )
+		else:
+			lines.append( f'    <netcdf location="{location}" ncoords="{row["nsteps"]}"/>' )
+	lines = lines + [ '  </aggregation>' , '</netcdf>' , '' ]
+	
+	return "\n".join(lines)
+##}}}
+
+def _file_refs( path ):##{{{
+	
+	## kerchunk references of the output file path, with its final url (the
+	## object store if the output is remote)
+	url = path if cdsuParams.output_url is None else remote_url(path)
+	with remote_open(path) as f:
+		refs = kerchunk_hdf.SingleHdf5ToZarr( f , url , inline_threshold = 300 ).translate()
+		
+		## The chunks of the time axis are inlined, the files are not read
+		## again to combine the references
+		for key,ref in refs["refs"].items():
+			if key.startswith("time/") and isinstance(ref,list):
+				f.seek(ref[1])
+				refs["refs"][key] = "base64:" + base64.b64encode( f.read(ref[2]) ).decode()
+	
+	return refs
+##}}}
+
+def _kerchunk( con , cvar , rows ):##{{{
+	
+	## Combined kerchunk references of the files, the references of the files
+	## missing in the catalog (new files, or catalog built from the names)
+	## are computed
+	root = os.path.join( cdsuParams.output_dir , "ERA5" )
+	lrefs = []
+	for row in rows:
+		if row["refs"] is None:
+			refs = _file_refs( os.path.join( root , row["path"] ) )
+			catalog_set_refs( con , row["path"] , refs )
+		else:
+			refs = json.loads(row["refs"])
+		lrefs.append(refs)
+	
+	## The chunks of the files are concatenated, a time chunk can not be cut
+	## by the end of a file (except the last one)
+	for row,refs in zip(rows[:-1],lrefs[:-1]):
+		zarray = json.loads(refs["refs"][f"{cvar}/.zarray"])
+		if not zarray["shape"][0] % zarray["chunks"][0] == 0:
+			raise Exception( f"the time chunks ({zarray['chunks'][0]}) of '{os.path.basename(row['path'])}' are cut by the end of the file" )
+	
+	if len(lrefs) == 1:
+		return lrefs[0]
+	mzz = kerchunk_combine.MultiZarrToZarr( lrefs , concat_dims = ["time"] , identical_dims = ["lat","lon","height"] )
+	
+	return mzz.translate()
+##}}}
+
+def _write( ofile , content ):##{{{
+	with atomic_output(ofile) as tfile:
+		with open( tfile , "w" ) as f:
+			f.write(content)
+	if cdsuParams.output_url is not None:
+		remote_upload(ofile)
+##}}}
+
+def write_index( con , freq , cvar ):##{{{
+	
+	## Parameters
+	rows = [ row for row in catalog_rows( con , cdsuParams.area_name , freq , cvar ) if row["path"].endswith(".nc") ]
+	if len(rows) == 0:
+		return
+	logger.info( f" * Index of {cvar} / {freq}, {len(rows)} files" )
+	
+	## NcML
+	_write( index_path( cvar , freq , "ncml" ) , _ncml(rows) )
+	
+	## kerchunk, optional. If the files can not be combined (e.g. the time
+	## chunks of a file are cut by its end, with --chunking series), the old
+	## index is removed, it would not give the new files.
+	if kerchunk_hdf is None:
+		return
+	ofile = index_path( cvar , freq , "json" )
+	try:
+		refs = _kerchunk( con , cvar , rows )
+	except Exception as e:
+		logger.warning( f"No kerchunk index for {cvar} / {freq}: {e}" )
+		if cdsuParams.output_url is not None:
+			remote_remove(ofile)
+		elif os.path.isfile(ofile):
+			os.remove(ofile)
+		return
+	_write( ofile , json.dumps(refs) )
+##}}}
+
+def reindex( output_dir , area , freq , cvar ):##{{{
+	
+	## Index of (freq,cvar) of the area of the archive output_dir, out of an
+	## update (e.g. after --rechunk)
+	with use_params( CDSUParams( output_dir = output_dir , area_name = area ) ):
+		write_indexes( [(freq,cvar)] )
+##}}}
+
+def write_indexes( keys ):##{{{
+	
+	## Index of each (freq,cvar) of keys, in the main process after the merge
+	if cdsuParams.output_format == "zarr":
+		return
+	logger.info( "Index of the output files" )
+	con = connect(catalog_file())
+	try:
+		for freq,cvar in keys:
+			if freq == "fx":
+				continue
+			write_index( con , freq , cvar )
+	finally:
+		con.close()
+##}}}
+
@@ -21,7 +21,11 @@
 #############
 
 from .__exec      import start_cdsupdate
+from .__exec      import run_cdsupdate
+from .__CDSUParams import CDSUParams
 from .__doc       import doc
+from .__reader    import open_output as open
+from .__fetch     import fetch
 from .__release   import version
 
 
@@ -21,15 +21,21 @@
 ##############
 
 import os
+import shutil
 import logging
-import cdsapi
+import threading
+import contextlib
 
 import datetime as dt
 import numpy  as np
-import xarray as xr
 
-import netCDF4
-import cftime
+from .__lazy import LazyModule
+from .__lazy import lazy_import
+
+xr      = LazyModule("xarray")
+netCDF4 = LazyModule("netCDF4")
+cdsapi  = LazyModule("cdsapi")
+zarr    = lazy_import("zarr")
 
 
 #############
@@ -37,8 +43,50 @@ import cftime
 #############
 
 from .__CDSUParams import cdsuParams
+from .__CDSUParams import with_params
 from .__release import version
 from .__release import src_url
+from .__blocks import day_blocks
+from .__blocks import daily_reduce
+from .__tmpfiles import TmpWriter
+from .__tmpfiles import list_tmp
+from .__tmpfiles import open_tmp
+from .__tmpfiles import save_tmp
+from .__tmpfiles import tmp_isfile
+from .__tmpfiles import time2num
+from .__tmpfiles import time2str
+from .__store import HourlyStore
+from .__atomic import atomic_target
+from .__atomic import copy_target
+from .__atomic import commit_target
+from .__atomic import atomic_output
+from .__atomic import commit_tree
+from .__workers import run_units
+from .__workers import hdf5_serialized
+from .__chunking import chunk_shape
+from .__chunking import time_chunk
+from .__chunking import aligned_block
+from .__chunking import set_chunk_cache
+from .__remote import remote_fetch
+from .__remote import remote_upload
+from .__remote import remote_remove
+from .__catalog import catalog_file
+from .__catalog import open_catalog
+from .__catalog import catalog_files
+from .__catalog import catalog_reconcile
+from .__catalog import catalog_era5t
+from .__catalog import catalog_update
+from .__catalog import file_time
+from .__catalog import record_era5t
+from .__catalog import era5t_start
+from .__catalog import merged_era5t
+from .__index import write_indexes
+from .__shards import file_range
+from .__shards import shard_key
+from .__shards import shard_keys
+from .__shards import shard_bounds
+from .__thermo import Workspace
+from .__grid import grid_from_raw
 
 
 ##################
@@ -53,11 +101,25 @@ for mod in ["cdsapi","datapi"]:
 	logging.getLogger(mod).setLevel(logging.ERROR)
 
 
+###############
+## Variables ##
+###############
+
+## Idle clients of the CDS, kept between the downloads (and between the
+## updates of --watch)
+_clients      = []
+_clients_lock = threading.Lock()
+
+
 ###############
 ## Functions ##
 ###############
 
-def load_data_CDS():##{{{
+def list_requests_CDS():##{{{
+	
+	## List of the downloads, as tuples (key,cvar,name,request,target), with
+	## key the (tl,tr) period of the request
+	requests = []
 	
 	## Build area
 	lon0,lon1,lat0,lat1 = cdsuParams.area
@@ -76,19 +138,9 @@ def load_data_CDS():##{{{
 	cvars_dwl = cdsuParams.cvars_dwl
 	cvars_lev = cdsuParams.cvars_lev
 	
-	## cdsapi client params
-	cdskey = None
-	cdsurl = None
-	cdsverify = None
-	
 	## Now loop on cvar for download
 	for cvar,level in zip(cvars_dwl,cvars_lev):
 		
-		logger.info( f"Start download {cvar} ({level})" )
-		
-		## Find the level (surface or pressure level)
-		logger.info( f" * Level: {level}" )
-		
 		## Build name
 		if level == "single":
 			name  = f"reanalysis-era5-{level}-levels"
@@ -120,26 +172,89 @@ def load_data_CDS():##{{{
 			if not os.path.isdir(opath):
 				os.makedirs(opath)
 			
-			## Log
-			logger.info( " * Load '{} / {}' in 'TMP/ERA5-BRUT/hr/".format(*key) + f"{cvar+h}/" + ofile + "'" )
-			
-			## And run download
-			try:
-				client = cdsapi.Client( key = cdskey , url = cdsurl , verify = cdsverify , quiet = True , progress = False )
-				client.retrieve( name , request , target )
-			except Exception as e:
-				logger.info( f" * => Warning '{e}', data not used." )
-				if os.path.isfile(target):
-					os.remove(target)
+			requests.append( (key,cvar + h,name,request,target) )
+	
+	return requests
+##}}}
+
+@contextlib.contextmanager
+def cds_client():##{{{
+	
+	## A client of the CDS, reused if one is idle, a client is used by one
+	## thread at a time
+	with _clients_lock:
+		client = _clients.pop() if len(_clients) > 0 else None
+	
+	## cdsapi client params
+	if client is None:
+		cdskey = None
+		cdsurl = None
+		cdsverify = None
+		client = cdsapi.Client( key = cdskey , url = cdsurl , verify = cdsverify , quiet = True , progress = False )
+	
+	try:
+		yield client
+	finally:
+		with _clients_lock:
+			_clients.append(client)
+##}}}
+
+def cds_end_date( name ):##{{{
+	
+	## Last day of the dataset name available in the CDS, None if it can not
+	## be asked (e.g. legacy CDS API)
+	try:
+		with cds_client() as client:
+			end = client.client.get_collection(name).end_datetime
+	except Exception as e:
+		logger.debug( f" * End of '{name}' not available: {e}" )
+		return None
+	if end is None:
+		return None
+	
+	return dt.date.fromisoformat(str(end)[:10])
+##}}}
+
+def download_CDS( key , cvar , name , request , target ):##{{{
+	
+	## Log
+	logger.info( " * Load '{} / {}' in 'TMP/ERA5-BRUT/hr/".format(*key) + f"{cvar}/" + os.path.basename(target) + "'" )
+	
+	## And run download, in a temporary file renamed when complete
+	part = os.path.join( os.path.dirname(target) , "." + os.path.basename(target) + ".part" )
+	try:
+		with cds_client() as client:
+			client.retrieve( name , request , part )
+		os.replace( part , target )
+	except Exception as e:
+		logger.info( f" * => Warning '{e}', data not used." )
+		for f in [part,target]:
+			if os.path.isfile(f):
+				os.remove(f)
+##}}}
+
+@with_params
+def load_data_CDS():##{{{
+	
+	## Download all the requests, sequentially
+	logger.info( f"Start download" )
+	for args in list_requests_CDS():
+		download_CDS(*args)
 	
 ##}}}
 
-def BRUT_to_AMIP_format():##{{{
+@with_params
+@hdf5_serialized
+def BRUT_to_AMIP_format( store = None , years = None ):##{{{
 	
 	## Parameters
 	cvars = cdsuParams.cvars
 	area_name = cdsuParams.area_name
 	
+	## Without store, all hourly data are written in TMP/ERA5-AMIP/hr
+	if store is None:
+		store = HourlyStore( cdsuParams.tmp , area_name , keep_hourly = True , fmt = cdsuParams.tmp_format )
+	
 	## List of climate vars
 	cvars_dwl = cdsuParams.cvars_dwl
 	cvars_lev = cdsuParams.cvars_lev
@@ -157,7 +272,9 @@ def BRUT_to_AMIP_format():##{{{
 		ipath = os.path.join( cdsuParams.tmp , "ERA5-BRUT" , "hr" , cvar + h )
 		
 		## List files
-		ifiles = os.listdir(ipath)
+		if not os.path.isdir(ipath):
+			continue
+		ifiles = [ f for f in os.listdir(ipath) if not f.startswith(".") ]
 		ifiles.sort()
 		
 		## Split in year
@@ -170,72 +287,93 @@ def BRUT_to_AMIP_format():##{{{
 			else:
 				difiles[year] = [ifile]
 		
+		## Orography is converted only once
+		if level == "single" and cvar == "orog":
+			if tmp_isfile( os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "fx" , cvar , f"ERA5-AMIP_{cvar}_fx_{area_name}.nc" ) ):
+				continue
+			years_cvar = list(difiles)[:1]
+		elif years is None:
+			years_cvar = list(difiles)
+		else:
+			years_cvar = [ year for year in difiles if year in years ]
+		
 		## Now loop on years
-		for year in difiles:
+		for year in years_cvar:
 			
-			## Load data
-			idata = xr.concat( [ xr.open_dataset( os.path.join( ipath , ifile ) ).astype("float32") for ifile in difiles[year] ] , dim = "valid_time" ).rename( valid_time = "time" )
-			idata = idata.compute()
+			## Open data, loaded later by time blocks
+			idatas = [ xr.open_dataset( os.path.join( ipath , ifile ) ).rename( valid_time = "time" ) for ifile in difiles[year] ]
 			
-			## Reorganize lon / lat axis
-			idata = idata.rename( { "longitude" : "lon" , "latitude" : "lat" , evar : cvar + h } )
-			idata = idata.assign_coords( lon = idata.lon.where( idata.lon < 180 , idata.lon.values - 360 ) ).sortby("lon").sortby("lat").compute()
+			## Grid, computed once for the area, and used to reorganize the
+			## lon / lat axis during the read
+			grid = grid_from_raw( area_name , idatas[0].latitude.values , idatas[0].longitude.values )
+			cdsuParams.grid = grid
 			
 			## Special case, orography
 			if level == "single" and cvar == "orog":
 				
 				## Convert to orography and remove time axis
 				g = 9.80665
-				idata[cvar] = idata[cvar] / g
-				idata[cvar] = idata[cvar][0,:,:]
-				idata = idata.drop_vars("time")
+				X = grid.reorder( idatas[0][evar][0,:,:].values )
+				idata = xr.Dataset( { cvar : ( ["lat","lon"] , X / g ) } , coords = { "lat" : grid.lat , "lon" : grid.lon } )
 				
 				opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "fx" , cvar )
 				ofile = f"ERA5-AMIP_{cvar}_fx_{area_name}.nc"
-				target = os.path.join( opath , ofile )
-				if not os.path.isdir(opath):
-					os.makedirs(opath)
 				logger.info( f" * Save 'TMP/ERA5-AMIP/fx/{cvar}/{ofile}'" )
-				idata.to_netcdf( os.path.join( opath , ofile ) )
+				save_tmp( idata , os.path.join( opath , ofile ) , cdsuParams.tmp_format )
+				for idata in idatas:
+					idata.close()
 				break
 			
+			## ERA5T (preliminary) data, recorded for the catalog
+			for idata in idatas:
+				if "expver" in idata.coords:
+					record_era5t( idata.time.values , idata.expver.values )
+			
 			## Delete last day if all hours are not present
-			t0 = str(idata.time[ 0].values)[:10] + " 00:00"
-			t1 = str(idata.time[-1].values)[:10]
-			tm = dt.datetime.fromisoformat(t1 + " 00:00") - dt.timedelta( hours = 1 )
-			if idata.sel( time = t1 ).time.size < 24:
-				idata = idata.sel( time = slice(t0,tm) ).compute()
+			time  = np.concatenate( [ idata.time.values for idata in idatas ] )
+			days  = time.astype("datetime64[D]")
+			ntime = time.size
+			if np.sum( days == days[-1] ) < 24:
+				ntime = int(np.sum( days < days[-1] ))
 			
-			## Change scale
-			if cvar in ["zg"]:
-				g = 9.80665
-				idata[cvar+h] = idata[cvar+h] / g
+			## Block size, for the raw and the float32 data
+			block = cdsuParams.time_block( 4 * grid.nlat * grid.nlon , nbuffers = 3 , align = 24 )
+			ws    = Workspace()
 			
-			## Transform hourly variable
-			opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "hr" , cvar + h )
-			t0    = str(idata.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-			t1    = str(idata.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-			ofile = f"ERA5-AMIP_{cvar+h}_hr_{area_name}_{t0}-{t1}.nc"
-			target = os.path.join( opath , ofile )
-			if not os.path.isdir(opath):
-				os.makedirs(opath)
-			logger.info( f" * Save 'TMP/ERA5-AMIP/hr/{cvar+h}/{ofile}'" )
-			idata.to_netcdf( os.path.join( opath , ofile ) )
-			
-			## Build daily variable
-			dtime = [dt.datetime(int(year),1,1) + dt.timedelta( days = int(i) - 1 ) for i in np.unique(idata.time.dt.dayofyear.values)]
-			ddata = idata.groupby("time.dayofyear").mean().rename( dayofyear = "time" ).assign_coords( time = dtime )
+			## Transform hourly variable, and build daily variable, by time blocks
+			with store.writer( cvar + h , year , time[:ntime] , grid ) as wrth, TmpWriter( cdsuParams.tmp , cvar + h , "day" , area_name , grid.lat , grid.lon , cdsuParams.tmp_format ) as wrtd:
+				n = 0
+				for idata in idatas:
+					
+					itime = idata.time.values[:max(0,ntime-n)]
+					n    += idata.time.size
+					for sl in day_blocks( itime , block ):
+						
+						## Read, reorganize lon / lat axis and cast to float32
+						raw = idata[evar][sl].values
+						raw = raw.reshape( (raw.shape[0],) + raw.shape[-2:] )
+						X   = grid.reorder( raw , out = ws( "X" , (raw.shape[0],) + grid.shape ) )
+						
+						## Change scale
+						if cvar in ["zg"]:
+							g = 9.80665
+							np.divide( X , g , out = X )
+						
+						wrth.append( itime[sl] , X )
+						wrtd.append( *daily_reduce( itime[sl] , X , "mean" ) )
 			
-			## Save daily variable
-			opath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "day" , cvar + h )
-			t0    = str(ddata.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-			t1    = str(ddata.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-			ofile = f"ERA5-AMIP_{cvar+h}_day_{area_name}_{t0}-{t1}.nc"
-			target = os.path.join( opath , ofile )
-			if not os.path.isdir(opath):
-				os.makedirs(opath)
-			logger.info( f" * Save 'TMP/ERA5-AMIP/day/{cvar+h}/{ofile}'" )
-			ddata.to_netcdf( os.path.join( opath , ofile ) )
+			for idata in idatas:
+				idata.close()
+##}}}
+
+def find_grid( idata = None ):##{{{
+	
+	## Grid of the run, shared by all stages. Built from the AMIP coordinates
+	## only if the conversion has not been done in this run.
+	if cdsuParams.grid is None:
+		cdsuParams.grid = grid_from_raw( cdsuParams.area_name , idata.lat.values , idata.lon.values )
+	
+	return cdsuParams.grid
 ##}}}
 
 def build_gattrs( cvar , level ): ##{{{
@@ -270,32 +408,34 @@ def build_gattrs( cvar , level ): ##{{{
 	return gattrs
 ##}}}
 
-def save_netcdf( idata , cvar , freq , ofile ):##{{{
+def save_netcdf( idata , cvar , freq , ofile , X = None ):##{{{
 	
 	avar,level    = cdsuParams.cvarsParams.split_level(cvar)
 	time_units    = "hours since 1900-01-01 00:00"
 	time_calendar = "standard"
 	
-	nlat  = idata.lat.size
-	nlon  = idata.lon.size
+	grid  = find_grid(idata)
+	nlat  = grid.nlat
+	nlon  = grid.nlon
 	ntime = idata.time.size
-	if freq == "hr":
-		time  = [ dt.datetime(y,m,d,h) for y,m,d,h in zip(idata.time.dt.year.values,idata.time.dt.month.values,idata.time.dt.day.values,idata.time.dt.hour.values) ]
-	else:
-		time  = [ dt.datetime(y,m,d) for y,m,d in zip(idata.time.dt.year.values,idata.time.dt.month.values,idata.time.dt.day.values) ]
+	chunks = chunk_shape( cdsuParams.chunking , freq , nlat , nlon , cdsuParams.file_period )
+	
+	## Time axis truncated to the hour (or the day), encoded in time_units
+	## with the datetime64 arithmetic
+	time  = idata.time.values.astype( "datetime64[h]" if freq == "hr" else "datetime64[D]" )
 	
 	with netCDF4.Dataset( ofile , mode = "w" ) as ncf:
 		
 		## Add dimensions
-		ncd_lat  = ncf.createDimension( "lat"  , idata.lat.size )
-		ncd_lon  = ncf.createDimension( "lon"  , idata.lon.size )
-		ncd_time = ncf.createDimension( "time" , None           )
+		ncd_lat  = ncf.createDimension( "lat"  , nlat )
+		ncd_lon  = ncf.createDimension( "lon"  , nlon )
+		ncd_time = ncf.createDimension( "time" , None )
 		
 		## Add variables of dimensions
 		ncv_lat    = ncf.createVariable( "lat"    , "double" , ("lat",)  , fill_value = np.nan , shuffle = False , compression = "zlib" , complevel = 5 , chunksizes = (nlat,) )
 		ncv_lon    = ncf.createVariable( "lon"    , "double" , ("lon",)  , fill_value = np.nan , shuffle = False , compression = "zlib" , complevel = 5 , chunksizes = (nlon,) )
 		ncv_height = ncf.createVariable( "height" , "double" )
-		ncv_time   = ncf.createVariable( "time"   , "double" , ("time",) , fill_value = np.nan , shuffle = False , compression = "zlib" , complevel = 5 , chunksizes = (1,)    )
+		ncv_time   = ncf.createVariable( "time"   , "double" , ("time",) , fill_value = np.nan , shuffle = False , compression = "zlib" , complevel = 5 , chunksizes = time_chunk( freq , cdsuParams.file_period ) )
 		
 		## Add attributes
 		ncv_lat.setncattr( "axis"          , "Y"             )
@@ -324,13 +464,21 @@ def save_netcdf( idata , cvar , freq , ofile ):##{{{
 		ncv_time.setncattr( "calendar"      , time_calendar )
 		
 		## Fill variables of dimensions
-		ncv_lat[:]    = idata.lat.values
-		ncv_lon[:]    = idata.lon.values
-		ncv_time[:]   = cftime.date2num( time , time_units , time_calendar )
+		ncv_lat[:]    = grid.lat
+		ncv_lon[:]    = grid.lon
+		ncv_time[:]   = time2num(time)
 		
-		## Now the main variable
-		ncv_cvar = ncf.createVariable( cvar , "float32" , ("time","lat","lon")  , fill_value = np.nan , shuffle = False , compression = "zlib" , complevel = 5 , chunksizes = (1,nlat,nlon) )
-		ncv_cvar[:] = idata[cvar].values
+		## Now the main variable, written by time blocks
+		lossy    = cdsuParams.lossy_profile(cvar)
+		ncv_cvar = ncf.createVariable( cvar , lossy.dtype() , ("time","lat","lon")  , fill_value = lossy.fill_value() , chunksizes = chunks , **cdsuParams.compression_profile(cvar).kwargs() , **lossy.kwargs( cdsuParams.cvarsParams , avar ) )
+		lossy.set_attrs( ncv_cvar , cdsuParams.cvarsParams , avar )
+		set_chunk_cache( ncv_cvar , chunks , nlat , nlon , cdsuParams.max_memory )
+		if X is None:
+			X = idata[cvar]
+		block = aligned_block( cdsuParams.time_block( 4 * nlat * nlon , nbuffers = 4 ) , chunks )
+		for i0 in range(0,ntime,block):
+			i1 = min( i0 + block , ntime )
+			ncv_cvar[i0:i1,:,:] = lossy.encode( np.asarray( X[i0:i1] , dtype = np.float32 ) , cdsuParams.cvarsParams , avar )
 		
 		## Attributes
 		cvarattrs = cdsuParams.cvarsParams.attrs(avar)
@@ -355,6 +503,95 @@ def save_netcdf( idata , cvar , freq , ofile ):##{{{
 	
 ##}}}
 
+def append_netcdf( idata , cvar , freq , opath , ifile ):##{{{
+	
+	## Merge the new data idata in a copy of the old file ifile: the time steps
+	## already in the file are overwritten (region writes, with the old values
+	## kept where the new ones are missing), and the time steps after the end
+	## of the file are appended along the unlimited time axis. The copy is then
+	## renamed with the new time range. Returns the name of the merged file,
+	## or None if the new time steps can not be written in place (time steps
+	## before the start or between the time steps of the old file).
+	## The old file is not modified in place: an interrupted write of HDF5 can
+	## leave the whole file unreadable, and the overwritten time steps would
+	## be lost. The copy is a clone where the file system supports it, else
+	## the whole file is copied (only the compression of the old data is
+	## saved).
+	
+	area_name = cdsuParams.area_name
+	avar,level = cdsuParams.cvarsParams.split_level(cvar)
+	
+	timeN = np.round(time2num(idata.time.values)).astype("int64")
+	X     = idata[cvar]
+	
+	## Work on a copy, renamed at the end, the old file is never modified
+	tfile = atomic_target( os.path.join( opath , ifile ) )
+	copy_target( os.path.join( opath , ifile ) , tfile )
+	try:
+		t0,t1 = _append_netcdf( tfile , timeN , X , cvar , level )
+	except BaseException:
+		os.remove(tfile)
+		raise
+	if t0 is None:
+		os.remove(tfile)
+		return None
+	
+	## Rename with the new time range, the old file is removed by merge_unit
+	t0    = time2str( np.datetime64("1900-01-01T00") + np.timedelta64(int(t0),"h") , freq )
+	t1    = time2str( np.datetime64("1900-01-01T00") + np.timedelta64(int(t1),"h") , freq )
+	ofile = f"ERA5_{cvar}_{freq}_{area_name}_{t0}-{t1}.nc"
+	commit_target( tfile , os.path.join( opath , ofile ) )
+	
+	return ofile
+##}}}
+
+def _append_netcdf( tfile , timeN , X , cvar , level ):##{{{
+	
+	with netCDF4.Dataset( tfile , mode = "a" ) as ncf:
+		
+		ncv_time = ncf.variables["time"]
+		ncv_cvar = ncf.variables[cvar]
+		lossy    = cdsuParams.lossy_profile(cvar)
+		avar,_   = cdsuParams.cvarsParams.split_level(cvar)
+		
+		## Check that the new time steps are in the file or after its end
+		timeO = np.round(np.asarray(ncv_time[:])).astype("int64")
+		ntime = timeO.size
+		nover = int(np.sum( timeN <= timeO[-1] ))
+		if not np.all( np.isin( timeN[:nover] , timeO ) ):
+			return None,None
+		
+		## Overlap, by time blocks
+		block = cdsuParams.time_block( 4 * X.shape[1] * X.shape[2] , nbuffers = 4 )
+		for i0 in range(0,nover,block):
+			i1  = min( i0 + block , nover )
+			idx = np.searchsorted( timeO , timeN[i0:i1] )
+			j0  = idx[0]
+			j1  = idx[-1] + 1
+			Y   = np.asarray( X[i0:i1] , dtype = np.float32 )
+			Z   = np.ma.filled( ncv_cvar[j0:j1,:,:].astype(np.float32) , np.nan )
+			Z[idx-j0] = np.where( np.isnan(Y) , Z[idx-j0] , Y )
+			ncv_cvar[j0:j1,:,:] = lossy.encode( Z , cdsuParams.cvarsParams , avar )
+		
+		## Append the new time steps
+		for i0 in range(nover,timeN.size,block):
+			i1 = min( i0 + block , timeN.size )
+			j0 = ntime + i0 - nover
+			j1 = ntime + i1 - nover
+			ncv_time[j0:j1]       = timeN[i0:i1]
+			ncv_cvar[j0:j1,:,:]   = lossy.encode( np.asarray( X[i0:i1] , dtype = np.float32 ) , cdsuParams.cvarsParams , avar )
+		
+		## Update global attributes
+		gattrs = build_gattrs( cvar , level )
+		ncf.setncattr( "creation_date" , gattrs["creation_date"] )
+		ncf.setncattr( "references"    , gattrs["references"]    )
+		
+		t0 = timeO[0]
+		t1 = max( timeO[-1] , timeN[-1] )
+	
+	return t0,t1
+##}}}
+
 def save_orography():##{{{
 	
 	##
@@ -364,22 +601,23 @@ def save_orography():##{{{
 	## Open
 	ipath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "fx" , cvar )
 	ifile = f"ERA5-AMIP_{cvar}_fx_{area_name}.nc"
-	idata = xr.open_dataset( os.path.join( ipath , ifile ) )
+	idata = open_tmp( os.path.join( ipath , ifile ) )
 	
 	## And save
 	avar,level = cdsuParams.cvarsParams.split_level(cvar)
-	nlat       = idata.lat.size
-	nlon       = idata.lon.size
+	grid       = find_grid(idata)
+	nlat       = grid.nlat
+	nlon       = grid.nlon
 	
 	opath = os.path.join( cdsuParams.output_dir , "ERA5" , area_name , 'fx' , cvar )
 	if not os.path.isdir(opath):
 		os.makedirs(opath)
 	ofile  = f"ERA5_{cvar}_fx_{area_name}.nc"
-	with netCDF4.Dataset( os.path.join( opath , ofile ) , mode = "w" ) as ncf:
+	with atomic_output( os.path.join( opath , ofile ) ) as tfile, netCDF4.Dataset( tfile , mode = "w" ) as ncf:
 		
 		## Add dimensions
-		ncd_lat  = ncf.createDimension( "lat"  , idata.lat.size )
-		ncd_lon  = ncf.createDimension( "lon"  , idata.lon.size )
+		ncd_lat  = ncf.createDimension( "lat"  , nlat )
+		ncd_lon  = ncf.createDimension( "lon"  , nlon )
 		
 		## Add variables of dimensions
 		ncv_lat    = ncf.createVariable( "lat"    , "double" , ("lat",)  , fill_value = np.nan , shuffle = False , compression = "zlib" , complevel = 5 , chunksizes = (nlat,) )
@@ -404,11 +642,11 @@ def save_orography():##{{{
 		ncv_height.setncattr( "units"         , "m"      )
 		
 		## Fill variables of dimensions
-		ncv_lat[:]    = idata.lat.values
-		ncv_lon[:]    = idata.lon.values
+		ncv_lat[:]    = grid.lat
+		ncv_lon[:]    = grid.lon
 		
 		## Now the main variable
-		ncv_cvar = ncf.createVariable( cvar , "float32" , ("lat","lon")  , fill_value = np.nan , shuffle = False , compression = "zlib" , complevel = 5 , chunksizes = (nlat,nlon) )
+		ncv_cvar = ncf.createVariable( cvar , "float32" , ("lat","lon")  , fill_value = np.nan , chunksizes = chunk_shape( cdsuParams.chunking , "fx" , nlat , nlon )[1:] , **cdsuParams.compression_profile(cvar).kwargs() )
 		ncv_cvar[:] = idata[cvar].values
 		
 		## Attributes
@@ -427,17 +665,375 @@ def save_orography():##{{{
 			ncf.setncattr( attr , gattrs[attr] )
 ##}}}
 
-def merge_AMIP_CF_format():##{{{
+class CombineFirst:##{{{
+	
+	## Lazy equivalent of new.combine_first(old) along the time axis, the
+	## data are read only when a time block is requested.
+	
+	def __init__( self , new , old , time ):##{{{
+		self.new   = new
+		self.old   = old
+		self.time  = time
+		self.shape = (time.size,) + new.shape[1:]
+	##}}}
+	
+	def __getitem__( self , sl ):##{{{
+		
+		time = self.time[sl]
+		X    = np.zeros( (time.size,) + self.shape[1:] , dtype = np.float32 ) + np.nan
+		if time.size == 0:
+			return X
+		
+		for src in [self.old,self.new]:
+			stime = src.time.values
+			j0    = np.searchsorted( stime , time[ 0] , side = "left"  )
+			j1    = np.searchsorted( stime , time[-1] , side = "right" )
+			if not j0 < j1:
+				continue
+			idx = np.searchsorted( time , stime[j0:j1] )
+			Y   = np.asarray( src[j0:j1] , dtype = np.float32 )
+			X[idx] = np.where( np.isnan(Y) , X[idx] , Y )
+		
+		return X
+	##}}}
+	
+##}}}
+
+def zarr_path( cvar , freq ):##{{{
+	
+	## Zarr store of (area,freq,cvar), all the time steps are in one store
+	area_name = cdsuParams.area_name
+	return os.path.join( cdsuParams.output_dir , "ERA5" , area_name , freq , cvar , f"ERA5_{cvar}_{freq}_{area_name}.zarr" )
+##}}}
+
+def _zarr_coords( grid , level , height ):##{{{
+	
+	## Coordinates lat, lon and height, with the attributes of the netCDF files
+	coords = {}
+	coords["lat"] = xr.DataArray( grid.lat , dims = ["lat"] , attrs = { "axis" : "Y" , "long_name" : "Latitude"  , "standard_name" : "latitude"  , "units" : "degrees_north" } )
+	coords["lon"] = xr.DataArray( grid.lon , dims = ["lon"] , attrs = { "axis" : "X" , "long_name" : "Longitude" , "standard_name" : "longitude" , "units" : "degrees_east"  } )
+	coords["height"] = xr.DataArray( float(height) , attrs = { "axis" : "Z" , "long_name" : "height" , "standard_name" : "height" , "positive" : "up" , "units" : "m" if level == "single" else "hPa" } )
+	
+	return coords
+##}}}
+
+def _zarr_attrs( avar , level ):##{{{
+	cvarattrs = {}
+	for att,val in cdsuParams.cvarsParams.attrs(avar).items():
+		if len(val) == 0:
+			continue
+		if att == "long_name" and not (level == "single"):
+			val = val.replace("__CHANGE__",level)
+		cvarattrs[att] = val
+	return cvarattrs
+##}}}
+
+def _zarr_block( time , X , cvar , lossy ):##{{{
+	
+	## Time block of a variable, the missing values are the NaN, the packing
+	## is done by xarray with the encoding of the store
+	avar,_ = cdsuParams.cvarsParams.split_level(cvar)
+	Y      = np.ma.filled( lossy.encode( np.asarray( X , dtype = np.float32 ) , cdsuParams.cvarsParams , avar ) , np.nan )
+	Y      = lossy.bitround( Y , cdsuParams.cvarsParams , avar )
+	return xr.Dataset( { cvar : ( ("time","lat","lon") , Y ) } , coords = { "time" : time } )
+##}}}
+
+def save_zarr( idata , cvar , freq , path , X = None ):##{{{
+	
+	## New zarr store, written by time blocks: the first block creates the
+	## store, the others are appended along the time axis
+	
+	avar,level = cdsuParams.cvarsParams.split_level(cvar)
+	grid   = find_grid(idata)
+	ntime  = idata.time.size
+	time   = idata.time.values
+	chunks = chunk_shape( cdsuParams.chunking , freq , grid.nlat , grid.nlon )
+	lossy  = cdsuParams.lossy_profile(cvar)
+	height = cdsuParams.cvarsParams.height(cvar) if level == "single" else level
+	if X is None:
+		X = idata[cvar]
+	
+	encoding = { cvar   : { "chunks" : chunks , **cdsuParams.compression_profile(cvar).zarr_kwargs() , **lossy.zarr_encoding( cdsuParams.cvarsParams , avar ) } ,
+	             "time" : { "units" : "hours since 1900-01-01 00:00" , "calendar" : "standard" , "dtype" : "float64" , "chunks" : time_chunk(freq) } }
+	
+	block = aligned_block( cdsuParams.time_block( 4 * grid.nlat * grid.nlon , nbuffers = 4 ) , chunks )
+	for i0 in range(0,ntime,block):
+		i1   = min( i0 + block , ntime )
+		data = _zarr_block( time[i0:i1] , X[i0:i1] , cvar , lossy )
+		if i0 > 0:
+			data.to_zarr( path , mode = "a" , append_dim = "time" , consolidated = False )
+			continue
+		data = data.assign_coords( _zarr_coords( grid , level , height ) )
+		data[cvar].attrs = _zarr_attrs( avar , level )
+		data["time"].attrs = { "axis" : "T" , "long_name" : "Time Axis" , "standard_name" : "time" }
+		data.attrs = build_gattrs( cvar , level )
+		data.to_zarr( path , mode = "w" , encoding = encoding , consolidated = False )
+##}}}
+
+def merge_zarr( idataN , cvar , freq ):##{{{
+	
+	## Merge the new data idataN in the zarr store of (freq,cvar): the time
+	## steps already in the store are overwritten (region writes, with the old
+	## values kept where the new ones are missing), and the time steps after
+	## the end of the store are appended. If the new time steps can not be
+	## written in place (before the start of the store, or between its time
+	## steps), a new store is written, and replaces the old one.
+	
+	path = zarr_path( cvar , freq )
+	if not os.path.isdir(path):
+		logger.info( f" * Create '{os.path.basename(path)}'" )
+		save_zarr( idataN , cvar , freq , path )
+		return
+	
+	avar,level = cdsuParams.cvarsParams.split_level(cvar)
+	lossy  = cdsuParams.lossy_profile(cvar)
+	grid   = find_grid(idataN)
+	idataO = xr.open_zarr( path , chunks = None , consolidated = False )
+	timeO  = idataO.time.values
+	timeN  = idataN.time.values
+	nover  = int(np.sum( timeN <= timeO[-1] ))
+	
+	## Rewrite
+	if not np.all( np.isin( timeN[:nover] , timeO ) ):
+		logger.info( f" * Can not append in '{os.path.basename(path)}', rewrite" )
+		time  = np.union1d( timeO , timeN )
+		X     = CombineFirst( idataN[cvar] , idataO[cvar] , time )
+		tpath = atomic_target(path)
+		try:
+			save_zarr( xr.Dataset( coords = { "time" : time } ) , cvar , freq , tpath , X )
+		except BaseException:
+			shutil.rmtree( tpath , ignore_errors = True )
+			raise
+		finally:
+			idataO.close()
+		commit_tree( tpath , path )
+		return
+	
+	logger.info( f" * Append in '{os.path.basename(path)}'" )
+	
+	## Overlap, by time blocks
+	block = cdsuParams.time_block( 4 * grid.nlat * grid.nlon , nbuffers = 4 )
+	try:
+		for i0 in range(0,nover,block):
+			i1  = min( i0 + block , nover )
+			idx = np.searchsorted( timeO , timeN[i0:i1] )
+			j0  = idx[0]
+			j1  = idx[-1] + 1
+			Y   = np.asarray( idataN[cvar][i0:i1] , dtype = np.float32 )
+			Z   = np.asarray( idataO[cvar][j0:j1] , dtype = np.float32 )
+			Z[idx-j0] = np.where( np.isnan(Y) , Z[idx-j0] , Y )
+			_zarr_block( timeO[j0:j1] , Z , cvar , lossy ).to_zarr( path , mode = "r+" , region = { "time" : slice(j0,j1) } , consolidated = False )
+	finally:
+		idataO.close()
+	
+	## Append the new time steps
+	for i0 in range(nover,timeN.size,block):
+		i1 = min( i0 + block , timeN.size )
+		_zarr_block( timeN[i0:i1] , idataN[cvar][i0:i1] , cvar , lossy ).to_zarr( path , mode = "a" , append_dim = "time" , consolidated = False )
+	
+	## Update global attributes
+	gattrs = build_gattrs( cvar , level )
+	zarr.open_group( path , mode = "r+" ).attrs.update( { "creation_date" : gattrs["creation_date"] , "references" : gattrs["references"] } )
+##}}}
+
+def save_orography_zarr():##{{{
+	
+	area_name = cdsuParams.area_name
+	cvar      = "orog"
+	
+	## Open
+	ipath = os.path.join( cdsuParams.tmp , "ERA5-AMIP" , "fx" , cvar )
+	idata = open_tmp( os.path.join( ipath , f"ERA5-AMIP_{cvar}_fx_{area_name}.nc" ) )
+	
+	## And save, in a new store replacing the old one
+	avar,level = cdsuParams.cvarsParams.split_level(cvar)
+	grid       = find_grid(idata)
+	data       = xr.Dataset( { cvar : ( ("lat","lon") , idata[cvar].values.astype(np.float32) , _zarr_attrs( avar , level ) ) } , coords = _zarr_coords( grid , level , cdsuParams.cvarsParams.height(cvar) ) )
+	data.attrs = build_gattrs( cvar , level )
+	encoding   = { cvar : { "chunks" : chunk_shape( cdsuParams.chunking , "fx" , grid.nlat , grid.nlon )[1:] , **cdsuParams.compression_profile(cvar).zarr_kwargs() } }
+	idata.close()
+	
+	path  = zarr_path( cvar , "fx" )
+	tpath = atomic_target(path)
+	os.makedirs( os.path.dirname(path) , exist_ok = True )
+	try:
+		data.to_zarr( tpath , mode = "w" , encoding = encoding , consolidated = False )
+	except BaseException:
+		shutil.rmtree( tpath , ignore_errors = True )
+		raise
+	commit_tree( tpath , path )
+##}}}
+
+def merge_unit( freq , cvar , shard , ifilesN , ifileO ):##{{{
+	
+	## Merge the new data of the intermediate files ifilesN, restricted to the
+	## shard (a month, a year or a decade, see --file-period), in the old
+	## file ifileO of the shard (None if no old data). With the zarr output,
+	## the shard is None, all the files are merged in the store of the
+	## variable. Units are independent, and can be run in parallel (see
+	## CDSupdate.__workers).
+	
+	## Orography
+	if freq == "fx":
+		logger.info( f" * {cvar}" )
+		area_name = cdsuParams.area_name
+		if cdsuParams.output_format == "zarr":
+			save_orography_zarr()
+			ofile = zarr_path( cvar , "fx" )
+		else:
+			save_orography()
+			ofile = os.path.join( cdsuParams.output_dir , "ERA5" , area_name , "fx" , cvar , f"ERA5_{cvar}_fx_{area_name}.nc" )
+		catalog_update( ofile , cvar , freq , None )
+		if cdsuParams.output_url is not None:
+			remote_upload(ofile)
+		return
+	
+	## Path
+	ipath = os.path.join( cdsuParams.tmp        , "ERA5-AMIP" ,                        freq , cvar )
+	opath = os.path.join( cdsuParams.output_dir , "ERA5"      , cdsuParams.area_name , freq , cvar )
+	
+	## ERA5T data of the run, and of the old file (from the catalog)
+	eN = era5t_start()
+	
+	## Zarr store
+	if cdsuParams.output_format == "zarr":
+		logger.info( f" * {cvar} ({freq})" )
+		path    = zarr_path( cvar , freq )
+		eO,tO1  = catalog_era5t(path)
+		for ifileN in ifilesN:
+			idataN = open_tmp( os.path.join( ipath , ifileN ) )
+			try:
+				merge_zarr( idataN , cvar , freq )
+				eO  = merged_era5t( eO , tO1 , idataN.time.values , eN , freq )
+			finally:
+				idataN.close()
+		with xr.open_zarr( path , chunks = None , consolidated = False ) as idata:
+			catalog_update( path , cvar , freq , idata.time.values , eO )
+		return
+	
+	logger.info( f" * {cvar} ({freq}, {shard})" )
+	
+	## Time steps of the shard
+	start,end = shard_bounds( shard , cdsuParams.file_period )
+	
+	## Old file on an object store, fetched in the staging directory
+	remote = cdsuParams.output_url is not None
+	ofile  = ifileO
+	if remote and ifileO is not None:
+		remote_fetch( os.path.join( opath , ifileO ) )
+	eO,tO1 = catalog_era5t( os.path.join( opath , ifileO ) ) if ifileO is not None else (None,None)
+	
+	## A shard can be made of several intermediate (yearly) files, merged one
+	## after the other. The replaced files are removed only once the merged
+	## file is in the catalog.
+	replaced = []
+	for ifileN in ifilesN:
+		idataN = open_tmp( os.path.join( ipath , ifileN ) )
+		time   = idataN.time.values
+		i0     = np.searchsorted( time , start.astype(time.dtype) , side = "left" )
+		i1     = np.searchsorted( time , end.astype(time.dtype)   , side = "left" )
+		try:
+			if i0 < i1:
+				mfile = _merge_file( idataN.isel( time = slice(i0,i1) ) , freq , cvar , opath , ofile )
+				eO    = merged_era5t( eO , tO1 , time[i0:i1] , eN , freq )
+				if ofile is not None and not mfile == ofile:
+					replaced.append(ofile)
+				ofile = mfile
+		finally:
+			idataN.close()
+	if ofile is None:
+		return
+	
+	## Record the merged file in the catalog
+	catalog_update( os.path.join( opath , ofile ) , cvar , freq , file_time( os.path.join( opath , ofile ) ) , eO , replaced = None if ifileO is None else os.path.join( opath , ifileO ) )
+	
+	## Remove the replaced files, and upload the merged file (the old one is
+	## removed after)
+	for f in replaced:
+		if os.path.isfile( os.path.join( opath , f ) ):
+			os.remove( os.path.join( opath , f ) )
+	if remote:
+		remote_upload( os.path.join( opath , ofile ) )
+		if ifileO is not None and not ifileO == ofile:
+			remote_remove( os.path.join( opath , ifileO ) )
+##}}}
+
+def _merge_file( idataN , freq , cvar , opath , ifileO ):##{{{
+	
+	## Merge the new data idataN in the old file ifileO, returns the name of
+	## the merged file. The old file is not removed.
+	
+	area_name = cdsuParams.area_name
+	
+	## Case 2, new file, but no old data
+	if ifileO is None:
+		logger.info( f" * No old data to merge" )
+		t0     = time2str( idataN.time.values[ 0] , freq )
+		t1     = time2str( idataN.time.values[-1] , freq )
+		ofile  = f"ERA5_{cvar}_{freq}_{area_name}_{t0}-{t1}.nc"
+		logger.info( f" * Save '{ofile}'" )
+		with atomic_output( os.path.join( opath , ofile ) ) as tfile:
+			save_netcdf( idataN , cvar , freq , tfile )
+		return ofile
+	
+	## Case 3, must merge the two files
+	logger.info( f" * Require merge" )
+	find_grid(idataN)
+	
+	## Append mode, only the new time steps are written in the old file
+	if cdsuParams.merge_mode == "append":
+		ofile = append_netcdf( idataN , cvar , freq , opath , ifileO )
+		if ofile is not None:
+			logger.info( f" * Append in '{ofile}'" )
+			return ofile
+		logger.info( f" * Can not append in '{ifileO}', rewrite" )
+	
+	idataO = xr.open_dataset( os.path.join( opath , ifileO ) )
+	time   = np.union1d( idataO.time.values , idataN.time.values )
+	idata  = xr.Dataset( coords = { "time" : time } )
+	X      = CombineFirst( idataN[cvar] , idataO[cvar] , time )
+	
+	t0     = time2str( time[ 0] , freq )
+	t1     = time2str( time[-1] , freq )
+	ofile  = f"ERA5_{cvar}_{freq}_{area_name}_{t0}-{t1}.nc"
+	logger.info( f" * Save '{ofile}'" )
+	
+	## Written in a temporary file, renamed over the old file (if the name has
+	## changed, the old file is removed by merge_unit)
+	try:
+		with atomic_output( os.path.join( opath , ofile ) ) as tfile:
+			save_netcdf( idata , cvar , freq , tfile , X )
+	finally:
+		idataO.close()
+	
+	return ofile
+##}}}
+
+@with_params
+@hdf5_serialized
+def merge_AMIP_CF_format( years = None , pool = None ):##{{{
 	
 	## Parameters
 	area_name = cdsuParams.area_name
 	
+	## List of merge units (freq,cvar,shard,ifilesN,ifileO)
+	period = cdsuParams.file_period
+	
+	## Catalog of the output files (the old files are found with it), fetched
+	## from the object store
+	if cdsuParams.output_url is not None:
+		remote_fetch( catalog_file() )
+	con = open_catalog()
+	units = []
+	
 	## List of cvars
 	cvars = list(cdsuParams.cvars_cmp)
 	for cvar,level in zip(cdsuParams.cvars_dwl,cdsuParams.cvars_lev):
 		
+		## Orography is saved with the first year
 		if level == "single" and cvar == "orog":
-			save_orography()
+			if years is None or cdsuParams.years()[0] in years:
+				units.append( ("fx",cvar,None,None,None) )
 			continue
 		
 		if level == "single":
@@ -453,71 +1049,62 @@ def merge_AMIP_CF_format():##{{{
 		
 		## Loop on climate variables
 		for cvar in cvars:
-			logger.info( "AMIP to CF, final merge" )
-			logger.info( f" * {cvar}" )
 			
-			## Path
-			ipath = os.path.join( cdsuParams.tmp        , "ERA5-AMIP" ,             freq , cvar )
-			if not os.path.isdir(ipath):
+			## Path and new files
+			ipath   = os.path.join( cdsuParams.tmp        , "ERA5-AMIP" ,             freq , cvar )
+			ifilesN = list_tmp(ipath)
+			if len(ifilesN) == 0:
 				continue
 			opath = os.path.join( cdsuParams.output_dir , "ERA5"      , area_name , freq , cvar )
 			if not os.path.isdir(opath):
 				os.makedirs(opath)
 			
-			## List files
-			ifilesN = os.listdir(ipath)
-			ifilesO = os.listdir(opath)
+			## Zarr, one store by variable
+			if cdsuParams.output_format == "zarr":
+				ifilesN = [ f for f in ifilesN if years is None or file_range(f)[0][:4] in years ]
+				if len(ifilesN) > 0:
+					units.append( (freq,cvar,None,ifilesN,None) )
+				continue
 			
-			## Split files in year
-			difilesN = { ifileN.split("_")[-1][:4] : ifileN for ifileN in ifilesN }
-			difilesO = { ifileO.split("_")[-1][:4] : ifileO for ifileO in ifilesO }
+			## Old files, from the catalog checked against the directory
+			catalog_reconcile( con , area_name , freq , cvar )
+			ifilesO = [ f for f in catalog_files( con , area_name , freq , cvar ) if f.endswith(".nc") ]
 			
-			## Total available years
-			years = list(set( list(difilesN) + list(difilesO) ))
-			years.sort()
-			for year in years:
-				
-				ifileN = difilesN.get(year)
-				ifileO = difilesO.get(year)
-				
-				## Case 1, no new file for this specific year
-				if ifileN is None:
+			## Split the new (yearly) files in shards, a file can cover several
+			## shards (months), and a shard several files (decade)
+			dshardsN = {}
+			for ifileN in ifilesN:
+				t0,t1 = file_range(ifileN)
+				if years is not None and not t0[:4] in years:
 					continue
-				
-				## Case 2, new file, but no old data
-				if ifileO is None:
-					logger.info( f" * No old data to merge" )
-					idataN = xr.open_dataset( os.path.join( ipath , ifileN ) )
-					if freq == "hr":
-						t0    = str(idataN.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-						t1    = str(idataN.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-					else:
-						t0    = str(idataN.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-						t1    = str(idataN.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-					ofile  = f"ERA5_{cvar}_{freq}_{area_name}_{t0}-{t1}.nc"
-					logger.info( f" * Save '{ofile}'" )
-					save_netcdf( idataN , cvar , freq , os.path.join( opath , ofile ) )
-				
-				## Case 3, must merge the two files
-				if ifileO is not None and ifileN is not None:
-					logger.info( f" * Require merge" )
-					idataN = xr.open_dataset( os.path.join( ipath , ifileN ) ).expand_dims("version").assign_coords( version = [1] )
-					idataO = xr.open_dataset( os.path.join( opath , ifileO ) ).expand_dims("version").assign_coords( version = [0] )
-					idata  = xr.concat( [idataN,idataO] , dim = "version" )
-					idata  = idata.sel( version = 1 ).combine_first( idata.sel( version = 0 ) ).compute()
-					del idataN
-					del idataO
-					os.remove( os.path.join( opath , ifileO ) )
-					
-					if freq == "hr":
-						t0    = str(idata.time[ 0].values)[:13].replace("-","").replace(" ","").replace("T","")
-						t1    = str(idata.time[-1].values)[:13].replace("-","").replace(" ","").replace("T","")
-					else:
-						t0    = str(idata.time[ 0].values)[:10].replace("-","").replace(" ","").replace("T","")
-						t1    = str(idata.time[-1].values)[:10].replace("-","").replace(" ","").replace("T","")
-					ofile  = f"ERA5_{cvar}_{freq}_{area_name}_{t0}-{t1}.nc"
-					logger.info( f" * Save '{ofile}'" )
-					save_netcdf( idata , cvar , freq , os.path.join( opath , ofile ) )
+				for key in shard_keys( t0 , t1 , period ):
+					dshardsN[key] = dshardsN.get( key , [] ) + [ifileN]
+			
+			## Old files, by shard
+			difilesO = {}
+			for ifileO in ifilesO:
+				t0,t1 = file_range(ifileO)
+				key   = shard_key( t0 , period )
+				if not key == shard_key( t1 , period ) or key in difilesO:
+					raise Exception( f"The file '{ifileO}' is not a '{period}' file, use the --file-period of the existing files" )
+				difilesO[key] = ifileO
+			
+			## Shards with new data, if no new file there is nothing to merge
+			for key in sorted(dshardsN):
+				units.append( (freq,cvar,key,dshardsN[key],difilesO.get(key)) )
+	
+	con.close()
+	
+	## And run, in parallel if a pool is given
+	logger.info( "AMIP to CF, final merge" )
+	try:
+		run_units( merge_unit , units , pool )
+		
+		## Index of the files of each variable, with the new files
+		write_indexes( sorted(set( unit[:2] for unit in units )) )
+	finally:
+		if cdsuParams.output_url is not None:
+			remote_upload( catalog_file() )
 ##}}}
 
 
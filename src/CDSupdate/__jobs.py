@@ -0,0 +1,345 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import contextvars
+import concurrent.futures
+import datetime as dt
+
+from .__lazy import lazy_import
+
+tomllib = lazy_import("tomllib") or lazy_import("tomli")
+
+
+#############
+## Imports ##
+#############
+
+from .__CDSUParams import CDSUParams
+from .__CDSUParams import cdsuParams
+from .__CDSUParams import use_params
+from .__CDSUParams import current_params
+from .__blocks import parse_memory
+from .__io import list_requests_CDS
+from .__io import download_CDS
+from .__pipeline import run_pipeline
+from .__workers import make_pool
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+## Global limits of a jobs file, in the table [limits]:
+## - download_workers: concurrent requests to the CDS, for all the jobs
+## - cpu_workers     : processes of the merges, one pool for all the jobs
+##                     (the conversions are serialized by the HDF5 lock,
+##                     see __workers)
+## - max_tmp         : size of the tmp directory of all the jobs (raw and
+##                     intermediate files), estimated from the requests
+## - jobs            : number of jobs run concurrently
+jobs_limits = { "download_workers" : 4 , "cpu_workers" : 1 , "max_tmp" : None , "jobs" : 4 }
+
+
+#############
+## Classes ##
+#############
+
+class SharedDownloads:##{{{
+	
+	## Downloads of all the jobs of a jobs file. The requests run in one pool
+	## of threads (the global limit of requests to the CDS), an identical raw
+	## request (same dataset, variable, area and dates) of several jobs is
+	## downloaded once in cache_dir, and hard linked in the tmp directory of
+	## each job (copied if the link is not possible). The cached file is
+	## removed when all the jobs have it. A year of a job is started only if
+	## its estimated size fits in the tmp budget (max_tmp), or if nothing else
+	## is reserved.
+	
+	def __init__( self , max_workers , cache_dir , max_tmp = None ):##{{{
+		
+		self.cache_dir = cache_dir
+		self.max_tmp   = max_tmp
+		self.pool      = concurrent.futures.ThreadPoolExecutor( max_workers = max_workers )
+		self.reserved  = {}
+		self.ndownload = 0
+		self.nshared   = 0
+		
+		self._users    = {}
+		self._futures  = {}
+		self._lock     = threading.Lock()
+		self._budget   = threading.Condition()
+		os.makedirs( cache_dir , exist_ok = True )
+	##}}}
+	
+	@staticmethod
+	def request_key( name , request ):##{{{
+		return hashlib.sha256( json.dumps( [name,request] , sort_keys = True ).encode() ).hexdigest()
+	##}}}
+	
+	def register( self , requests ):##{{{
+		
+		## Count the jobs using each raw request, requests is the output of
+		## list_requests_CDS of a job
+		for key,cvar,name,request,target in requests:
+			rkey = self.request_key( name , request )
+			self._users[rkey] = self._users.get( rkey , 0 ) + 1
+	##}}}
+	
+	def submit( self , key , cvar , name , request , target ):##{{{
+		
+		## Future of the download of target, the raw request is downloaded by
+		## the first job which needs it
+		rkey  = self.request_key( name , request )
+		cfile = os.path.join( self.cache_dir , f"{rkey}.nc" )
+		with self._lock:
+			if rkey not in self._futures:
+				self._futures[rkey] = self.pool.submit( contextvars.copy_context().run , download_CDS , key , cvar , name , request , cfile )
+				self.ndownload += 1
+			else:
+				self.nshared += 1
+				logger.info( f" * '{os.path.basename(target)}' shared with another job" )
+			rfuture = self._futures[rkey]
+		
+		future = concurrent.futures.Future()
+		def done(f):
+			## The future of the job can be cancelled (failed job)
+			if not future.set_running_or_notify_cancel():
+				return
+			try:
+				f.result()
+				self._deliver( rkey , cfile , target )
+				future.set_result(None)
+			except BaseException as e:
+				future.set_exception(e)
+		rfuture.add_done_callback(done)
+		
+		return future
+	##}}}
+	
+	def _deliver( self , rkey , cfile , target ):##{{{
+		
+		## The download can have failed (the data are not used, see
+		## download_CDS), then the target is not created
+		with self._lock:
+			if os.path.isfile(cfile):
+				try:
+					os.link( cfile , target )
+				except OSError:
+					shutil.copyfile( cfile , target )
+			self._users[rkey] = self._users.get( rkey , 1 ) - 1
+			if self._users[rkey] <= 0 and os.path.isfile(cfile):
+				os.remove(cfile)
+	##}}}
+	
+	@staticmethod
+	def estimate( params , year ):##{{{
+		
+		## Size of the raw and intermediate files of a year of a job, float32
+		## on the 0.25 degree grid of the CDS
+		lon0,lon1,lat0,lat1 = params.area
+		npoints = ( int( (lon1 - lon0) / 0.25 ) + 1 ) * ( int( (lat1 - lat0) / 0.25 ) + 1 )
+		nhours  = sum( 24 * ( ( dt.date.fromisoformat(tr) - dt.date.fromisoformat(tl) ).days + 1 ) for tl,tr in params.cdsApiParams if tl[:4] == str(year) )
+		
+		return 2 * 4 * npoints * nhours * len(params.cvars_dwl)
+	##}}}
+	
+	def reserve( self , year , wait = False ):##{{{
+		
+		## Reserve the tmp budget for a year of the current job, if wait the
+		## call blocks until the budget is available
+		params = current_params()
+		key    = (id(params),str(year))
+		size   = self.estimate( params , year )
+		with self._budget:
+			while True:
+				if self.max_tmp is None or len(self.reserved) == 0 or sum(self.reserved.values()) + size <= self.max_tmp:
+					self.reserved[key] = size
+					return True
+				if not wait:
+					return False
+				self._budget.wait()
+	##}}}
+	
+	def release( self , year ):##{{{
+		with self._budget:
+			if self.reserved.pop( (id(current_params()),str(year)) , None ) is not None:
+				self._budget.notify_all()
+	##}}}
+	
+	def shutdown(self):##{{{
+		self.pool.shutdown()
+		shutil.rmtree( self.cache_dir , ignore_errors = True )
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def _argv( options ):##{{{
+	
+	## Arguments of 'cdsupdate' from the options of a job, the keys are the
+	## options without '--' ('output-dir' or 'output_dir'), true for a flag,
+	## and a list for comma separated values
+	argv = []
+	for key,value in options.items():
+		if value is False or value is None:
+			continue
+		argv.append( "--" + key.replace("_","-") )
+		if value is True:
+			continue
+		if isinstance(value,list):
+			value = ",".join( str(v) for v in value )
+		argv.append(str(value))
+	
+	return argv
+##}}}
+
+def load_jobs( path ):##{{{
+	
+	## Limits and jobs (name,argv) of a jobs file:
+	##
+	## [limits]
+	## download_workers = 4
+	## cpu_workers      = 4
+	## max_tmp          = "100G"
+	## jobs             = 2
+	##
+	## [defaults]                  # options of all the jobs
+	## output-dir = "data/"
+	##
+	## [[job]]
+	## name   = "sfcWind-NA"       # optional
+	## cvars  = "sfcWind"
+	## area   = "NorthAtlantic"
+	## period = "2024-06-01/"
+	## keep-hourly = true
+	with open( path , "rb" ) as f:
+		spec = tomllib.load(f)
+	
+	limits = dict(jobs_limits)
+	for key,value in spec.get( "limits" , {} ).items():
+		key = key.replace("-","_")
+		if not key in jobs_limits:
+			raise Exception( f"Unknown limit '{key}' in the jobs file {path}" )
+		limits[key] = value
+	if limits["max_tmp"] is not None:
+		limits["max_tmp"] = parse_memory(limits["max_tmp"])
+	for key in ["download_workers","cpu_workers","jobs"]:
+		if not int(limits[key]) > 0:
+			raise Exception( f"The limit '{key}' of the jobs file must be positive" )
+	
+	## Jobs, the global options of the jobs file are not options of the jobs
+	defaults = spec.get( "defaults" , {} )
+	jobs     = []
+	for i,job in enumerate( spec.get( "job" , [] ) ):
+		options = { **defaults , **job }
+		name    = str( options.pop( "name" , f"job{i}" ) )
+		for key in ["jobs-file","jobs_file","tmp","log","download-workers","download_workers","merge-workers","merge_workers"]:
+			if key in options:
+				raise Exception( f"The option '{key}' can not be given by job (job '{name}')" )
+		jobs.append( (name,_argv(options)) )
+	if len(jobs) == 0:
+		raise Exception( f"No job in the jobs file {path}" )
+	if not len(set( name for name,_ in jobs )) == len(jobs):
+		raise Exception( f"The names of the jobs must be unique" )
+	
+	return limits,jobs
+##}}}
+
+def _run_job( name , params , shared , mpool ):##{{{
+	
+	logger.info( f"Job '{name}': start" )
+	try:
+		run_pipeline( downloads = shared , merge_pool = mpool , params = params )
+	finally:
+		params.tmp_gen.cleanup()
+	logger.info( f"Job '{name}': done" )
+##}}}
+
+def run_jobs( path ):##{{{
+	
+	## Run all the jobs of the jobs file path, with the global limits. The
+	## jobs have their own tmp directory in the tmp directory of the run, and
+	## are run concurrently in threads (see CDSupdate.__CDSUParams.use_params).
+	## A failed job does not stop the others, the errors are raised together
+	## at the end.
+	limits,jobs = load_jobs(path)
+	
+	## Parameters of the jobs, checked before any download
+	lparams = []
+	for name,argv in jobs:
+		params = CDSUParams()
+		params.init_from_user_input( *argv , "--tmp" , cdsuParams.tmp , "--merge-workers" , str(limits["cpu_workers"]) , "--download-workers" , str(limits["download_workers"]) )
+		params.check()
+		if params.abort:
+			raise Exception( f"Job '{name}': {params.error}" )
+		params.init_tmp()
+		params.build_CDSAPIParams()
+		lparams.append(params)
+	
+	## Downloads of all the jobs, the identical raw requests are counted
+	shared = SharedDownloads( limits["download_workers"] , os.path.join( cdsuParams.tmp , "ERA5-CACHE" ) , limits["max_tmp"] )
+	for params in lparams:
+		with use_params(params):
+			shared.register( list_requests_CDS() )
+	
+	## Processes of the merges, shared by the jobs (None if sequential)
+	mpool = make_pool(limits["cpu_workers"])
+	
+	logger.info( f"Jobs file '{path}': {len(jobs)} jobs" )
+	errors = []
+	try:
+		with concurrent.futures.ThreadPoolExecutor( max_workers = limits["jobs"] ) as pool:
+			futures = [ pool.submit( _run_job , name , params , shared , mpool ) for (name,_),params in zip(jobs,lparams) ]
+			for (name,_),f in zip(jobs,futures):
+				try:
+					f.result()
+				except Exception as e:
+					logger.error( f"Job '{name}' failed: {e}" )
+					errors.append(e)
+	finally:
+		shared.shutdown()
+		if mpool is not None:
+			mpool.shutdown()
+	logger.info( f" * {shared.ndownload} requests downloaded, {shared.nshared} shared between jobs" )
+	
+	if len(errors) > 0:
+		raise Exception( f"{len(errors)} / {len(jobs)} jobs failed" )
+##}}}
+
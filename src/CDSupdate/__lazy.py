@@ -0,0 +1,69 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import importlib
+import importlib.util
+
+
+#############
+## Classes ##
+#############
+
+## The heavy packages (xarray, netCDF4, zarr, ...) are imported at their first
+## use, by the stage which needs them: the import of CDSupdate and the
+## command line (e.g. --help) do not pay their import.
+
+class LazyModule:##{{{
+	
+	## Module 'name', imported at the first access to one of its attributes
+	
+	def __init__( self , name ):##{{{
+		self._name   = name
+		self._module = None
+	##}}}
+	
+	def __getattr__( self , attr ):##{{{
+		if self._module is None:
+			self._module = importlib.import_module(self._name)
+		return getattr( self._module , attr )
+	##}}}
+	
+	def __repr__( self ):##{{{
+		return f"<LazyModule '{self._name}'>"
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def lazy_import( name ):##{{{
+	
+	## Lazy module of an optional package, None if it is not installed (only
+	## the top level package is searched, it is not imported)
+	if importlib.util.find_spec( name.split(".")[0] ) is None:
+		return None
+	return LazyModule(name)
+##}}}
+
@@ -0,0 +1,189 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import logging
+import dataclasses
+
+import numpy as np
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+lossy_modes = ["none","bitround","pack"]
+
+## Fill value of the packed data, the valid range is mapped on [-32767,32767]
+pack_fill  = np.int16(-32768)
+pack_steps = 2**16 - 2
+
+
+#############
+## Classes ##
+#############
+
+@dataclasses.dataclass(frozen=True)
+class Lossy:##{{{
+	
+	## Lossy encoding of a variable, 'none', 'bitround[-nsb]' or 'pack'.
+	## - bitround: only nsb bits of the mantissa are kept (default from the
+	##   'nsb' column of ERA5-name.csv), the relative error is less than
+	##   2**-(nsb+1). Decoded by any netCDF reader, the gain comes from the
+	##   compression of the zeroed bits.
+	## - pack: CF int16 packing with scale_factor / add_offset over the range
+	##   [valid_min,valid_max] of ERA5-name.csv, the absolute error is half a
+	##   step, (valid_max - valid_min) / (2 * 65534), up to the float32
+	##   rounding of the decoded values. Values outside the range are clipped.
+	
+	mode : str        = "none"
+	nsb  : int | None = None
+	
+	@staticmethod
+	def from_str( s ):##{{{
+		
+		parts = s.strip().split("-")
+		if not parts[0] in lossy_modes or len(parts) > 2 or ( len(parts) == 2 and not parts[0] == "bitround" ):
+			raise ValueError( f"Invalid lossy encoding: '{s}'" )
+		nsb = int(parts[1]) if len(parts) == 2 else None
+		
+		return Lossy( parts[0] , nsb )
+	##}}}
+	
+	def __str__(self):##{{{
+		if self.nsb is None:
+			return self.mode
+		return f"{self.mode}-{self.nsb}"
+	##}}}
+	
+	def dtype(self):##{{{
+		return "int16" if self.mode == "pack" else "float32"
+	##}}}
+	
+	def fill_value(self):##{{{
+		return pack_fill if self.mode == "pack" else np.nan
+	##}}}
+	
+	def kwargs( self , cvarsParams , cvar ):##{{{
+		
+		## Arguments of netCDF4.Dataset.createVariable
+		if self.mode == "bitround":
+			nsb = cvarsParams.nsb(cvar) if self.nsb is None else self.nsb
+			return { "significant_digits" : nsb , "quantize_mode" : "BitRound" }
+		
+		return {}
+	##}}}
+	
+	def pack_params( self , cvarsParams , cvar ):##{{{
+		vmin,vmax = cvarsParams.valid_range(cvar)
+		scale     = np.float32( ( vmax - vmin ) / pack_steps )
+		offset    = np.float32( ( vmax + vmin ) / 2 )
+		return scale,offset
+	##}}}
+	
+	def set_attrs( self , ncv , cvarsParams , cvar ):##{{{
+		
+		## Must be set before writing, netCDF4 packs the data with them
+		if self.mode == "pack":
+			scale,offset = self.pack_params( cvarsParams , cvar )
+			vmin,vmax    = cvarsParams.valid_range(cvar)
+			ncv.setncattr( "scale_factor" , scale )
+			ncv.setncattr( "add_offset"   , offset )
+			ncv.setncattr( "valid_min"    , np.float32(vmin) )
+			ncv.setncattr( "valid_max"    , np.float32(vmax) )
+	##}}}
+	
+	def zarr_encoding( self , cvarsParams , cvar ):##{{{
+		
+		## Encoding of xarray.Dataset.to_zarr, the packing is done by xarray
+		if self.mode == "pack":
+			scale,offset = self.pack_params( cvarsParams , cvar )
+			return { "dtype" : "int16" , "scale_factor" : scale , "add_offset" : offset , "_FillValue" : pack_fill }
+		
+		return { "dtype" : "float32" , "_FillValue" : np.float32(np.nan) }
+	##}}}
+	
+	def bitround( self , X , cvarsParams , cvar ):##{{{
+		
+		## Bit-rounding of float32 data (round to nearest of the nsb kept bits
+		## of the mantissa), as the BitRound quantization of netCDF, for the
+		## backends without it (zarr)
+		if not self.mode == "bitround":
+			return X
+		nsb  = cvarsParams.nsb(cvar) if self.nsb is None else self.nsb
+		drop = 23 - nsb
+		if drop <= 0:
+			return X
+		
+		X = np.asarray( X , dtype = np.float32 )
+		B = X.view(np.int32)
+		B = B + ( ( B >> drop ) & 1 ) + ( ( 1 << ( drop - 1 ) ) - 1 )
+		B = B & np.int32( ~( ( 1 << drop ) - 1 ) )
+		
+		return np.where( np.isnan(X) , X , B.view(np.float32) )
+	##}}}
+	
+	def encode( self , X , cvarsParams , cvar ):##{{{
+		
+		## Data to write, as a masked array (missing values are the NaN)
+		invalid = np.isnan(X)
+		if self.mode == "pack":
+			vmin,vmax = cvarsParams.valid_range(cvar)
+			nout = int(np.sum( ( X < vmin ) | ( X > vmax ) ))
+			if nout > 0:
+				logger.warning( f"{nout} values of {cvar} outside [{vmin},{vmax}] are clipped" )
+			X = np.where( invalid , ( vmin + vmax ) / 2 , np.clip( X , vmin , vmax ) )
+		else:
+			X = np.where( invalid , 0 , X )
+		
+		return np.ma.MaskedArray( X.astype(np.float32) , mask = invalid )
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def parse_lossy( s ):##{{{
+	
+	## 'mode' or 'mode,cvar:mode,...', returns a dict cvar => Lossy, with the
+	## key None for the default
+	out = { None : Lossy() }
+	for item in s.split(","):
+		if ":" in item:
+			cvar,mode = item.split(":")
+			out[cvar.strip()] = Lossy.from_str(mode)
+		else:
+			out[None] = Lossy.from_str(item)
+	
+	return out
+##}}}
+
@@ -0,0 +1,145 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import logging
+import contextvars
+import concurrent.futures
+
+
+#############
+## Imports ##
+#############
+
+from .__CDSUParams import cdsuParams
+from .__CDSUParams import with_params
+from .__CDSUParams import current_params
+from .__io import list_requests_CDS
+from .__io import download_CDS
+from .__io import BRUT_to_AMIP_format
+from .__io import merge_AMIP_CF_format
+from .__extracvars import build_EXTRA_cvars
+from .__store import HourlyStore
+from .__workers import make_pool
+from .__workers import hdf5_lock
+from .__tmpfiles import release_tmp
+from .__tmpfiles import remove_year
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Functions ##
+###############
+
+@with_params
+def run_pipeline( merge = True , downloads = None , merge_pool = None ):##{{{
+	
+	## Streaming pipeline: the downloads run in a pool of threads
+	## (--download-workers), and a year is converted, completed by the extra
+	## variables and merged, in the main thread, as soon as all its downloads
+	## are done. At most --queue-years years are downloaded ahead of the year
+	## processed, and the files of a year are removed from the tmp directory
+	## once merged, to bound its size. The parameters of the run (params) are
+	## given to the threads of the downloads. Without merge, the data are only
+	## converted (see CDSupdate.fetch).
+	## downloads is a scheduler shared by several runs (see
+	## CDSupdate.__jobs.SharedDownloads): the downloads are submitted to it,
+	## and a year is started only if it is reserved in its tmp budget.
+	## merge_pool is a pool of processes for the merge shared by several runs,
+	## by default the run has its own (--merge-workers).
+	
+	## Downloads, by year
+	requests = {}
+	for args in list_requests_CDS():
+		year = args[0][0][:4]
+		requests[year] = requests.get( year , [] ) + [args]
+	years = cdsuParams.years()
+	
+	## Hourly data shared by conversion and extra variables
+	store = HourlyStore.from_params(current_params())
+	
+	## Processes for the merge (None if sequential)
+	mpool = merge_pool
+	if mpool is None and merge:
+		mpool = make_pool(cdsuParams.merge_workers)
+	
+	with concurrent.futures.ThreadPoolExecutor( max_workers = cdsuParams.download_workers ) as pool:
+		
+		futures = {}
+		def submit( i , wait = False ):
+			if i < len(years) and years[i] not in futures:
+				if downloads is not None and not downloads.reserve( years[i] , wait ):
+					return
+				logger.info( f"Start download {years[i]}" )
+				if downloads is None:
+					futures[years[i]] = [ pool.submit( contextvars.copy_context().run , download_CDS , *args ) for args in requests.get( years[i] , [] ) ]
+				else:
+					futures[years[i]] = [ downloads.submit(*args) for args in requests.get( years[i] , [] ) ]
+		
+		try:
+			for i,year in enumerate(years):
+				
+				## Bounded queue of years in download, only the year processed
+				## waits for the tmp budget
+				submit( i , wait = True )
+				for j in range( i + 1 , i + cdsuParams.queue_years ):
+					submit(j)
+				
+				## Wait the downloads of the year
+				for f in concurrent.futures.as_completed(futures[year]):
+					f.result()
+				logger.info( f"Downloads of {year} done" )
+				
+				## Change data format and build extra variables
+				BRUT_to_AMIP_format( store , [year] )
+				build_EXTRA_cvars( store , [year] )
+				with hdf5_lock:
+					store.release(year)
+				
+				## And merge with current data
+				if merge:
+					merge_AMIP_CF_format( [year] , mpool )
+					remove_year( cdsuParams.tmp , year )
+				if downloads is not None:
+					downloads.release(year)
+		except BaseException:
+			for fs in futures.values():
+				for f in fs:
+					f.cancel()
+			raise
+		finally:
+			if mpool is not None and merge_pool is None:
+				mpool.shutdown()
+			if merge:
+				release_tmp(cdsuParams.tmp)
+			if downloads is not None:
+				for year in futures:
+					downloads.release(year)
+	
+##}}}
+
@@ -0,0 +1,232 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import sqlite3
+import functools
+import importlib.util
+import logging
+
+import numpy  as np
+
+from .__lazy import LazyModule
+
+xr = LazyModule("xarray")
+
+
+#############
+## Imports ##
+#############
+
+from .__catalog import catalog_file
+from .__shards import file_range
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+## Number of output files kept open by open_output
+open_cache_size = 64
+
+
+###############
+## Functions ##
+###############
+
+## Reader of the output tree output_dir/ERA5/area/freq/cvar, exported as
+## CDSupdate.open. The files are found with the catalog (or with their names
+## if there is no catalog), only the files of the period are opened, and the
+## selection (period, box, points) is done on each file before the
+## concatenation: only the chunks of the selection are read. With dask, the
+## dataset is lazy, otherwise only the selection is loaded.
+
+def _period( period ):##{{{
+	
+	## First and last time steps (hours) of a period 't0/t1' (or a tuple),
+	## t0 or t1 can be empty, or 't' for 't/t'. The last time step is the end
+	## of t1, e.g. the 31 December 23h for t1 = '2020' or '2020-12-31'.
+	if period is None:
+		return None,None
+	if isinstance(period,str):
+		period = period.split("/")
+		if len(period) == 1:
+			period = period + period
+		if not len(period) == 2:
+			raise ValueError( "The period must be 't0/t1'" )
+	t0,t1 = [ None if t is None or (isinstance(t,str) and t == "") else np.datetime64(t) for t in period ]
+	if t0 is not None:
+		t0 = t0.astype("datetime64[h]")
+	if t1 is not None:
+		unit = np.datetime_data(t1.dtype)[0]
+		if unit in ["Y","M","W","D"]:
+			t1 = ( t1 + np.timedelta64(1,unit) ).astype("datetime64[h]") - np.timedelta64(1,"h")
+		else:
+			t1 = t1.astype("datetime64[h]")
+	
+	return t0,t1
+##}}}
+
+def _files( root , area , freq , cvar , t0 , t1 ):##{{{
+	
+	## Output files of (area,freq,cvar) overlapping [t0,t1], sorted by time.
+	## The catalog is opened read only.
+	cfile = catalog_file(root)
+	ipath = os.path.join( root , "ERA5" , area , freq , cvar )
+	if os.path.isfile(cfile):
+		query = "SELECT path,t0,t1 FROM files WHERE area = ? AND freq = ? AND cvar = ? ORDER BY t0"
+		con   = sqlite3.connect( f"file:{cfile}?mode=ro" , uri = True )
+		try:
+			rows = con.execute( query , (area,freq,cvar) ).fetchall()
+		finally:
+			con.close()
+		rows = [ ( os.path.join( root , "ERA5" , path ) , r0 , r1 ) for path,r0,r1 in rows ]
+	elif os.path.isdir(ipath):
+		rows = []
+		for name in sorted(os.listdir(ipath)):
+			path = os.path.join( ipath , name )
+			if name.startswith(".") or not ( name.endswith(".nc") or name.endswith(".zarr") ):
+				continue
+			if freq == "fx" or name.endswith(".zarr"):
+				rows.append( (path,None,None) )
+				continue
+			r0,r1 = [ f"{t[:4]}-{t[4:6]}-{t[6:8]}T{t[8:10] or '00'}" for t in file_range(name) ]
+			rows.append( (path,r0,r1) )
+	else:
+		rows = []
+	
+	## Only the files overlapping the period
+	files = []
+	for path,r0,r1 in rows:
+		if t0 is not None and r1 is not None and np.datetime64(r1,"h") < t0:
+			continue
+		if t1 is not None and r0 is not None and np.datetime64(r0,"h") > t1:
+			continue
+		files.append(path)
+	
+	return files
+##}}}
+
+def _open_file( path ):##{{{
+	
+	## Open an output file (or zarr store), lazily. With dask, the chunks of
+	## the file are the dask chunks.
+	chunks = {} if importlib.util.find_spec("dask") is not None else None
+	if path.endswith(".zarr"):
+		return xr.open_zarr( path , consolidated = False , chunks = chunks )
+	return xr.open_dataset( path , chunks = chunks )
+##}}}
+
+def _mtime( path ):##{{{
+	
+	## Modification time of a file, or of a zarr store: the time steps are
+	## appended in the store, the metadata of its arrays are rewritten
+	if not os.path.isdir(path):
+		return os.stat(path).st_mtime_ns
+	mtimes = [ os.stat(path).st_mtime_ns ]
+	for dpath in [ path , os.path.join( path , "time" ) ]:
+		if os.path.isdir(dpath):
+			mtimes = mtimes + [ entry.stat().st_mtime_ns for entry in os.scandir(dpath) if entry.is_file() ]
+	
+	return max(mtimes)
+##}}}
+
+@functools.lru_cache( maxsize = open_cache_size )
+def _open_cached( path , mtime ):##{{{
+	
+	## The modification time is in the key: a rewritten file is opened again
+	return _open_file(path)
+##}}}
+
+def _select( ds , t0 , t1 , bbox , points ):##{{{
+	
+	## Period
+	if "time" in ds.dims and ( t0 is not None or t1 is not None ):
+		ds = ds.sel( time = slice( t0 , t1 ) )
+	
+	## Box lon_min,lon_max,lat_min,lat_max, as for --area
+	if bbox is not None:
+		lon_min,lon_max,lat_min,lat_max = bbox
+		ilat = np.flatnonzero( (ds.lat.values >= lat_min) & (ds.lat.values <= lat_max) )
+		ilon = np.flatnonzero( (ds.lon.values >= lon_min) & (ds.lon.values <= lon_max) )
+		ds   = ds.isel( lat = ilat , lon = ilon )
+	
+	## Nearest grid points of the points (lon,lat), along a dimension 'point'
+	if points is not None:
+		points = np.array( points , dtype = float ).reshape(-1,2)
+		lon    = ( points[:,0] + 180 ) % 360 - 180
+		ilon   = np.abs( ds.lon.values.reshape(1,-1) - lon.reshape(-1,1) ).argmin(1)
+		ilat   = np.abs( ds.lat.values.reshape(1,-1) - points[:,1].reshape(-1,1) ).argmin(1)
+		ds     = ds.isel( lat = xr.DataArray( ilat , dims = "point" ) , lon = xr.DataArray( ilon , dims = "point" ) )
+	
+	return ds
+##}}}
+
+def open_output( area , cvar , freq , period = None , bbox = None , points = None , root = None , cache = True ):##{{{
+	
+	## Parameters
+	## area   : name of the area (the --area of the update)
+	## cvar   : variable, e.g. 'tas' or 'zg500'
+	## freq   : 'hr', 'day' or 'fx'
+	## period : 't0/t1' (e.g. '2020/2022-06' or '2021-01-01/'), 't' for
+	##          't/t', or a tuple, None for all the time steps
+	## bbox   : lon_min,lon_max,lat_min,lat_max
+	## points : list of (lon,lat), the nearest grid points are selected
+	## root   : output directory (the --output-dir of the update), default is
+	##          the current directory
+	## cache  : keep the files open for the next calls (the open_cache_size
+	##          last files)
+	if root is None:
+		root = os.getcwd()
+	t0,t1 = _period(period)
+	files = _files( root , area , freq , cvar , t0 , t1 )
+	if len(files) == 0:
+		raise FileNotFoundError( f"No output file of {cvar} / {freq} / {area} in '{root}' for the period" )
+	
+	## Open and select each file
+	ldata = []
+	for path in files:
+		if cache:
+			ds = _open_cached( path , _mtime(path) )
+		else:
+			ds = _open_file(path)
+		ds = _select( ds , t0 , t1 , bbox , points )
+		if "time" in ds.dims and ds.time.size == 0:
+			continue
+		ldata.append(ds)
+	
+	if len(ldata) == 0:
+		raise FileNotFoundError( f"No time step of {cvar} / {freq} / {area} in '{root}' for the period" )
+	if len(ldata) == 1:
+		return ldata[0]
+	
+	return xr.concat( ldata , dim = "time" , data_vars = "minimal" , coords = "minimal" , compat = "override" , join = "override" , combine_attrs = "override" )
+##}}}
+
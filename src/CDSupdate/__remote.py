@@ -0,0 +1,153 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import logging
+
+from .__lazy import lazy_import
+
+fsspec = lazy_import("fsspec")
+
+
+#############
+## Imports ##
+#############
+
+from .__CDSUParams import cdsuParams
+from .__atomic import atomic_target
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+## Cache of the file systems, by url
+_filesystems = {}
+
+
+###############
+## Functions ##
+###############
+
+## The output files are written in a local staging directory (the
+## --output-dir of the run is then TMP/OUTPUT), and the object store
+## (cdsuParams.output_url) has the same tree. The old files are fetched only
+## when a merge needs them, and the new files are uploaded at the end of each
+## merge unit.
+
+def _remote( lpath ):##{{{
+	
+	## File system of the object store, and the path of the staged path lpath
+	url = cdsuParams.output_url
+	if not url in _filesystems:
+		_filesystems[url] = fsspec.core.url_to_fs(url)
+	fs,root = _filesystems[url]
+	rel = os.path.relpath( lpath , cdsuParams.output_dir )
+	
+	return fs,"/".join( [root.rstrip("/")] + rel.split(os.path.sep) )
+##}}}
+
+def remote_url( lpath ):##{{{
+	
+	## Url on the object store of the staged path lpath
+	fs,rpath = _remote(lpath)
+	return fs.unstrip_protocol(rpath)
+##}}}
+
+def remote_open( lpath ):##{{{
+	
+	## File object of the path lpath, read on the object store if the output
+	## is remote (only the blocks read are downloaded)
+	if cdsuParams.output_url is None:
+		return open( lpath , "rb" )
+	fs,rpath = _remote(lpath)
+	return fs.open( rpath , "rb" )
+##}}}
+
+def remote_find( opath ):##{{{
+	
+	## Files under the output directory opath on the object store, as paths
+	## of the staging directory
+	fs,rpath = _remote(opath)
+	fs.invalidate_cache(rpath)
+	if not fs.exists(rpath):
+		return []
+	
+	return [ os.path.join( opath , *os.path.relpath( p , rpath ).split("/") ) for p in fs.find(rpath) ]
+##}}}
+
+def remote_fetch( ofile ):##{{{
+	
+	## Download the output file ofile in the staging directory, if not
+	## already there. Returns False if the file is not on the object store.
+	if os.path.isfile(ofile):
+		return True
+	fs,rpath = _remote(ofile)
+	if not fs.exists(rpath):
+		return False
+	logger.info( f" * Fetch '{rpath}'" )
+	os.makedirs( os.path.dirname(ofile) , exist_ok = True )
+	tfile = atomic_target(ofile)
+	try:
+		fs.get_file( rpath , tfile )
+	except BaseException:
+		if os.path.isfile(tfile):
+			os.remove(tfile)
+		raise
+	os.replace( tfile , ofile )
+	
+	return True
+##}}}
+
+def remote_upload( ofile ):##{{{
+	
+	## Upload the staged file ofile, and remove the local copy. With S3, the
+	## upload is multipart, and --upload-workers parts are sent in parallel.
+	fs,rpath = _remote(ofile)
+	logger.info( f" * Upload '{rpath}'" )
+	kwargs = {}
+	if "s3" in fs.protocol:
+		kwargs["max_concurrency"] = cdsuParams.upload_workers
+	fs.makedirs( rpath.rsplit("/",1)[0] , exist_ok = True )
+	fs.put_file( ofile , rpath , **kwargs )
+	os.remove(ofile)
+##}}}
+
+def remote_remove( ofile ):##{{{
+	
+	## Remove the output file ofile of the object store
+	fs,rpath = _remote(ofile)
+	if fs.exists(rpath):
+		logger.info( f" * Remove '{rpath}'" )
+		fs.rm_file(rpath)
+	if os.path.isfile(ofile):
+		os.remove(ofile)
+##}}}
+
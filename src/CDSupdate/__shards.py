@@ -0,0 +1,94 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import logging
+
+import numpy as np
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+file_periods = ["month","year","decade"]
+
+## Maximal number of time steps of a shard
+shard_steps = { "month"  : { "hr" :   744 , "day" :   31 },
+                "year"   : { "hr" :  8784 , "day" :  366 },
+                "decade" : { "hr" : 87672 , "day" : 3653 } }
+
+
+###############
+## Functions ##
+###############
+
+def file_range( fname ):##{{{
+	
+	## (t0,t1) of a file 'PREFIX_cvar_freq_area_{t0}-{t1}.ext', as strings
+	## 'YYYYMMDD' (day) or 'YYYYMMDDHH' (hr)
+	t0,t1 = fname.split("_")[-1].split(".")[0].split("-")
+	return t0,t1
+##}}}
+
+def shard_key( t , period ):##{{{
+	
+	## Key of the shard containing the time t ('YYYYMMDD[HH]'): 'YYYYMM'
+	## (month), 'YYYY' (year) or 'YYY0' (decade)
+	if period == "month":
+		return t[:6]
+	if period == "year":
+		return t[:4]
+	return t[:3] + "0"
+##}}}
+
+def shard_bounds( key , period ):##{{{
+	
+	## [start,end[ of a shard, in hours
+	if period == "month":
+		start = np.datetime64( f"{key[:4]}-{key[4:6]}" , "M" )
+		end   = start + 1
+	else:
+		start = np.datetime64( key , "Y" )
+		end   = start + ( 1 if period == "year" else 10 )
+	
+	return start.astype("datetime64[h]"),end.astype("datetime64[h]")
+##}}}
+
+def shard_keys( t0 , t1 , period ):##{{{
+	
+	## Keys of the shards between the times t0 and t1 ('YYYYMMDD[HH]')
+	keys  = [shard_key(t0,period)]
+	while not keys[-1] == shard_key(t1,period):
+		_,end = shard_bounds( keys[-1] , period )
+		keys.append( shard_key( str(end.astype("datetime64[M]")).replace("-","") , period ) )
+	
+	return keys
+##}}}
+
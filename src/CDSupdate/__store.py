@@ -0,0 +1,184 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import logging
+
+import numpy  as np
+
+
+#############
+## Imports ##
+#############
+
+from .__blocks import default_memory
+from .__tmpfiles import TmpWriter
+from .__tmpfiles import list_tmp
+from .__tmpfiles import open_tmp
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+#############
+## Classes ##
+#############
+
+class HourlyStore:##{{{
+	
+	## Hourly data of the TMP/ERA5-AMIP/hr stage, by (cvar,year). The hourly
+	## data needed by the extra variables are kept in memory, and written in
+	## TMP/ERA5-AMIP/hr only if the hourly data are kept (--keep-hourly), or
+	## if the memory budget is exceeded (spill).
+	
+	def __init__( self , tmp , area_name , keep_hourly = False , needed = None , max_memory = None , fmt = "netcdf" ):##{{{
+		
+		self.tmp         = tmp
+		self.area_name   = area_name
+		self.keep_hourly = keep_hourly
+		self.fmt         = fmt
+		self.needed      = set() if needed is None else set(needed)
+		self.max_memory  = default_memory() if max_memory is None else max_memory // 2
+		self.nbytes      = 0
+		
+		self._memory = {}
+		self._files  = {}
+		self._opened = {}
+	##}}}
+	
+	@staticmethod
+	def from_params( cdsuParams ):##{{{
+		
+		## Hourly data needed in memory: the dependencies of the extra cvars
+		needed = set()
+		for cvar in cdsuParams.cvars_cmp:
+			needed = needed | set(cdsuParams.cvarsParams.dep_cvars[cdsuParams.cvarsParams.removeLevel(cvar)])
+		
+		return HourlyStore( cdsuParams.tmp , cdsuParams.area_name , cdsuParams.keep_hourly , needed , cdsuParams.max_memory , cdsuParams.tmp_format )
+	##}}}
+	
+	def writer( self , cvar , year , time , grid ):##{{{
+		
+		nbytes = 4 * time.size * grid.nlat * grid.nlon
+		memory = cvar in self.needed and self.nbytes + nbytes <= self.max_memory
+		disk   = self.keep_hourly or ( cvar in self.needed and not memory )
+		if cvar in self.needed and not memory:
+			logger.info( f" * Memory budget exceeded, hourly {cvar} spilled in 'TMP/ERA5-AMIP/hr/{cvar}'" )
+		
+		return StoreWriter( self , cvar , year , time , grid , memory , disk )
+	##}}}
+	
+	def get( self , cvar , year ):##{{{
+		
+		## Return (time,X) with X an array-like with time as first axis, or
+		## None if the data is not available
+		key = (cvar,str(year))
+		if key in self._memory:
+			return self._memory[key]
+		
+		## Not in memory, look on the disk
+		if key not in self._files:
+			ipath  = os.path.join( self.tmp , "ERA5-AMIP" , "hr" , cvar )
+			ifiles = [ f for f in list_tmp(ipath) if f.split("_")[-1][:4] == str(year) ]
+			if len(ifiles) == 0:
+				return None
+			self._files[key] = os.path.join( ipath , ifiles[0] )
+		
+		if key not in self._opened:
+			self._opened[key] = open_tmp( self._files[key] )
+		idata = self._opened[key]
+		
+		return idata.time.values,idata[cvar]
+	##}}}
+	
+	def release( self , year ):##{{{
+		
+		for key in [ key for key in self._opened if key[1] == str(year) ]:
+			self._opened.pop(key).close()
+		for key in [ key for key in self._memory if key[1] == str(year) ]:
+			time,X = self._memory.pop(key)
+			self.nbytes -= X.nbytes
+	##}}}
+	
+##}}}
+
+class StoreWriter:##{{{
+	
+	## Writer of hourly data for a HourlyStore, in memory and / or on disk
+	
+	def __init__( self , store , cvar , year , time , grid , memory , disk ):##{{{
+		
+		self.store = store
+		self.cvar  = cvar
+		self.year  = str(year)
+		self.time  = time
+		self.size  = 0
+		self.X     = None
+		self.wrt   = None
+		
+		if memory:
+			self.X = np.empty( (time.size,) + grid.shape , dtype = np.float32 )
+			store.nbytes += self.X.nbytes
+		if disk:
+			self.wrt = TmpWriter( store.tmp , cvar , "hr" , store.area_name , grid.lat , grid.lon , store.fmt )
+	##}}}
+	
+	def append( self , time , X ):##{{{
+		
+		i0 = self.size
+		i1 = i0 + len(time)
+		if self.X is not None:
+			self.X[i0:i1] = X
+		if self.wrt is not None:
+			self.wrt.append( time , X )
+		self.size = i1
+	##}}}
+	
+	def __enter__(self):##{{{
+		return self
+	##}}}
+	
+	def __exit__( self , exc_type , exc_value , traceback ):##{{{
+		
+		key = (self.cvar,self.year)
+		if self.wrt is not None:
+			if exc_type is None:
+				ofile = self.wrt.close()
+				if ofile is not None:
+					self.store._files[key] = ofile
+			else:
+				self.wrt.abort()
+		
+		if self.X is not None:
+			if exc_type is None:
+				self.store._memory[key] = (self.time[:self.size],self.X[:self.size])
+			else:
+				self.store.nbytes -= self.X.nbytes
+	##}}}
+	
+##}}}
+
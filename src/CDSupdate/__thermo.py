@@ -0,0 +1,352 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+## Thermodynamics kernels used to build the EXTRA variables.
+##
+## All kernels work on float32 numpy arrays, write in a preallocated 'out'
+## buffer, and take their temporaries from a Workspace, so that a loop on time
+## blocks does not allocate anything after the first block. The operations are
+## done in the same order and in the same precision (float32) than the xarray
+## formulas used before, so the results are identical bit-for-bit (NaN are at
+## the same place). All buffers are contiguous, so numpy uses the same exp /
+## sqrt implementation than before; see 'benchmarks/bench_thermo.py' for the
+## check.
+
+##############
+## Packages ##
+##############
+
+import numpy as np
+
+
+###############
+## Variables ##
+###############
+
+TIME_BLOCK = 24 * 31 ## Default number of time steps processed at once
+
+
+#############
+## Classes ##
+#############
+
+class Workspace:##{{{
+	
+	def __init__( self ):##{{{
+		self._buffers = {}
+	##}}}
+	
+	def __call__( self , key , shape , dtype = np.float32 ):##{{{
+		
+		dtype = np.dtype(dtype)
+		size  = int(np.prod(shape))
+		buf   = self._buffers.get( (key,dtype) )
+		if buf is None or buf.size < size:
+			buf = np.empty( size , dtype = dtype )
+			self._buffers[(key,dtype)] = buf
+		
+		return buf[:size].reshape(shape)
+	##}}}
+	
+	@property
+	def nbytes(self):##{{{
+		return sum( buf.nbytes for buf in self._buffers.values() )
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def _init_out( x , out , ws ):##{{{
+	if out is None:
+		out = np.empty( x.shape , dtype = np.float32 )
+	if ws is None:
+		ws = Workspace()
+	return out,ws
+##}}}
+
+def wind_speed( uas , vas , out = None , ws = None ):##{{{
+	
+	## sqrt( uas**2 + vas**2 )
+	out,ws = _init_out( uas , out , ws )
+	w0     = ws( 0 , out.shape )
+	
+	np.square( uas , out = out )
+	np.square( vas , out = w0 )
+	np.add(  out , w0 , out = out )
+	np.sqrt( out ,      out = out )
+	
+	return out
+##}}}
+
+def relative_humidity( dptas , tas , out = None , ws = None ):##{{{
+	
+	## e(X) = 6.1078 * exp( 17.1 * ( X - 273.15 ) / ( 235 + X - 273.15 ) )
+	## hurs = e(dptas) / e(tas) * 100
+	out,ws = _init_out( dptas , out , ws )
+	w0     = ws( 0 , out.shape )
+	w1     = ws( 1 , out.shape )
+	
+	## Vapor pressure in out
+	np.subtract( dptas , 273.15 , out = out )
+	np.multiply( out   , 17.1   , out = out )
+	np.add(      dptas , 235    , out = w0  )
+	np.subtract( w0    , 273.15 , out = w0  )
+	np.divide(   out   , w0     , out = out )
+	np.exp(      out   ,          out = out )
+	np.multiply( out   , 6.1078 , out = out )
+	
+	## Saturated vapor pressure in w0
+	np.subtract( tas , 273.15 , out = w0 )
+	np.multiply( w0  , 17.1   , out = w0 )
+	np.add(      tas , 235    , out = w1 )
+	np.subtract( w1  , 273.15 , out = w1 )
+	np.divide(   w0  , w1     , out = w0 )
+	np.exp(      w0  ,          out = w0 )
+	np.multiply( w0  , 6.1078 , out = w0 )
+	
+	## Ratio
+	np.divide(   out , w0  , out = out )
+	np.multiply( out , 100 , out = out )
+	
+	return out
+##}}}
+
+def specific_humidity( dptas , ps , out = None , ws = None ):##{{{
+	
+	## E    = a1 * exp( a3 * ( dptas - T0 ) / ( dptas - a4 ) )
+	## huss = E * ( rdry / rvap ) / ( ps - ( E * ( 1 - rdry / rvap ) ) )
+	rdry   = 287.0597
+	rvap   = 461.5250
+	a1     = 611.21
+	a3     = 17.502
+	a4     = 32.19
+	T0     = 273.16
+	
+	out,ws = _init_out( dptas , out , ws )
+	w0     = ws( 0 , out.shape )
+	
+	np.subtract( dptas , T0 , out = out )
+	np.multiply( out   , a3 , out = out )
+	np.subtract( dptas , a4 , out = w0  )
+	np.divide(   out   , w0 , out = out )
+	np.exp(      out   ,      out = out )
+	np.multiply( out   , a1 , out = out )
+	
+	np.multiply( out , 1 - rdry / rvap , out = w0  )
+	np.subtract( ps  , w0              , out = w0  )
+	np.multiply( out , rdry / rvap     , out = out )
+	np.divide(   out , w0              , out = out )
+	
+	return out
+##}}}
+
+def upper_bound_tas( ta500 , zg500 , huss , orog , out = None , ws = None ):##{{{
+	
+	## Constant
+	Lv      = 2.5008 * 1e6 ## Latent heat of vaporization
+	cp      = 1004.7090    ## Specific heat of air at constant pressure
+	g       = 9.80665      ## Gravitational constant
+	epsilon = 0.0180153 / 0.028964
+	
+	out,ws = _init_out( ta500 , out , ws )
+	w0     = ws( 0 , out.shape )
+	
+	## Specific humidity saturation at 500hPa from Clausius-Clapeyron relation
+	np.divide(   1                , ta500           , out = out )
+	np.subtract( 1 / 273.15       , out             , out = out )
+	np.multiply( out              , Lv / 461.52     , out = out )
+	np.exp(      out              ,                   out = out )
+	np.multiply( out              , epsilon * 6.11  , out = out )
+	np.divide(   out              , 500             , out = out )
+	
+	## And compute upper bound
+	np.subtract( out   , huss    , out = out )
+	np.multiply( out   , Lv / cp , out = out )
+	np.add(      ta500 , out     , out = out )
+	np.subtract( zg500 , orog    , out = w0  )
+	np.multiply( w0    , g / cp  , out = w0  )
+	np.add(      out   , w0      , out = out )
+	
+	return out
+##}}}
+
+def _heat_index_polynomial( T , H , c , out , ws ):##{{{
+	
+	## c[0] + c[1] * T + c[2] * H + c[3] * T * H + c[4] * T**2 + c[5] * H**2
+	##      + c[6] * T**2 * H + c[7] * T * H**2 + c[8] * T**2 * H**2
+	T2 = ws( "T2" , out.shape )
+	H2 = ws( "H2" , out.shape )
+	w0 = ws( 0    , out.shape )
+	np.square( T , out = T2 )
+	np.square( H , out = H2 )
+	
+	np.multiply( T  , c[1] , out = out )
+	np.add(      out , c[0] , out = out )
+	
+	np.multiply( H  , c[2] , out = w0 )
+	np.add(      out , w0  , out = out )
+	
+	np.multiply( T  , c[3] , out = w0 )
+	np.multiply( w0 , H    , out = w0 )
+	np.add(      out , w0  , out = out )
+	
+	np.multiply( T2 , c[4] , out = w0 )
+	np.add(      out , w0  , out = out )
+	
+	np.multiply( H2 , c[5] , out = w0 )
+	np.add(      out , w0  , out = out )
+	
+	np.multiply( T2 , c[6] , out = w0 )
+	np.multiply( w0 , H    , out = w0 )
+	np.add(      out , w0  , out = out )
+	
+	np.multiply( T  , c[7] , out = w0 )
+	np.multiply( w0 , H2   , out = w0 )
+	np.add(      out , w0  , out = out )
+	
+	np.multiply( T2 , c[8] , out = w0 )
+	np.multiply( w0 , H2   , out = w0 )
+	np.add(      out , w0  , out = out )
+	
+	return out
+##}}}
+
+def heat_index_noaa( tas , hurs , out = None , ws = None ):##{{{
+	
+	out,ws = _init_out( tas , out , ws )
+	T  = ws( "T" , out.shape )
+	H  = ws( "H" , out.shape )
+	w0 = ws( 0   , out.shape )
+	w1 = ws( 1   , out.shape )
+	m0 = ws( "m0" , out.shape , bool )
+	m1 = ws( "m1" , out.shape , bool )
+	
+	## Variables, T in Fahrenheit
+	np.subtract( tas , 273.15 , out = T )
+	np.multiply( T   , 9.     , out = T )
+	np.divide(   T   , 5.     , out = T )
+	np.add(      T   , 32     , out = T )
+	np.round( hurs , 0 , out = H )
+	
+	## Heat Index
+	c = [-42.379,2.04901523,10.14333127,-0.22475541,-0.00683783,-0.05481717,0.00122874,0.00085282,-0.00000199]
+	_heat_index_polynomial( T , H , c , out , ws )
+	
+	## Correction for extremes, HIA1 = ( 13 - H ) /  4 * np.sqrt( ( 17 - np.abs( T - 95 ) ) / 17 )
+	np.less(    H  , 13. , out = m0 )
+	np.greater( T  , 80. , out = m1 )
+	np.logical_and( m0 , m1 , out = m0 )
+	np.less(    T  , 112 , out = m1 )
+	np.logical_and( m0 , m1 , out = m0 )
+	np.subtract( T   , 95  , out = w0 )
+	np.abs(      w0  ,       out = w0 )
+	np.subtract( 17  , w0  , out = w0 )
+	np.divide(   w0  , 17  , out = w0 )
+	with np.errstate( invalid = "ignore" ):
+		np.sqrt( w0 , out = w0 )
+	np.subtract( 13  , H   , out = w1 )
+	np.divide(   w1  , 4   , out = w1 )
+	np.multiply( w1  , w0  , out = w0 )
+	np.subtract( out , w0  , out = out , where = m0 )
+	
+	## Correction for extremes, HIA2 = ( H - 85 ) / 10 * ( ( 87 - T ) / 5 )
+	np.greater( H  , 85. , out = m0 )
+	np.greater( T  , 80. , out = m1 )
+	np.logical_and( m0 , m1 , out = m0 )
+	np.less(    T  , 87  , out = m1 )
+	np.logical_and( m0 , m1 , out = m0 )
+	np.subtract( H   , 85  , out = w0 )
+	np.divide(   w0  , 10  , out = w0 )
+	np.subtract( 87  , T   , out = w1 )
+	np.divide(   w1  , 5   , out = w1 )
+	np.multiply( w0  , w1  , out = w0 )
+	np.add(      out , w0  , out = out , where = m0 )
+	
+	## Low values, HIL = 0.5 * ( T + 61 + 1.2 * (T - 68) + 0.094 * H )
+	np.add(      T   , 61    , out = w0 )
+	np.subtract( T   , 68    , out = w1 )
+	np.multiply( w1  , 1.2   , out = w1 )
+	np.add(      w0  , w1    , out = w0 )
+	np.multiply( H   , 0.094 , out = w1 )
+	np.add(      w0  , w1    , out = w0 )
+	np.multiply( w0  , 0.5   , out = w0 )
+	np.greater( w0 , 80. , out = m0 )
+	np.logical_not( m0 , out = m0 )
+	np.copyto( out , w0 , where = m0 )
+	
+	## Back to Kelvin
+	np.subtract( out , 32.    , out = out )
+	np.multiply( out , 5.     , out = out )
+	np.divide(   out , 9.     , out = out )
+	np.add(      out , 273.15 , out = out )
+	
+	return out
+##}}}
+
+def heat_index_blazejczyk( tas , hurs , out = None , ws = None ):##{{{
+	
+	out,ws = _init_out( tas , out , ws )
+	T  = ws( "T"  , out.shape )
+	H  = ws( "H"  , out.shape )
+	m0 = ws( "m0" , out.shape , bool )
+	
+	## Variables, T in Celcius
+	np.subtract( tas , 273.15 , out = T )
+	np.round( hurs , 0 , out = H )
+	
+	## Heat Index, with the constant 273.15 added first
+	c = [273.15 + -8.784695,1.61139411,2.338549,-0.14611605,-1.2308094e-2,-1.6424828e-2,2.211732e-3,7.2546e-4,-3.582e-6]
+	_heat_index_polynomial( T , H , c , out , ws )
+	
+	## Only defined for T > 20
+	np.greater( T , 20 , out = m0 )
+	np.logical_not( m0 , out = m0 )
+	np.copyto( out , np.nan , where = m0 )
+	
+	return out
+##}}}
+
+def blockwise( kernel , inputs , ntime , block = TIME_BLOCK , out = None , ws = None ):##{{{
+	
+	## Inputs are array-like (numpy or xarray), with the time as first axis.
+	## Inputs with less dimensions than the output (e.g. orography) are
+	## constant in time and are passed as is to the kernel.
+	shape = None
+	for x in inputs:
+		if shape is None or len(x.shape) > len(shape):
+			shape = (ntime,) + tuple(x.shape[1:])
+	static = [ len(x.shape) < len(shape) for x in inputs ]
+	inputs = [ np.asarray( x , dtype = np.float32 ) if s else x for x,s in zip(inputs,static) ]
+	
+	if out is None:
+		out = np.empty( shape , dtype = np.float32 )
+	if ws is None:
+		ws = Workspace()
+	
+	for i0 in range(0,ntime,block):
+		i1  = min( i0 + block , ntime )
+		xin = [ x if s else np.asarray( x[i0:i1] , dtype = np.float32 ) for x,s in zip(inputs,static) ]
+		kernel( *xin , out = out[i0:i1] , ws = ws )
+	
+	return out
+##}}}
+
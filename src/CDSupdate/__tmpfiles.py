@@ -0,0 +1,279 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import json
+import logging
+
+import numpy  as np
+
+from .__lazy import LazyModule
+
+xr      = LazyModule("xarray")
+netCDF4 = LazyModule("netCDF4")
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+time_units    = "hours since 1900-01-01 00:00"
+time_calendar = "standard"
+time_origin   = np.datetime64("1900-01-01T00:00")
+
+## Formats of the intermediate files: 'netcdf', 'npy' for raw float32 data
+## ('.dat', memory-mappable) with a JSON sidecar for the coordinates, or
+## 'memory' where nothing is written: the xr.Dataset are kept in memory_tmp,
+## by path (only the processes of the run see them)
+tmp_formats = ["netcdf","npy","memory"]
+tmp_ext     = { "netcdf" : ".nc" , "npy" : ".dat" , "memory" : ".mem" }
+memory_tmp  = {}
+
+
+###############
+## Functions ##
+###############
+
+def time2num( time ):##{{{
+	return ( np.asarray(time).astype("datetime64[ns]") - time_origin ) / np.timedelta64(1,"h")
+##}}}
+
+def time2str( time , freq ):##{{{
+	if freq == "hr":
+		return str(np.datetime64(time,"h")).replace("-","").replace("T","")
+	return str(np.datetime64(time,"D")).replace("-","")
+##}}}
+
+def list_tmp( ipath ):##{{{
+	
+	## Sorted intermediate files of ipath, without the sidecars and the files
+	## currently written, and the files of the memory format
+	ifiles = []
+	if os.path.isdir(ipath):
+		ifiles = [ f for f in os.listdir(ipath) if not f.startswith(".") and os.path.splitext(f)[1] in tmp_ext.values() ]
+	ifiles = ifiles + [ os.path.basename(p) for p in list(memory_tmp) if os.path.dirname(p) == ipath ]
+	ifiles.sort()
+	
+	return ifiles
+##}}}
+
+def tmp_isfile( ifile ):##{{{
+	return ifile in memory_tmp or os.path.isfile(ifile)
+##}}}
+
+def save_tmp( idata , ofile , fmt = "netcdf" ):##{{{
+	
+	## Save the xr.Dataset idata (without time axis, e.g. the orography) as
+	## the intermediate file ofile
+	if fmt == "memory":
+		memory_tmp[ofile] = idata
+		return
+	os.makedirs( os.path.dirname(ofile) , exist_ok = True )
+	idata.to_netcdf(ofile)
+##}}}
+
+def release_tmp( tmp , year = None ):##{{{
+	
+	## Free the files of the memory format of the tmp directory tmp, only the
+	## files of the year if given (the files without time axis are kept)
+	for p in [ p for p in list(memory_tmp) if p.startswith( tmp + os.path.sep ) ]:
+		if year is not None and not os.path.basename(p).split("_")[-1][:4] == str(year):
+			continue
+		memory_tmp.pop( p , None )
+##}}}
+
+def remove_year( tmp , year ):##{{{
+	
+	## Remove the raw and intermediate files of the year from the tmp
+	## directory tmp (once merged), the files without time axis are kept
+	release_tmp( tmp , year )
+	for stage in ["ERA5-BRUT","ERA5-AMIP"]:
+		for dpath,_,fnames in os.walk( os.path.join( tmp , stage ) ):
+			for f in fnames:
+				if not f.startswith(".") and f.split("_")[-1][:4] == str(year):
+					os.remove( os.path.join( dpath , f ) )
+##}}}
+
+def open_tmp( ifile ):##{{{
+	
+	## Open an intermediate file as a xr.Dataset. The npy format is memory
+	## mapped, so the pages are shared through the OS page cache.
+	if ifile in memory_tmp:
+		return memory_tmp[ifile]
+	if ifile.endswith(".nc"):
+		return xr.open_dataset(ifile)
+	
+	with open( os.path.splitext(ifile)[0] + ".json" , "r" ) as f:
+		meta = json.load(f)
+	X    = np.memmap( ifile , dtype = meta["dtype"] , mode = "r" , shape = tuple(meta["shape"]) )
+	time = time_origin + np.asarray( meta["time"] , dtype = "int64" ) * np.timedelta64(1,"h")
+	
+	return xr.Dataset( { meta["cvar"] : ( ["time","lat","lon"] , X ) } , coords = { "time" : time.astype("datetime64[ns]") , "lat" : meta["lat"] , "lon" : meta["lon"] } )
+##}}}
+
+
+#############
+## Classes ##
+#############
+
+class TmpWriter:##{{{
+	
+	## Intermediate file of the TMP directory, written by time blocks. The file
+	## is renamed 'ERA5-AMIP_{cvar}_{freq}_{area}_{t0}-{t1}.nc' when closed
+	## ('.dat' + '.json' for the npy format).
+	
+	def __init__( self , tmp , cvar , freq , area_name , lat , lon , fmt = "netcdf" ):##{{{
+		
+		self.cvar      = cvar
+		self.freq      = freq
+		self.area_name = area_name
+		self.fmt       = fmt
+		self.opath     = os.path.join( tmp , "ERA5-AMIP" , freq , cvar )
+		self.t0        = None
+		self.t1        = None
+		self.size      = 0
+		
+		## In memory, the blocks are copied
+		if fmt == "memory":
+			self._lat    = np.asarray( lat , dtype = np.float64 )
+			self._lon    = np.asarray( lon , dtype = np.float64 )
+			self._time   = []
+			self._blocks = []
+			return
+		
+		if not os.path.isdir(self.opath):
+			os.makedirs(self.opath)
+		self._ofile = os.path.join( self.opath , f".ERA5-AMIP_{cvar}_{freq}_{area_name}{tmp_ext[fmt]}.part" )
+		
+		## Raw data, the coordinates are written in the sidecar when closed
+		if fmt == "npy":
+			self._lat  = [ float(x) for x in lat ]
+			self._lon  = [ float(x) for x in lon ]
+			self._time = []
+			self._ncf  = open( self._ofile , "wb" )
+			return
+		
+		self._ncf   = netCDF4.Dataset( self._ofile , mode = "w" )
+		self._ncf.createDimension( "time" , None     )
+		self._ncf.createDimension( "lat"  , len(lat) )
+		self._ncf.createDimension( "lon"  , len(lon) )
+		
+		ncv_time = self._ncf.createVariable( "time" , "double" , ("time",) )
+		ncv_lat  = self._ncf.createVariable( "lat"  , "double" , ("lat",)  )
+		ncv_lon  = self._ncf.createVariable( "lon"  , "double" , ("lon",)  )
+		ncv_time.setncattr( "units"    , time_units    )
+		ncv_time.setncattr( "calendar" , time_calendar )
+		ncv_lat[:] = lat
+		ncv_lon[:] = lon
+		
+		self._ncv = self._ncf.createVariable( cvar , "float32" , ("time","lat","lon") , fill_value = np.nan )
+	##}}}
+	
+	def append( self , time , X ):##{{{
+		
+		i0 = self.size
+		i1 = i0 + len(time)
+		if self.fmt == "memory":
+			self._time.append( np.asarray(time).astype("datetime64[ns]") )
+			self._blocks.append( np.array( X , dtype = np.float32 ) )
+		elif self.fmt == "npy":
+			self._time.append( np.round(time2num(time)).astype("int64") )
+			self._ncf.write( np.ascontiguousarray( X , dtype = np.float32 ).tobytes() )
+		else:
+			self._ncf.variables["time"][i0:i1] = time2num(time)
+			self._ncv[i0:i1,:,:] = X
+		
+		if self.t0 is None:
+			self.t0 = time[0]
+		self.t1   = time[-1]
+		self.size = i1
+	##}}}
+	
+	def close(self):##{{{
+		
+		if not self.fmt == "memory":
+			self._ncf.close()
+		if self.size == 0:
+			if not self.fmt == "memory":
+				os.remove(self._ofile)
+			return None
+		
+		t0    = time2str( self.t0 , self.freq )
+		t1    = time2str( self.t1 , self.freq )
+		ofile = f"ERA5-AMIP_{self.cvar}_{self.freq}_{self.area_name}_{t0}-{t1}{tmp_ext[self.fmt]}"
+		
+		## Kept in memory, the blocks are concatenated
+		if self.fmt == "memory":
+			X = np.concatenate(self._blocks) if len(self._blocks) > 1 else self._blocks[0]
+			self._blocks = []
+			memory_tmp[os.path.join( self.opath , ofile )] = xr.Dataset( { self.cvar : ( ["time","lat","lon"] , X ) } , coords = { "time" : np.concatenate(self._time) , "lat" : self._lat , "lon" : self._lon } )
+			return os.path.join( self.opath , ofile )
+		
+		## Sidecar first, the data file is visible only when complete
+		if self.fmt == "npy":
+			meta = { "cvar"  : self.cvar,
+			         "dtype" : "float32",
+			         "shape" : [self.size,len(self._lat),len(self._lon)],
+			         "time"  : np.concatenate(self._time).tolist(),
+			         "units" : time_units,
+			         "lat"   : self._lat,
+			         "lon"   : self._lon
+			        }
+			with open( os.path.join( self.opath , os.path.splitext(ofile)[0] + ".json" ) , "w" ) as f:
+				json.dump( meta , f )
+		
+		os.replace( self._ofile , os.path.join( self.opath , ofile ) )
+		logger.info( f" * Save 'TMP/ERA5-AMIP/{self.freq}/{self.cvar}/{ofile}'" )
+		
+		return os.path.join( self.opath , ofile )
+	##}}}
+	
+	def __enter__(self):##{{{
+		return self
+	##}}}
+	
+	def abort(self):##{{{
+		if self.fmt == "memory":
+			self._blocks = []
+			return
+		self._ncf.close()
+		if os.path.isfile(self._ofile):
+			os.remove(self._ofile)
+	##}}}
+	
+	def __exit__( self , exc_type , exc_value , traceback ):##{{{
+		if exc_type is None:
+			self.close()
+		else:
+			self.abort()
+	##}}}
+	
+##}}}
+
@@ -0,0 +1,238 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import os
+import json
+import signal
+import logging
+import threading
+import datetime as dt
+
+
+#############
+## Imports ##
+#############
+
+from .__CDSUParams import CDSUParams
+from .__CDSUParams import cdsuParams
+from .__pipeline import run_pipeline
+from .__atomic import atomic_target
+from .__remote import remote_fetch
+from .__catalog import catalog_file
+from .__catalog import open_catalog
+from .__catalog import catalog_last
+from .__io import cds_end_date
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+## Lag (days) of ERA5T behind real time, used if the last day of a dataset
+## can not be asked to the CDS
+era5t_lag = 5
+
+
+#############
+## Classes ##
+#############
+
+class WatchStatus:##{{{
+	
+	## Status of the watch, rewritten (atomically) in a JSON file at each
+	## change, for the monitoring: state is 'checking', 'updating', 'idle',
+	## 'error' or 'stopped', failures is the number of consecutive failed
+	## cycles, available the last day in the CDS, last_day the last day of
+	## the output files.
+	
+	def __init__( self , path , interval ):##{{{
+		self.path   = path
+		self.status = { "pid"         : os.getpid(),
+		                "state"       : "starting",
+		                "started"     : _now(),
+		                "interval"    : interval,
+		                "cycles"      : 0,
+		                "updates"     : 0,
+		                "failures"    : 0,
+		                "last_check"  : None,
+		                "available"   : None,
+		                "last_day"    : None,
+		                "last_update" : None,
+		                "last_period" : None,
+		                "last_error"  : None,
+		                "next_check"  : None }
+		os.makedirs( os.path.dirname(path) , exist_ok = True )
+		self.write()
+	##}}}
+	
+	def __getitem__( self , key ):##{{{
+		return self.status[key]
+	##}}}
+	
+	def update( self , **kwargs ):##{{{
+		self.status.update(kwargs)
+		self.write()
+	##}}}
+	
+	def write(self):##{{{
+		tfile = atomic_target(self.path)
+		with open( tfile , "w" ) as f:
+			json.dump( self.status , f , indent = 1 )
+		os.replace( tfile , self.path )
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def _now( delay = 0 ):##{{{
+	t = dt.datetime.now(dt.UTC) + dt.timedelta( seconds = delay )
+	return str(t)[:19].replace(" ","T") + "Z"
+##}}}
+
+def status_file():##{{{
+	
+	## Default status file of the watch, next to the catalog, or in the tmp
+	## directory for an object store
+	name = f"watch_{cdsuParams.area_name}.json"
+	if cdsuParams.output_url is not None:
+		return os.path.join( cdsuParams.tmp_base , name )
+	return os.path.join( cdsuParams.output_dir , "ERA5" , name )
+##}}}
+
+def available_end():##{{{
+	
+	## Last day available in the CDS for all the variables, asked to the CDS,
+	## or estimated with the lag of ERA5T
+	names = sorted(set( "reanalysis-era5-single-levels" if level == "single" else "reanalysis-era5-pressure-levels" for level in cdsuParams.cvars_lev ))
+	ends  = [ cds_end_date(name) for name in names ]
+	if any( end is None for end in ends ):
+		ends = [ end for end in ends if end is not None ] + [ dt.datetime.now(dt.UTC).date() - dt.timedelta( days = era5t_lag ) ]
+	
+	return min(ends)
+##}}}
+
+def last_day():##{{{
+	
+	## Last day of the output files, the oldest of the variables, None if a
+	## variable has no file. The catalog of an object store is fetched again,
+	## it is changed by each update.
+	cfile = catalog_file()
+	if cdsuParams.output_url is not None:
+		if os.path.isfile(cfile):
+			os.remove(cfile)
+		remote_fetch(cfile)
+	
+	con   = open_catalog()
+	lasts = [ catalog_last( con , cdsuParams.area_name , "day" , cvar ) for cvar in cdsuParams.cvars if not cvar == "orog" ]
+	con.close()
+	if any( t is None for t in lasts ):
+		return None
+	
+	return dt.date.fromisoformat( str(min(lasts))[:10] )
+##}}}
+
+def _update( argv , t0 , t1 ):##{{{
+	
+	## Update of the period t0 / t1, the parameters of the watch with this
+	## period, in their own tmp directory
+	params = CDSUParams.from_user_input( *argv , "--period" , f"{t0}/{t1}" , "--tmp" , cdsuParams.tmp )
+	try:
+		params.build_CDSAPIParams()
+		run_pipeline( params = params )
+	finally:
+		params.tmp_gen.cleanup()
+##}}}
+
+def run_watch( argv ):##{{{
+	
+	## Resident mode: every cdsuParams.watch seconds, compare the last day of
+	## the output files with the last day available in the CDS, and update
+	## only the new days. The process (imports, metadata, grids, clients of
+	## the CDS) is kept between the updates. argv are the arguments of the
+	## command line, the start of --period is the first day of the data.
+	interval = cdsuParams.watch
+	t0       = cdsuParams.period[0].date()
+	if all( cvar == "orog" for cvar in cdsuParams.cvars ):
+		raise Exception( "Only the orography is requested, nothing to watch" )
+	
+	path   = cdsuParams.watch_status if cdsuParams.watch_status is not None else status_file()
+	status = WatchStatus( path , interval )
+	logger.info( f"Watch: check the CDS every {interval:g}s, status in '{path}'" )
+	
+	## SIGTERM and SIGINT stop the watch after the current update
+	stop = threading.Event()
+	def halt( signum , frame ):
+		logger.info( f"Watch: signal {signum}, stop after the current cycle" )
+		stop.set()
+	handlers = {}
+	try:
+		for sig in [signal.SIGTERM,signal.SIGINT]:
+			handlers[sig] = signal.signal( sig , halt )
+	except ValueError:
+		## Not in the main thread
+		pass
+	
+	try:
+		while not stop.is_set():
+			status.update( state = "checking" , last_check = _now() , cycles = status["cycles"] + 1 )
+			try:
+				end   = available_end()
+				last  = last_day()
+				start = t0 if last is None else max( t0 , last + dt.timedelta( days = 1 ) )
+				status.update( available = str(end) , last_day = None if last is None else str(last) )
+				
+				## Only if new days are in the CDS. The downloads of days not
+				## yet available fail, the next cycle tries again.
+				if start <= end:
+					logger.info( f"Watch: update {start} / {end}" )
+					status.update( state = "updating" , last_period = f"{start}/{end}" )
+					_update( argv , start , end )
+					new = last_day()
+					if not new == last:
+						status.update( last_day = None if new is None else str(new) , last_update = _now() , updates = status["updates"] + 1 )
+				else:
+					logger.info( f"Watch: nothing new (output {last}, CDS {end})" )
+				status.update( state = "idle" , failures = 0 )
+			except Exception as e:
+				logger.error( f"Watch: cycle failed: {e}" )
+				status.update( state = "error" , failures = status["failures"] + 1 , last_error = str(e) )
+			
+			status.update( next_check = _now(interval) )
+			stop.wait(interval)
+	finally:
+		for sig in handlers:
+			signal.signal( sig , handlers[sig] )
+		status.update( state = "stopped" , next_check = None )
+##}}}
+
@@ -0,0 +1,181 @@
+
+## Copyright(c) 2025 Yoann Robin
+## 
+## This file is part of CDSupdate.
+## 
+## CDSupdate is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+## 
+## CDSupdate is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+## 
+## You should have received a copy of the GNU General Public License
+## along with CDSupdate.  If not, see <https://www.gnu.org/licenses/>.
+
+##############
+## Packages ##
+##############
+
+import logging
+import functools
+import threading
+import multiprocessing
+import concurrent.futures
+
+
+#############
+## Imports ##
+#############
+
+from .__CDSUParams import CDSUParams
+from .__CDSUParams import cdsuParams
+from .__CDSUParams import use_params
+
+
+##################
+## Init logging ##
+##################
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+###############
+## Variables ##
+###############
+
+## HDF5 is not thread safe: the stages reading or writing netCDF files hold
+## this lock, so the runs done concurrently in threads of one process are
+## serialized on these stages (their downloads still run concurrently)
+hdf5_lock = threading.RLock()
+
+
+#############
+## Classes ##
+#############
+
+class _RecordsHandler(logging.Handler):##{{{
+	
+	## Keep the log records of a unit run in a worker, to be logged in order by
+	## the main process
+	
+	def __init__(self):##{{{
+		super().__init__()
+		self.records = []
+	##}}}
+	
+	def emit( self , record ):##{{{
+		record.msg      = record.getMessage()
+		record.args     = None
+		record.exc_info = None
+		self.records.append(record)
+	##}}}
+	
+##}}}
+
+
+###############
+## Functions ##
+###############
+
+def hdf5_serialized( func ):##{{{
+	
+	## Decorator of the stages, func is called with hdf5_lock held
+	@functools.wraps(func)
+	def wrapper( *args , **kwargs ):
+		with hdf5_lock:
+			return func( *args , **kwargs )
+	
+	return wrapper
+##}}}
+
+def _state():##{{{
+	
+	## Copy of the parameters of the run, sent with each unit: a pool can be
+	## shared by several runs (see CDSupdate.__jobs)
+	skip = ["tmp_gen","cvarsParams","error"]
+	return { key : cdsuParams[key] for key in cdsuParams.keys() if key not in skip }
+##}}}
+
+def _init_worker( level ):##{{{
+	logging.getLogger("CDSupdate").setLevel(level)
+##}}}
+
+def _run_in_worker( func , args , state ):##{{{
+	
+	## Parameters of the run of the unit
+	params = CDSUParams()
+	for key in state:
+		setattr( params , key , state[key] )
+	
+	## The records are only kept, and logged by the main process
+	handler = _RecordsHandler()
+	plogger = logging.getLogger("CDSupdate")
+	plogger.addHandler(handler)
+	plogger.propagate = False
+	error   = None
+	try:
+		with use_params(params):
+			func(*args)
+	except Exception as e:
+		error = f"{type(e).__name__}: {e}"
+	finally:
+		plogger.removeHandler(handler)
+		plogger.propagate = True
+	
+	return handler.records,error
+##}}}
+
+def _run_in_process( func , args ):##{{{
+	
+	## Same as _run_in_worker, the records are logged directly
+	try:
+		func(*args)
+	except Exception as e:
+		return [],f"{type(e).__name__}: {e}"
+	
+	return [],None
+##}}}
+
+def make_pool( max_workers ):##{{{
+	
+	## Pool of processes (HDF5 is not thread safe), None if only one worker.
+	## The workers are spawned, the parameters of the run are sent with each
+	## unit (see run_units).
+	if max_workers < 2:
+		return None
+	
+	level = logging.getLogger("CDSupdate").getEffectiveLevel()
+	
+	return concurrent.futures.ProcessPoolExecutor( max_workers = max_workers , mp_context = multiprocessing.get_context("spawn") , initializer = _init_worker , initargs = (level,) )
+##}}}
+
+def run_units( func , units , pool = None ):##{{{
+	
+	## Run func(*unit) for all units, in the pool if given. The log records are
+	## logged in the order of the units, and a failed unit does not stop the
+	## others: the errors are raised together at the end.
+	
+	if pool is None:
+		results = ( _run_in_process( func , unit ) for unit in units )
+	else:
+		state   = _state()
+		futures = [ pool.submit( _run_in_worker , func , unit , state ) for unit in units ]
+		results = ( f.result() for f in futures )
+	
+	errors = []
+	for unit,(records,error) in zip(units,results):
+		for record in records:
+			logging.getLogger(record.name).handle(record)
+		if error is not None:
+			logger.error( f" * {'/'.join( str(u) for u in unit[:3] if u is not None )} failed: {error}" )
+			errors.append(error)
+	
+	if len(errors) > 0:
+		raise Exception( f"{len(errors)} / {len(units)} units failed" )
+##}}}
+